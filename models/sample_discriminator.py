@@ -1,61 +1,408 @@
+# Software model of src/rtl/receive_chain/sample_discriminator/sample_discriminator.sv
+#
+# Predicts which words (groups of 8 parallel samples, one per 512 MHz ADC clock
+# cycle) are saved by the sample discriminator and which timestamps it emits,
+# given the same settings that DAQOverlay.set_discriminator_thresholds,
+# set_discriminator_delays, set_discriminator_event_sources and
+# bypass_discriminators encode.
+#
+# The input is assumed to be a continuous stream (valid on every cycle) that
+# starts after the discriminator state was reset (i.e. after arming a capture).
+# Cycles and timestamps are counted from the cycle of the first input word.
+#
+# The comparators and delay lines are evaluated with numpy over the whole
+# stream; only the state machine is stepped, and only on cycles where one of
+# its inputs fires. discriminate_channel_loop is a literal cycle-by-cycle
+# translation of the RTL registers and is used as the reference in
+# benchmark_discriminator. Run this file to plot an example and benchmark.
+
+import time
 import numpy as np
-import matplotlib.pyplot as plt
 
-N = 1024
 P_SAMP = 8
+NUM_CHANNELS = 8
+DISC_LATENCY = 2
+MAX_DELAY_CYCLES = 64
+
+DISABLED, PRECAPTURE, CAPTURE, POSTCAPTURE = range(4)
+
+def _signed(thresholds):
+    """Thresholds are sent as 16-bit words but compared as signed samples"""
+    return np.asarray(thresholds, dtype=np.int64).astype(np.uint16).view(np.int16)
+
+def _words(samples: np.ndarray):
+    """View samples (16-bit, signed or raw unsigned) as (num_words, P_SAMP) signed words"""
+    samples = np.asarray(samples)
+    if samples.dtype == np.uint16:
+        samples = samples.view(np.int16)
+    return samples.reshape(-1, P_SAMP)
+
+def _shift(x: np.ndarray, delay: int):
+    """x delayed by delay cycles, zero-filled"""
+    y = np.zeros_like(x)
+    if delay < len(x):
+        y[delay:] = x[:len(x)-delay]
+    return y
+
+def _pulse_delay(start: np.ndarray, delay: int):
+    """Output of pulse_delay with delay-1 loaded into its counter
+
+    A pulse at cycle p comes out at p+delay, unless another pulse arrives in
+    between, which restarts the counter
+    """
+    cycles = np.arange(len(start))
+    last_start = np.maximum.accumulate(np.where(start, cycles, -1))
+    delayed = _shift(start, delay)
+    return delayed & (last_start == cycles - delay)
+
+def _next_true(x: np.ndarray):
+    """For each cycle, the first cycle at or after it where x is set (len(x) if none)"""
+    cycles = np.where(x, np.arange(len(x)), len(x))
+    return np.minimum.accumulate(cycles[::-1])[::-1]
+
+def _run_fsm(start, start_d, stop, valid_d3, zero_total, digital):
+    """Step the state machine from one state change to the next
+
+    Each state only reacts to some of its inputs, so the cycle of its next transition
+    is looked up directly instead of visiting every cycle where some input fires.
+
+    Returns:
+        changes (np.ndarray): cycles at which the state changes, starting with 0
+        states (np.ndarray): state from each cycle in changes on
+    """
+    num_cycles = len(start)
+    next_start = _next_true(start)
+    next_start_d = _next_true(start_d)
+    next_start_or_stop = _next_true(start | stop)
+    changes = [0]
+    states = [DISABLED]
+    state = DISABLED
+    cycle = 0
+    while True:
+        if state == DISABLED:
+            cycle = next_start[cycle] if cycle < num_cycles else num_cycles
+        elif state == PRECAPTURE:
+            cycle = next_start_d[cycle] if cycle < num_cycles else num_cycles
+        elif state == CAPTURE and not(zero_total and digital):
+            cycle = next_start_or_stop[cycle] if cycle < num_cycles else num_cycles
+        # POSTCAPTURE and CAPTURE with a zero-delay digital trigger can change state
+        # without an input event, so they are evaluated on the next cycle
+        if cycle >= num_cycles:
+            break
+        if state == DISABLED:
+            state = CAPTURE if zero_total else PRECAPTURE
+        elif state == PRECAPTURE:
+            state = POSTCAPTURE if digital else CAPTURE
+        elif state == CAPTURE:
+            if start[cycle]:
+                state = CAPTURE if zero_total else PRECAPTURE
+            elif (zero_total and digital and valid_d3[cycle]) or stop[cycle]:
+                state = DISABLED
+        else:
+            state = DISABLED
+        if state != states[-1]:
+            changes.append(cycle + 1)
+            states.append(state)
+        cycle += 1
+    return np.array(changes), np.array(states)
+
+def discriminate_channel(any_high: np.ndarray,
+                         all_low: np.ndarray,
+                         start_delay: int,
+                         stop_delay: int,
+                         digital_trigger: np.ndarray = None,
+                         digital_delay: int = 0,
+                         bypass: bool = False):
+    """Model one discriminator channel
+
+    Arguments:
+        any_high (np.ndarray): for each input word of the trigger source channel, whether
+                                any sample was above its high threshold
+        all_low (np.ndarray): for each input word of the trigger source channel, whether
+                                all samples were at or below its low threshold
+        start_delay (int): words to save before each event
+        stop_delay (int): words to save after each event
+        digital_trigger (np.ndarray): digital trigger for each input word; if given, the
+                                        channel triggers on it instead of the analog source
+        digital_delay (int): cycles to delay the digital trigger by
+        bypass (bool): save every word
+
+    Returns:
+        keep (np.ndarray): for each input word, whether it is saved
+        timestamps (tuple[np.ndarray]): (cycle, sample_index) of each timestamp, where
+                                        sample_index is the number of words saved before it
+    """
+    num_words = len(any_high)
+    if bypass:
+        return np.ones(num_words, dtype=bool), (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    num_cycles = num_words + start_delay + DISC_LATENCY + 2
+    digital = digital_trigger is not None
+    pad = lambda x: np.concatenate((np.asarray(x, dtype=bool), np.zeros(num_cycles - num_words, dtype=bool)))
+    if digital:
+        start = _shift(pad(digital_trigger), 2 + digital_delay)
+        stop = np.zeros(num_cycles, dtype=bool)
+    else:
+        start = _shift(pad(any_high), 2)
+        stop = _shift(pad(all_low), 2)
+    total_delay = start_delay + stop_delay
+    zero_total = total_delay == 0
+    if zero_total:
+        start_d = np.zeros(num_cycles, dtype=bool)
+    else:
+        start_d = _pulse_delay(start, total_delay)
+        stop = _shift(stop, total_delay)
+    valid_d3 = _shift(pad(np.ones(num_words, dtype=bool)), 3)
+    changes, states = _run_fsm(start, start_d, stop, valid_d3, zero_total, digital)
+    active = np.repeat(states != DISABLED, np.diff(np.append(changes, num_cycles)))
+    keep = active[start_delay + DISC_LATENCY + 1:][:num_words]
+    # timestamp emitted two cycles after active rises, with the time and sample index of
+    # the cycle after the rise
+    rise = np.flatnonzero(active[1:] & ~active[:-1]) + 1
+    if len(active) > 0 and active[0]:
+        rise = np.insert(rise, 0, 0)
+    saved = np.concatenate(([0], np.cumsum(keep)))
+    index = saved[np.clip(rise - start_delay - DISC_LATENCY - 1, 0, num_words)]
+    return keep, (rise + 1, index)
+
+def discriminate_channel_loop(any_high: np.ndarray,
+                              all_low: np.ndarray,
+                              start_delay: int,
+                              stop_delay: int,
+                              digital_trigger: np.ndarray = None,
+                              digital_delay: int = 0,
+                              bypass: bool = False):
+    """Reference for discriminate_channel, simulating every register on every cycle"""
+    num_words = len(any_high)
+    if bypass:
+        return np.ones(num_words, dtype=bool), (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    pipe_delay = start_delay + DISC_LATENCY
+    total_delay = start_delay + stop_delay
+    digital = digital_trigger is not None
+    num_cycles = num_words + pipe_delay + 2
+    keep = np.zeros(num_words, dtype=bool)
+    cycles, indices = [], []
+    # registers
+    any_high_q = all_low_q = fsm_start = fsm_stop = digital_d = False
+    digital_pipe = [False] * (MAX_DELAY_CYCLES + 1)
+    stop_pipe = [False] * (2 * MAX_DELAY_CYCLES)
+    valid_pipe = [False] * (MAX_DELAY_CYCLES + DISC_LATENCY)
+    index_pipe = [0] * (MAX_DELAY_CYCLES + DISC_LATENCY)
+    counter, pd_active = 0, False
+    state = DISABLED
+    active_d = False
+    samples_valid, samples_index = False, 0
+    timestamp_pending = False
+    timestamp_valid, timestamp_data = False, (0, 0)
+    sample_index = 0
+    for cycle in range(num_cycles + 2):
+        valid = cycle < num_words
+        trigger = valid and digital and bool(digital_trigger[cycle])
+        # combinational
+        active = state != DISABLED
+        done = counter == 0
+        start_d = done and pd_active and not(fsm_start)
+        stop_d = stop_pipe[total_delay - 1] if total_delay > 0 else False
+        # outputs
+        if samples_valid and samples_index < num_words:
+            keep[samples_index] = True
+        if timestamp_valid:
+            cycles.append(timestamp_data[0])
+            indices.append(timestamp_data[1])
+        # next state
+        next_timestamp_pending = active and not(active_d)
+        next_timestamp_valid = timestamp_pending
+        next_timestamp_data = (cycle, sample_index)
+        next_sample_index = sample_index + samples_valid
+        next_samples_valid = valid_pipe[pipe_delay] and active
+        next_samples_index = index_pipe[pipe_delay]
+        if digital:
+            next_fsm_start = digital_d
+            next_fsm_stop = False
+            next_digital_d = trigger if digital_delay == 0 else digital_pipe[digital_delay - 1]
+        else:
+            next_fsm_start = any_high_q
+            next_fsm_stop = all_low_q
+            next_digital_d = False
+        next_any_high = valid and bool(any_high[cycle])
+        next_all_low = valid and bool(all_low[cycle])
+        if fsm_start:
+            next_counter, next_pd_active = (total_delay - 1) % (2 * MAX_DELAY_CYCLES), True
+        elif not(done):
+            next_counter, next_pd_active = counter - 1, pd_active
+        else:
+            next_counter, next_pd_active = counter, False
+        next_state = state
+        if state == DISABLED:
+            if fsm_start:
+                next_state = CAPTURE if total_delay == 0 else PRECAPTURE
+        elif state == PRECAPTURE:
+            if start_d:
+                next_state = POSTCAPTURE if digital else CAPTURE
+        elif state == CAPTURE:
+            if fsm_start:
+                next_state = CAPTURE if total_delay == 0 else PRECAPTURE
+            elif total_delay == 0:
+                if digital and valid_pipe[2]:
+                    next_state = DISABLED
+                if fsm_stop:
+                    next_state = DISABLED
+            elif stop_d:
+                next_state = DISABLED
+        else:
+            next_state = DISABLED
+        # clock edge
+        digital_pipe = [trigger] + digital_pipe[:-1]
+        stop_pipe = [fsm_stop] + stop_pipe[:-1]
+        valid_pipe = [valid] + valid_pipe[:-1]
+        index_pipe = [cycle] + index_pipe[:-1]
+        any_high_q, all_low_q = next_any_high, next_all_low
+        fsm_start, fsm_stop, digital_d = next_fsm_start, next_fsm_stop, next_digital_d
+        counter, pd_active = next_counter, next_pd_active
+        state = next_state
+        active_d = active
+        samples_valid, samples_index = next_samples_valid, next_samples_index
+        timestamp_pending = next_timestamp_pending
+        timestamp_valid, timestamp_data = next_timestamp_valid, next_timestamp_data
+        sample_index = next_sample_index
+    cycles, indices = np.array(cycles, dtype=np.int64), np.array(indices, dtype=np.int64)
+    # same window of timestamps as discriminate_channel
+    return keep, (cycles[cycles <= num_cycles], indices[cycles <= num_cycles])
+
+class SampleDiscriminator:
+    """Model of all channels of the sample discriminator
+
+    Settings use the same encoding as the DAQOverlay setters: thresholds are 16-bit
+    words (two's complement for negative thresholds), delays are in words, sources
+    0-7 select the analog trigger of an ADC channel and 8-15 a digital trigger from
+    an AWG channel, and bit n of bypass_mask bypasses channel n.
+    """
+    def __init__(self,
+                 low_thresholds: list[int],
+                 high_thresholds: list[int],
+                 start_delays: list[int],
+                 stop_delays: list[int],
+                 digital_delays: list[int] = None,
+                 sources: list[int] = None,
+                 bypass_mask: int = 0):
+        self.low_thresholds = _signed(low_thresholds)
+        self.high_thresholds = _signed(high_thresholds)
+        self.start_delays = list(start_delays)
+        self.stop_delays = list(stop_delays)
+        self.digital_delays = [0] * NUM_CHANNELS if digital_delays is None else list(digital_delays)
+        self.sources = list(range(NUM_CHANNELS)) if sources is None else list(sources)
+        self.bypass_mask = bypass_mask
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """Create a model from the settings returned by DAQOverlay.get_config()"""
+        thresholds = config['discriminator_thresholds']
+        delays = config['discriminator_delays']
+        sources = config.get('discriminator_event_sources', {}).get('sources')
+        bypass_mask = config.get('discriminator_bypass', {}).get('bypass_mask', 0)
+        return cls(thresholds['low_thresholds'], thresholds['high_thresholds'],
+                   delays['start_delays'], delays['stop_delays'], delays['digital_delays'],
+                   sources, bypass_mask)
+
+    def comparators(self, samples: list[np.ndarray]):
+        """Evaluate the analog triggers of every channel
+
+        Arguments:
+            samples (list[np.ndarray]): input samples of each channel, a multiple of P_SAMP long
+
+        Returns:
+            any_high (list[np.ndarray]): per channel, any sample in the word above threshold_high
+            all_low (list[np.ndarray]): per channel, all samples in the word at or below threshold_low
+        """
+        any_high, all_low = [], []
+        for channel, x in enumerate(samples):
+            words = _words(x)
+            any_high.append((words > self.high_thresholds[channel]).any(axis=1))
+            all_low.append((words <= self.low_thresholds[channel]).all(axis=1))
+        return any_high, all_low
+
+    def run(self, samples: list[np.ndarray], digital_triggers: np.ndarray = None, loop: bool = False):
+        """Predict the saved words and timestamps of every channel
+
+        Arguments:
+            samples (list[np.ndarray]): input samples of each channel, all the same length
+            digital_triggers (np.ndarray): (AWG channels, words) digital triggers, only
+                                            needed for channels with a digital source
+            loop (bool): use the cycle-by-cycle reference model
+
+        Returns:
+            keep (list[np.ndarray]): per channel, whether each word is saved
+            timestamps (list[tuple[np.ndarray]]): per channel, (cycle, sample_index) of each timestamp
+        """
+        any_high, all_low = self.comparators(samples)
+        model = discriminate_channel_loop if loop else discriminate_channel
+        keep, timestamps = [], []
+        for channel in range(len(samples)):
+            source = self.sources[channel]
+            if source >= NUM_CHANNELS:
+                if digital_triggers is None:
+                    raise ValueError(f'channel {channel} uses digital trigger {source - NUM_CHANNELS}, but no digital triggers were given')
+                args = (any_high[channel], all_low[channel], digital_triggers[source - NUM_CHANNELS])
+            else:
+                args = (any_high[source], all_low[source], None)
+            k, t = model(args[0], args[1], self.start_delays[channel], self.stop_delays[channel],
+                         args[2], self.digital_delays[channel], bool((self.bypass_mask >> channel) & 1))
+            keep.append(k)
+            timestamps.append(t)
+        return keep, timestamps
+
+    def saved_samples(self, samples: list[np.ndarray], keep: list[np.ndarray]):
+        """Samples of each channel that the discriminator saves, in the order they are saved"""
+        return [_words(x)[k].reshape(-1) for x, k in zip(samples, keep)]
+
+def pulse_train(num_words: int, period: int, width: int, noise: float = 0.2, amplitude: int = 2**14, seed: int = None):
+    """Noisy periodic pulses, as int16 samples"""
+    rng = np.random.default_rng(seed)
+    n = np.arange(num_words * P_SAMP)
+    x = (n % period < width) + rng.standard_normal(len(n)) * noise
+    return np.clip(x * amplitude, -2**15, 2**15 - 1).astype(np.int16)
+
+def benchmark_discriminator(num_words: int = 1 << 18, trials: int = 200, seed: int = 0):
+    """Check the vectorized model against the reference, and compare their speed
+
+    Arguments:
+        num_words (int): words per channel in the timed run
+        trials (int): short random streams and settings to check for equality
+
+    Returns:
+        results (dict): samples/s of both models over all channels
+    """
+    rng = np.random.default_rng(seed)
+    for trial in range(trials):
+        n = int(rng.integers(1, 300))
+        any_high = rng.random(n) < rng.random() * 0.2
+        all_low = rng.random(n) < rng.random()
+        digital = rng.random(n) < 0.05 if rng.random() < 0.3 else None
+        args = (any_high, all_low, int(rng.integers(0, 8)), int(rng.integers(0, 8)), digital,
+                int(rng.integers(0, 8)), False)
+        keep, (cycles, index) = discriminate_channel(*args)
+        keep_ref, (cycles_ref, index_ref) = discriminate_channel_loop(*args)
+        assert np.array_equal(keep, keep_ref), f'saved words differ: {args}'
+        assert np.array_equal(cycles, cycles_ref) and np.array_equal(index, index_ref), f'timestamps differ: {args}'
+    model = SampleDiscriminator([2**13] * 8, [2**14] * 8, [4] * 8, [2] * 8)
+    samples = [pulse_train(num_words, 2000 + 100 * channel, 40, seed=channel) for channel in range(NUM_CHANNELS)]
+    results = {}
+    for name, loop, words in (('vectorized', False, num_words), ('loop', True, num_words // 64)):
+        x = [s[:words * P_SAMP] for s in samples]
+        start = time.perf_counter()
+        model.run(x, loop=loop)
+        results[name] = NUM_CHANNELS * words * P_SAMP / (time.perf_counter() - start)
+    return results
 
-T = 209
-W = 18
-
-t_high = 1
-t_low = 0.4
-
-D_pre = 5
-D_post = 1
-
-x_in = (np.arange((N//P_SAMP)*P_SAMP) % T < W) + np.random.randn((N//P_SAMP)*P_SAMP)/5
-any_high = np.zeros(N//P_SAMP)
-any_high_delay = np.zeros(N//P_SAMP)
-all_low = np.zeros(N//P_SAMP)
-all_low_delay = np.zeros(N//P_SAMP)
-x_in_delay = np.zeros((N//P_SAMP)*P_SAMP)
-x_in_delay[D_pre*P_SAMP:] = x_in[:N-D_pre*P_SAMP]
-
-
-for i in range(N//P_SAMP):
-    any_high[i] = 0
-    all_low[i] = 1
-    for j in range(P_SAMP):
-        if x_in[i*P_SAMP+j] > t_high:
-            any_high[i] = 1
-        if x_in[i*P_SAMP+j] > t_low:
-            all_low[i] = 0
-
-any_high_delay[D_post+D_pre:] = any_high[:N//P_SAMP-D_post-D_pre]
-all_low_delay[D_post+D_pre:] = all_low[:N//P_SAMP-D_post-D_pre]
-enabled = np.zeros(N//P_SAMP)
-hold = 0
-en = 0
-for i in range(N//P_SAMP):
-    if any_high[i] and not(hold):
-        hold = 1
-        en = 1
-    if any_high_delay[i] and hold:
-        hold = 0
-    if all_low_delay[i] and not(hold):
-        en = 0
-    enabled[i] = en
-
-
-plt.plot(x_in, '.', label='x_in')
-plt.plot(x_in_delay, '.', label='x_in_d')
-plt.plot(np.arange(0,N,P_SAMP), any_high, '-o', label='any_high')
-plt.plot(np.arange(0,N,P_SAMP), all_low, '-o', label='all_low')
-plt.plot(np.arange(0,N,P_SAMP), any_high_delay, '-o', label='any_high_delay')
-plt.legend()
-for i in range(N//P_SAMP):
-    if (enabled[i]):
-        plt.axvspan(i*P_SAMP,(i+1)*P_SAMP, facecolor='g', alpha=0.2)
-
-
-plt.show()
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+    results = benchmark_discriminator()
+    print(f"vectorized: {results['vectorized']/1e6:.1f} MS/s, loop: {results['loop']/1e6:.3f} MS/s")
+    num_words = 128
+    x = pulse_train(num_words, 209, 18)
+    model = SampleDiscriminator([int(0.4 * 2**14)], [2**14], [5], [1])
+    (keep,), ((cycles, index),) = model.run([x])
+    plt.plot(x, '.', label='x_in')
+    for word in np.flatnonzero(keep):
+        plt.axvspan(word * P_SAMP, (word + 1) * P_SAMP, facecolor='g', alpha=0.2)
+    plt.legend()
+    plt.show()
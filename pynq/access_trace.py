@@ -0,0 +1,191 @@
+import time
+import functools
+import numpy as np
+
+class AccessCounters:
+    """Per-device counters of register and DMA traffic
+
+    Attributes:
+        reads (int): MMIO register reads, including block reads of the RX data register
+        writes (int): MMIO register writes, including block writes of the TX data register
+        ops (int): packets sent/received or DMA transfers
+        words (int): 32-bit words moved through the FIFO, or bytes/4 for DMA
+        time_s (float): wall time spent in traced operations; DMA transfers are timed
+                        from starting them until wait() returns
+        histogram (np.ndarray): operation latency counts, bin k holds latencies in
+                                [2**(k-1), 2**k) us (bin 0 is < 1 us, last bin is overflow)
+    """
+    num_bins = 20
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.ops = 0
+        self.words = 0
+        self.time_s = 0.0
+        self.histogram = np.zeros(self.num_bins, dtype=np.int64)
+
+    def record_op(self, words: int, elapsed_s: float = None):
+        """Count an operation, and its latency unless elapsed_s is None (see record_latency)"""
+        self.ops += 1
+        self.words += words
+        if elapsed_s is not None:
+            self.record_latency(elapsed_s)
+
+    def record_latency(self, elapsed_s: float):
+        self.time_s += elapsed_s
+        self.histogram[min(int(elapsed_s * 1e6).bit_length(), self.num_bins - 1)] += 1
+
+    def as_dict(self):
+        return {
+            'reads': self.reads,
+            'writes': self.writes,
+            'ops': self.ops,
+            'words': self.words,
+            'time_s': self.time_s,
+            'histogram': self.histogram.copy(),
+        }
+
+class AccessTracer:
+    """Opt-in tracer for MMIO and DMA traffic of AXI FIFOs and DMA channels
+
+    Tracing works by shadowing the traced methods with timing wrappers on each
+    attached instance, and detach() removes them again, so untraced devices run
+    exactly the same code as before and pay nothing when tracing is disabled.
+    """
+    # methods that move a whole packet, and how to count the words they move
+    _fifo_ops = {
+        '_push_tx': lambda args, result: len(args[0]),
+        'get_rx_fifo_pkt': lambda args, result: len(result),
+        'get_rx_fifo_array': lambda args, result: len(result),
+    }
+    # register accesses that go through the data register keyhole instead of read/write
+    _fifo_keyhole = {
+        '_push_tx': ('writes', lambda args, result: len(args[0]) if isinstance(args[0], np.ndarray) else 0),
+        'get_rx_fifo_array': ('reads', lambda args, result: len(result)),
+    }
+
+    def __init__(self):
+        self.counters = {}
+        self._attached = []
+
+    def attach_fifo(self, name: str, fifo):
+        """Trace register accesses and packets of an AxiStreamFifoDriver"""
+        counters = self.counters.setdefault(name, AccessCounters())
+        self._wrap_count(fifo, 'read', counters, 'reads')
+        self._wrap_count(fifo, 'write', counters, 'writes')
+        for method, count_words in self._fifo_ops.items():
+            self._wrap_op(fifo, method, counters, count_words, self._fifo_keyhole.get(method))
+
+    def attach_dma(self, name: str, channel):
+        """Trace transfers on a DMA send or receive channel
+
+        Each transfer is one operation, timed from transfer() until the wait() that
+        finishes it returns, so the latency includes the time the data took to move.
+        Transfers that weren't waited on while tracing are counted without a latency.
+        """
+        counters = self.counters.setdefault(name, AccessCounters())
+        # start times of transfers that haven't been waited on yet
+        pending = []
+        transfer = channel.transfer
+        @functools.wraps(transfer)
+        def traced_transfer(array, *args, **kwargs):
+            # transfer(array, start=0, nbytes=0), where nbytes=0 moves the whole array
+            nbytes = kwargs.get('nbytes', args[1] if len(args) > 1 else 0)
+            counters.record_op((nbytes if nbytes > 0 else array.nbytes) // 4)
+            pending.append(time.perf_counter())
+            return transfer(array, *args, **kwargs)
+        wait = channel.wait
+        @functools.wraps(wait)
+        def traced_wait(*args, **kwargs):
+            result = wait(*args, **kwargs)
+            if pending:
+                counters.record_latency(time.perf_counter() - pending.pop(0))
+            return result
+        for method, wrapper in (('transfer', traced_transfer), ('wait', traced_wait)):
+            setattr(channel, method, wrapper)
+            self._attached.append((channel, method))
+
+    def detach(self):
+        """Remove all wrappers, restoring the original methods"""
+        for obj, method in self._attached:
+            delattr(obj, method)
+        self._attached = []
+
+    def reset(self):
+        """Clear all counters, keeping devices attached"""
+        for name in self.counters:
+            self.counters[name].__init__()
+
+    def _wrap_count(self, obj, method: str, counters: AccessCounters, field: str):
+        original = getattr(obj, method)
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            setattr(counters, field, getattr(counters, field) + 1)
+            return original(*args, **kwargs)
+        setattr(obj, method, wrapper)
+        self._attached.append((obj, method))
+
+    def _wrap_op(self, obj, method: str, counters: AccessCounters, count_words, keyhole=None):
+        original = getattr(obj, method)
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = original(*args, **kwargs)
+            counters.record_op(count_words(args, result), time.perf_counter() - start)
+            if keyhole is not None:
+                field, count_accesses = keyhole
+                setattr(counters, field, getattr(counters, field) + count_accesses(args, result))
+            return result
+        setattr(obj, method, wrapper)
+        self._attached.append((obj, method))
+
+    def snapshot(self):
+        """Get a copy of the counters for every traced device
+
+        Returns:
+            counters (dict[str, dict]): reads, writes, ops, words, time_s and histogram per device
+        """
+        return {name: counters.as_dict() for name, counters in self.counters.items()}
+
+    def report(self, skip_idle: bool = True):
+        """Format the counters as a table, sorted by time spent
+
+        Arguments:
+            skip_idle (bool): if True, leave out devices that weren't accessed
+
+        Returns:
+            report (str): one line per device, followed by the totals
+        """
+        rows = sorted(self.counters.items(), key=lambda item: item[1].time_s, reverse=True)
+        lines = [f"{'device':<34}{'reads':>8}{'writes':>8}{'ops':>6}{'words':>9}{'time [us]':>12}{'p50 [us]':>10}{'max [us]':>10}"]
+        totals = AccessCounters()
+        for name, counters in rows:
+            if skip_idle and counters.reads + counters.writes + counters.ops == 0:
+                continue
+            lines.append(
+                f'{name:<34}{counters.reads:>8}{counters.writes:>8}{counters.ops:>6}{counters.words:>9}'
+                f'{counters.time_s*1e6:>12.1f}{self._percentile_us(counters.histogram, 0.5):>10}'
+                f'{self._percentile_us(counters.histogram, 1.0):>10}'
+            )
+            totals.reads += counters.reads
+            totals.writes += counters.writes
+            totals.ops += counters.ops
+            totals.words += counters.words
+            totals.time_s += counters.time_s
+        lines.append(
+            f"{'total':<34}{totals.reads:>8}{totals.writes:>8}{totals.ops:>6}{totals.words:>9}"
+            f'{totals.time_s*1e6:>12.1f}'
+        )
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _percentile_us(histogram: np.ndarray, fraction: float):
+        """Upper edge (us) of the histogram bin containing the given fraction of operations"""
+        total = histogram.sum()
+        if total == 0:
+            return '-'
+        k = int(np.searchsorted(np.cumsum(histogram), fraction * total))
+        if k == len(histogram) - 1:
+            return f'>{2**(k-1)}'
+        return f'<{2**k}'
@@ -0,0 +1,299 @@
+import time
+import numpy as np
+
+class AdcBufferLayout:
+    """Layout of the ADC DMA buffer, and parsing of the captures in it
+
+    The buffer holds a timestamp region followed by a sample region. Each region is
+    split into num_channels banks, and bank b holds data of channel b % active_channels,
+    so each channel owns num_channels // active_channels banks which it fills in order.
+    How many entries were written to each bank is reported in a write depth packet per
+    region, with depth_bits bits per bank (the MSB indicating a full bank).
+
+    The layout is plain data, so it can be handed to other processes to parse captures
+    without access to the hardware.
+
+    Attributes:
+        num_channels (int): number of banks per region
+        regions (list[tuple]): for (timestamps, samples), a tuple of (depth_bits, 16-bit
+                                words per entry, offset of the region in 16-bit words,
+                                depth of each bank in entries)
+        size (int): size of the buffer in 16-bit words
+    """
+    def __init__(self,
+                 num_channels: int,
+                 tstamp_depth: int,
+                 data_depth: int,
+                 tstamp_width: int,
+                 data_width: int):
+        """
+        Arguments:
+            num_channels (int): number of banks per region
+            tstamp_depth (int): entries per timestamp bank
+            data_depth (int): entries per sample bank
+            tstamp_width (int): bits per timestamp entry
+            data_width (int): bits per sample entry (all parallel samples)
+        """
+        self.num_channels = num_channels
+        buffer_midpoint = num_channels * tstamp_depth * tstamp_width // 16
+        self.regions = [
+            ((tstamp_depth - 1).bit_length() + 1, tstamp_width // 16, 0, tstamp_depth),
+            ((data_depth - 1).bit_length() + 1, data_width // 16, buffer_midpoint, data_depth),
+        ]
+        self.size = buffer_midpoint + num_channels * data_depth * data_width // 16
+
+    def decode_depth_packet(self, packet: list[int], depth_bits: int, bank_depth: int):
+        """Get the number of entries written to each bank from a write depth packet
+
+        Arguments:
+            packet (list[int]): write depth packet
+            depth_bits (int): bits per bank; the MSB indicates the bank is full
+            bank_depth (int): number of entries in a full bank
+
+        Returns:
+            depth_per_bank (list[int]): number of entries written to each bank
+        """
+        # merge 32-bit qtys
+        depth_word = 0
+        for n, word in enumerate(packet):
+            depth_word |= int(word) << (32 * n)
+        mask = ((1 << depth_bits) - 1)
+        depth_per_bank = []
+        for bank in range(self.num_channels):
+            depth = (depth_word >> (bank * depth_bits)) & mask
+            if depth & (1 << (depth_bits - 1)):
+                depth = bank_depth
+            depth_per_bank.append(depth)
+        return depth_per_bank
+
+    def encode_depth_packet(self, depth_per_bank: list[int], depth_bits: int, bank_depth: int):
+        """Write depth packet reporting depth_per_bank, the inverse of decode_depth_packet
+
+        Arguments:
+            depth_per_bank (list[int]): number of entries written to each bank
+            depth_bits (int): bits per bank; the MSB indicates the bank is full
+            bank_depth (int): number of entries in a full bank
+
+        Returns:
+            packet (np.ndarray): np.uint32 packet words, as read from the status FIFO
+        """
+        depth_word = 0
+        for bank, depth in enumerate(depth_per_bank):
+            # a full bank reports the full flag with the write address wrapped to 0
+            field = 1 << (depth_bits - 1) if depth == bank_depth else depth
+            depth_word |= field << (bank * depth_bits)
+        num_words = -(-self.num_channels * depth_bits // 32)
+        return np.array([(depth_word >> (32 * n)) & 0xffffffff for n in range(num_words)], dtype=np.uint32)
+
+    def encode(self,
+               timestamps: list[np.ndarray],
+               samples: list[np.ndarray],
+               active_channels: int,
+               raw: np.ndarray = None):
+        """Lay out a capture the way the hardware stores and reads it out, the inverse of reassemble
+
+        Each channel's entries fill its banks (channel, channel + active_channels, ...) in
+        order. Entries that aren't written keep the previous contents of raw.
+
+        Arguments:
+            timestamps (list[np.ndarray]): for each active channel, uint64 timestamps
+            samples (list[np.ndarray]): for each active channel, 16-bit samples, a whole
+                                        number of entries (parallel samples) long
+            active_channels (int): number of channels the capture is made with
+            raw (np.ndarray): uint16 buffer to write into, allocated (zeroed) if None
+
+        Returns:
+            raw (np.ndarray): uint16 buffer holding the readout image
+            depth_packets (list[np.ndarray]): for each (timestamps, samples), the write depth packet
+
+        Raises:
+            ValueError: if a channel has more entries than its banks hold, or a partial entry
+        """
+        if raw is None:
+            raw = np.zeros(self.size, dtype=np.uint16)
+        depth_packets = []
+        for data, (depth_bits, depth_to_words, offset, bank_depth) in zip((timestamps, samples), self.regions):
+            depth_per_bank = [0] * self.num_channels
+            bank_size = bank_depth * depth_to_words
+            for channel in range(active_channels):
+                words = np.ascontiguousarray(data[channel]).view(np.uint16)
+                banks = range(channel, self.num_channels, active_channels)
+                if len(words) % depth_to_words != 0:
+                    raise ValueError(f'channel {channel} has a partial entry ({len(words)} words, '
+                                     f'{depth_to_words} per entry)')
+                if len(words) > len(banks) * bank_size:
+                    raise ValueError(f'channel {channel} has {len(words) // depth_to_words} entries, '
+                                     f'but its banks only hold {len(banks) * bank_depth}')
+                for n, bank in enumerate(banks):
+                    chunk = words[n * bank_size:(n + 1) * bank_size]
+                    if len(chunk) == 0:
+                        break
+                    write_start = offset + bank * bank_size
+                    raw[write_start:write_start + len(chunk)] = chunk
+                    depth_per_bank[bank] = len(chunk) // depth_to_words
+            depth_packets.append(self.encode_depth_packet(depth_per_bank, depth_bits, bank_depth))
+        return raw, depth_packets
+
+    def written_words(self, depth_packets: list[list[int]]):
+        """Number of 16-bit words from the start of the buffer up to the last written entry"""
+        end = 0
+        for packet, (depth_bits, depth_to_words, offset, bank_depth) in zip(depth_packets, self.regions):
+            depth_per_bank = self.decode_depth_packet(packet, depth_bits, bank_depth)
+            for bank in reversed(range(self.num_channels)):
+                if depth_per_bank[bank] > 0:
+                    end = offset + (bank * bank_depth + depth_per_bank[bank]) * depth_to_words
+                    break
+        return end
+
+    def reassemble(self,
+                   raw: np.ndarray,
+                   depth_packets: list[list[int]],
+                   active_channels: int,
+                   channels: list[int] = None,
+                   arena: np.ndarray = None):
+        """Split a capture into the timestamps and samples of each channel
+
+        A channel whose filled banks are adjacent in raw is returned as a view into raw,
+        otherwise its banks are gathered into arena.
+
+        Arguments:
+            raw (np.ndarray): uint16 buffer holding the capture
+            depth_packets (list[list[int]]): for each (timestamps, samples), a packet of write depth information
+            active_channels (int): number of channels the capture was made with
+            channels (list[int]): channels to reassemble, defaults to all active channels
+            arena (np.ndarray): uint16 scratch space of the size of the buffer, allocated if needed
+
+        Returns:
+            timestamps (list[array_like]): for each of the num_channels channels, timestamps
+                                            (empty for channels that weren't requested)
+            samples (list[array_like]): for each of the num_channels channels, collected samples
+                                            (empty for channels that weren't requested)
+        """
+        if channels is None:
+            channels = range(active_channels)
+        banks_per_channel = self.num_channels // active_channels
+        data = []
+        for packet, (depth_bits, depth_to_words, offset, bank_depth) in zip(depth_packets, self.regions):
+            depth_per_bank = self.decode_depth_packet(packet, depth_bits, bank_depth)
+            bank_size = bank_depth * depth_to_words
+            data.append([raw[offset:offset]] * self.num_channels)
+            for channel in channels:
+                if channel >= active_channels:
+                    continue
+                segments = []
+                for bank in range(channel, self.num_channels, active_channels):
+                    if depth_per_bank[bank] > 0:
+                        read_start = offset + (bank_size * bank)
+                        segments.append((read_start, read_start + depth_per_bank[bank] * depth_to_words))
+                if len(segments) == 0:
+                    continue
+                if all(segments[n][1] == segments[n + 1][0] for n in range(len(segments) - 1)):
+                    data[-1][channel] = raw[segments[0][0]:segments[-1][1]]
+                    continue
+                # banks are interleaved with other channels' banks, gather them
+                if arena is None:
+                    arena = np.empty(self.size, dtype=np.uint16)
+                arena_start = offset + channel * banks_per_channel * bank_size
+                write_stop = arena_start
+                for read_start, read_stop in segments:
+                    write_start = write_stop
+                    write_stop = write_start + read_stop - read_start
+                    arena[write_start:write_stop] = raw[read_start:read_stop]
+                data[-1][channel] = arena[arena_start:write_stop]
+        timestamps = [d.view(np.uint64) for d in data[0]]
+        samples = data[1]
+        return timestamps, samples
+
+    def sample_banks(self, raw: np.ndarray, depth_packets: list[list[int]], active_channels: int):
+        """Filled sample banks of each active channel, in capture order
+
+        Returns:
+            banks (list[list[np.ndarray]]): for each active channel, int16 views of its banks
+        """
+        depth_bits, depth_to_words, offset, bank_depth = self.regions[1]
+        depth_per_bank = self.decode_depth_packet(depth_packets[1], depth_bits, bank_depth)
+        bank_size = bank_depth * depth_to_words
+        banks = [[] for channel in range(active_channels)]
+        for bank in range(self.num_channels):
+            if depth_per_bank[bank] > 0:
+                read_start = offset + bank_size * bank
+                banks[bank % active_channels].append(
+                    raw[read_start:read_start + depth_per_bank[bank] * depth_to_words].view(np.int16)
+                )
+        return banks
+
+def random_capture(layout: AdcBufferLayout, active_channels: int, rng: np.random.Generator, fill: float = None):
+    """Random timestamps and samples of a capture that fits in the buffer
+
+    Arguments:
+        layout (AdcBufferLayout): buffer layout
+        active_channels (int): number of channels of the capture
+        rng (np.random.Generator): random source
+        fill (float): fraction of each channel's banks to fill, random per channel if None
+
+    Returns:
+        timestamps, samples (list[np.ndarray]): uint64 timestamps and int16 samples of each active channel
+    """
+    data = []
+    for depth_bits, depth_to_words, offset, bank_depth in layout.regions:
+        capacity = layout.num_channels // active_channels * bank_depth
+        region = []
+        for channel in range(active_channels):
+            entries = int(rng.integers(0, capacity + 1)) if fill is None else int(fill * capacity)
+            region.append(rng.integers(-2**15, 2**15, entries * depth_to_words, dtype=np.int16))
+        data.append(region)
+    return [t.view(np.uint64) for t in data[0]], data[1]
+
+def benchmark_reassembly(trials: int = 200, repeats: int = 20, seed: int = 0):
+    """Round-trip random captures through encode and reassemble, and time reassembly
+
+    Every trial encodes a random capture (with random channel fill, including empty and
+    full banks) on top of a buffer of garbage, checks the write depths and that
+    reassemble returns exactly the encoded data, for all channels and a random subset.
+    Throughput is then measured on full captures.
+
+    Arguments:
+        trials (int): random captures to check per channel count
+        repeats (int): reassemblies timed per channel count
+
+    Returns:
+        results (dict[int, dict]): for 1, 2, 4 and 8 active channels, reassembly throughput
+                                    in MB/s of the captured data, for all channels ('all')
+                                    and for channel 0 only ('one')
+    """
+    rng = np.random.default_rng(seed)
+    layout = AdcBufferLayout(8, 512, 4096, 64, 128)
+    arena = np.empty(layout.size, dtype=np.uint16)
+    results = {}
+    for active_channels in (1, 2, 4, 8):
+        for trial in range(trials):
+            timestamps, samples = random_capture(layout, active_channels, rng)
+            raw = rng.integers(0, 2**16, layout.size, dtype=np.uint16)
+            raw, depth_packets = layout.encode(timestamps, samples, active_channels, raw)
+            channels = None
+            if trial % 2 == 1:
+                num_channels = int(rng.integers(1, active_channels + 1))
+                channels = sorted(rng.choice(active_channels, num_channels, replace=False))
+            out_timestamps, out_samples = layout.reassemble(raw, depth_packets, active_channels, channels, arena)
+            for channel in range(layout.num_channels):
+                requested = channel < active_channels and (channels is None or channel in channels)
+                assert np.array_equal(out_timestamps[channel], timestamps[channel] if requested else []), \
+                    f'timestamps of channel {channel} differ ({active_channels} channels, trial {trial})'
+                assert np.array_equal(out_samples[channel].view(np.int16), samples[channel] if requested else []), \
+                    f'samples of channel {channel} differ ({active_channels} channels, trial {trial})'
+            assert layout.written_words(depth_packets) <= layout.size
+        timestamps, samples = random_capture(layout, active_channels, rng, fill=1.0)
+        raw, depth_packets = layout.encode(timestamps, samples, active_channels)
+        nbytes = sum(t.nbytes for t in timestamps) + sum(s.nbytes for s in samples)
+        results[active_channels] = {}
+        for name, channels in (('all', None), ('one', [0])):
+            selected = nbytes if channels is None else timestamps[0].nbytes + samples[0].nbytes
+            start = time.perf_counter()
+            for _ in range(repeats):
+                layout.reassemble(raw, depth_packets, active_channels, channels, arena)
+            results[active_channels][name] = selected * repeats / (time.perf_counter() - start) / 1e6
+    return results
+
+if __name__ == '__main__':
+    for active_channels, rates in benchmark_reassembly().items():
+        print(f"{active_channels} channels: {rates['all']:.0f} MB/s all channels, {rates['one']:.0f} MB/s channel 0")
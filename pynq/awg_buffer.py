@@ -0,0 +1,165 @@
+import numpy as np
+
+class AwgBuffer:
+    """AWG DMA buffer that tracks which parts of it changed since the last upload
+
+    Channels are stored back to back, channel c taking frame_depths[c] DMA words of
+    parallel_samples int16 samples. Writes made through channel() or write_template()
+    are recorded as a dirty sample range per channel; once an upload that started after
+    the last write completes, the buffer is clean and the AWG memory holds its contents,
+    so it doesn't need to be uploaded again.
+
+    The AWG resets its write pointer to the first word of channel 0 on every transfer and
+    expects tlast on the last word of the last channel (anything shorter is reported as
+    an early tlast error), so a dirty buffer is always uploaded as a whole: the smallest
+    legal transfer is either nothing or everything.
+
+    Attributes:
+        buffer (PynqBuffer): the uint16 DMA buffer
+        frame_depths (list[int]): frame depth of each channel in DMA words
+        offsets (list[int]): offset of each channel in samples
+        uploads (int): number of uploads that were started
+        skipped (int): number of uploads that were skipped because the buffer was clean
+        last_skipped (bool): True if the most recent upload was skipped
+        failed (int): number of uploads that reported a DMA error
+        bytes_uploaded (int): bytes transferred by uploads
+        bytes_saved (int): bytes that skipped uploads would have transferred
+    """
+    def __init__(self, buffer, frame_depths: list[int], parallel_samples: int):
+        """
+        Arguments:
+            buffer (PynqBuffer): uint16 DMA buffer holding all channels
+            frame_depths (list[int]): frame depth of each channel in DMA words
+            parallel_samples (int): samples per DMA word
+        """
+        self.buffer = buffer
+        self.frame_depths = list(frame_depths)
+        self.offsets = []
+        self._channels = []
+        offset = 0
+        for depth in frame_depths:
+            self.offsets.append(offset)
+            self._channels.append(buffer[offset:offset+depth*parallel_samples].view(np.int16))
+            offset += depth*parallel_samples
+        # per channel, (start, stop) sample range written since the last upload, or None
+        self._dirty = [(0, len(channel)) for channel in self._channels]
+        # per channel, key of the template it holds, or None if it was written otherwise
+        self._contents = [None] * len(self._channels)
+        # incremented on every write, so uploads only clean writes made before they started
+        self._generation = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Clear the upload counters"""
+        self.uploads = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_uploaded = 0
+        self.bytes_saved = 0
+        self.last_skipped = False
+
+    def __len__(self):
+        return len(self._channels)
+
+    def channel(self, channel: int, start: int = 0, stop: int = None):
+        """Get a writable view of samples [start, stop) of a channel, marking them dirty
+
+        Arguments:
+            channel (int): AWG channel
+            start (int): first sample
+            stop (int): end of the range, defaults to the end of the channel
+
+        Returns:
+            samples (np.ndarray): int16 view into the DMA buffer
+        """
+        stop = len(self._channels[channel]) if stop is None else stop
+        self.mark_dirty(channel, start, stop)
+        return self._channels[channel][start:stop]
+
+    def mark_dirty(self, channel: int = None, start: int = 0, stop: int = None):
+        """Record that samples [start, stop) of a channel (or all channels) were modified"""
+        channels = range(len(self._channels)) if channel is None else [channel]
+        for channel in channels:
+            end = len(self._channels[channel]) if stop is None else stop
+            if end <= start:
+                continue
+            dirty = self._dirty[channel]
+            self._dirty[channel] = (start, end) if dirty is None else (min(dirty[0], start), max(dirty[1], end))
+            self._contents[channel] = None
+        self._generation += 1
+
+    def invalidate(self):
+        """Record that the AWG memory was lost (e.g. the bitstream was reloaded)
+
+        Everything is uploaded again, but write_template still knows what each channel holds.
+        """
+        self._dirty = [(0, len(channel)) for channel in self._channels]
+        self._generation += 1
+
+    def write_template(self, channel: int, key, template: np.ndarray):
+        """Copy template into a channel, unless the channel already holds it
+
+        Arguments:
+            channel (int): AWG channel
+            key: hashable key identifying the template
+            template (np.ndarray): int16 samples, as long as the channel
+
+        Returns:
+            samples (np.ndarray): int16 view of the channel
+        """
+        data = self._channels[channel]
+        if self._contents[channel] != key:
+            data[:] = template
+            self.mark_dirty(channel)
+            self._contents[channel] = key
+        return data
+
+    @property
+    def dirty(self):
+        """True if the buffer has to be uploaded"""
+        return any(dirty is not None for dirty in self._dirty)
+
+    def dirty_regions(self):
+        """Sample ranges modified since the last upload
+
+        Returns:
+            regions (dict[int, tuple]): channel -> (start, stop) sample range, for dirty channels only
+        """
+        return {channel: dirty for channel, dirty in enumerate(self._dirty) if dirty is not None}
+
+    def skip_upload(self):
+        """Record an upload that was skipped because the buffer was clean"""
+        self.skipped += 1
+        self.bytes_saved += self.buffer.nbytes
+        self.last_skipped = True
+
+    def begin_upload(self):
+        """Record the start of an upload of the whole buffer
+
+        Returns:
+            generation (int): pass to end_upload once the transfer completes
+        """
+        self.uploads += 1
+        self.bytes_uploaded += self.buffer.nbytes
+        self.last_skipped = False
+        return self._generation
+
+    def end_upload(self, generation: int):
+        """Mark the buffer clean after an upload, unless it was written since the upload started"""
+        if generation == self._generation:
+            self._dirty = [None] * len(self._channels)
+
+    def upload_failed(self):
+        """Record that the last upload reported a DMA error, so it is repeated"""
+        self.failed += 1
+        self.invalidate()
+
+    def as_dict(self):
+        return {
+            'uploads': self.uploads,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'bytes_uploaded': self.bytes_uploaded,
+            'bytes_saved': self.bytes_saved,
+            'dirty_regions': self.dirty_regions(),
+        }
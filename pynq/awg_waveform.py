@@ -0,0 +1,171 @@
+from collections import OrderedDict
+import numpy as np
+
+# largest positive DAC code
+FULL_SCALE = 2**15 - 1
+
+def _check_level(value: int):
+    if value < -2**15 or value > FULL_SCALE:
+        raise ValueError(f'level {value} is outside of the int16 DAC range')
+
+def write_constant(out: np.ndarray, value: int):
+    """Set every sample of out to value
+
+    Arguments:
+        out (np.ndarray): int16 segment of an AWG channel
+        value (int): DAC code
+    """
+    _check_level(value)
+    out.fill(value)
+
+def write_ramp(out: np.ndarray, start: float, stop: float):
+    """Linear ramp from start to stop (both included, like np.linspace) rounded into out
+
+    The ramp is evaluated in a float32 scratch array the size of out, so ramps over a
+    whole channel never make float64 copies of it.
+
+    Arguments:
+        out (np.ndarray): int16 segment of an AWG channel
+        start (float): level of the first sample
+        stop (float): level of the last sample
+    """
+    _check_level(start)
+    _check_level(stop)
+    num_samples = len(out)
+    if num_samples == 0:
+        return
+    if num_samples == 1:
+        out[0] = round(start)
+        return
+    ramp = np.arange(num_samples, dtype=np.float32)
+    ramp *= (stop - start) / (num_samples - 1)
+    ramp += start
+    np.rint(ramp, out=ramp)
+    out[:] = ramp
+
+def write_pulse(out: np.ndarray,
+                rise_samples: int,
+                hold_samples: int,
+                fall_samples: int,
+                delay_samples: int = 0,
+                amplitude: int = FULL_SCALE):
+    """Trapezoidal pulse into out, with out zeroed before and after it
+
+    Same shape as DAQOverlay.generate_pulse, with len(out) as the period: a pulse that
+    runs past the end of the period is cut off.
+
+    Arguments:
+        out (np.ndarray): int16 segment of an AWG channel, one period long
+        rise_samples (int): length of the rising edge
+        hold_samples (int): length of the top
+        fall_samples (int): length of the falling edge
+        delay_samples (int): samples before the rising edge
+        amplitude (int): DAC code of the top
+    """
+    out[:delay_samples] = 0
+    offset = delay_samples
+    if rise_samples > 0:
+        # evaluate the whole edge so a cut off ramp keeps its slope
+        end = min(offset + rise_samples, len(out))
+        _write_edge(out[offset:end], 0, amplitude, rise_samples)
+    offset += rise_samples
+    write_constant(out[offset:offset + hold_samples], amplitude)
+    offset += hold_samples
+    if fall_samples > 0:
+        end = min(offset + fall_samples, len(out))
+        _write_edge(out[offset:end], amplitude, 0, fall_samples)
+    out[offset + fall_samples:] = 0
+
+def _write_edge(out: np.ndarray, start: int, stop: int, num_samples: int):
+    """First len(out) samples of a num_samples long ramp from start to stop"""
+    if len(out) == num_samples:
+        write_ramp(out, start, stop)
+    elif len(out) > 0:
+        step = 0 if num_samples == 1 else (stop - start) / (num_samples - 1)
+        write_ramp(out, start, start + step * (len(out) - 1))
+
+def repeat_period(out: np.ndarray, period: int):
+    """Repeat the first period samples of out over all of out, in place
+
+    Copies blocks of doubling size, so only log2(len(out) / period) copies are made and
+    no temporaries are allocated.
+    """
+    filled = min(period, len(out))
+    while filled < len(out):
+        num_samples = min(filled, len(out) - filled)
+        out[filled:filled + num_samples] = out[:num_samples]
+        filled += num_samples
+
+class WaveformCache:
+    """Bounded LRU cache of quantized (int16) waveform templates
+
+    Templates are generated on a miss by a callback and kept read-only, so they can be
+    copied or gathered into the AWG buffer without being regenerated. The least recently
+    used templates are evicted once the cache holds more than max_bytes.
+    """
+    def __init__(self, max_bytes: int = 16*2**20):
+        """
+        Arguments:
+            max_bytes (int): upper bound on the memory used by cached templates
+        """
+        self.max_bytes = max_bytes
+        self._templates = OrderedDict()
+        self.nbytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Clear the hit/miss counters, keeping the cached templates"""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        """Drop all cached templates"""
+        self._templates.clear()
+        self.nbytes = 0
+
+    def get(self, key, generate):
+        """Get the template for key, calling generate() to make it if it isn't cached
+
+        Arguments:
+            key (tuple): hashable description of the template, e.g. (kind, pulse_param_ns, fsamp, frame depth)
+            generate (callable): returns the template as an np.ndarray
+
+        Returns:
+            template (np.ndarray): read-only template
+        """
+        template = self._templates.get(key)
+        if template is not None:
+            self._templates.move_to_end(key)
+            self.hits += 1
+            return template
+        self.misses += 1
+        template = generate()
+        template.flags.writeable = False
+        if template.nbytes > self.max_bytes:
+            # too large to keep, hand it out without caching it
+            return template
+        self._templates[key] = template
+        self.nbytes += template.nbytes
+        while self.nbytes > self.max_bytes:
+            key, evicted = self._templates.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+        return template
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups that were served from the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'templates': len(self._templates),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+        }
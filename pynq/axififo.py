@@ -1,58 +1,397 @@
+import time
+import asyncio
+from itertools import repeat
+import numpy as np
 from pynq import DefaultIP
 
+# writing this key to TDFR/RDFR resets the corresponding data FIFO
+FIFO_RESET_KEY = 0xA5
+
+class FifoTimeoutError(TimeoutError):
+    """Raised when a FIFO doesn't become ready within the wait policy timeout"""
+    def __init__(self, fifo_name: str, condition: str, waited_s: float, occupancy: str):
+        self.fifo_name = fifo_name
+        self.waited_s = waited_s
+        super().__init__(
+            f'{fifo_name}: timed out after {waited_s:.3g} s waiting for {condition} ({occupancy})'
+        )
+
+class FifoWaitPolicy:
+    """How long and how hard to poll a FIFO before giving up
+
+    The first spin_count polls are issued back to back, after which the poll
+    interval starts at min_sleep_s and is multiplied by backoff after every poll,
+    up to max_sleep_s. If the FIFO still isn't ready after timeout_s, a
+    FifoTimeoutError is raised. A timeout_s of None waits forever.
+    """
+    def __init__(self,
+                 spin_count: int = 64,
+                 min_sleep_s: float = 10e-6,
+                 max_sleep_s: float = 1e-3,
+                 backoff: float = 2.0,
+                 timeout_s: float = 1.0):
+        self.spin_count = spin_count
+        self.min_sleep_s = min_sleep_s
+        self.max_sleep_s = max_sleep_s
+        self.backoff = backoff
+        self.timeout_s = timeout_s
+
+    def delay(self, poll: int):
+        """Return time to sleep (seconds) after the poll-th unsuccessful poll"""
+        if poll < self.spin_count:
+            return 0.0
+        return min(self.min_sleep_s * self.backoff ** (poll - self.spin_count), self.max_sleep_s)
+
+    def expired(self, waited_s: float):
+        """Return True if waited_s exceeds the timeout"""
+        return self.timeout_s is not None and waited_s > self.timeout_s
+
+class FifoWaitStats:
+    """Counters for how often and how long a FIFO had to be waited on"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clear all counters"""
+        self.polls = 0
+        self.waits = 0
+        self.wait_time_s = 0.0
+        self.max_wait_s = 0.0
+        self.timeouts = 0
+
+    def record(self, polls: int, waited_s: float, timed_out: bool = False):
+        """Accumulate the outcome of a single wait"""
+        self.polls += polls
+        if polls > 1:
+            self.waits += 1
+            self.wait_time_s += waited_s
+            self.max_wait_s = max(self.max_wait_s, waited_s)
+        if timed_out:
+            self.timeouts += 1
+
+    def as_dict(self):
+        return {
+            'polls': self.polls,
+            'waits': self.waits,
+            'wait_time_s': self.wait_time_s,
+            'max_wait_s': self.max_wait_s,
+            'timeouts': self.timeouts,
+        }
+
 class AxiStreamFifoDriver(DefaultIP):
     # This line is always the same for any driver
     def __init__(self, description):
         # This line is always the same for any driver
         super().__init__(description=description)
         self._reg_map = self.register_map
-    
+        self.name = description.get('fullpath', 'axi_fifo_mm_s')
+        self._tx_fifo_depth = int(description.get('parameters', {}).get('C_TX_FIFO_DEPTH', 0))
+        self.wait_policy = FifoWaitPolicy()
+        self.wait_stats = FifoWaitStats()
+        # resolve register offsets once, looking them up through the register map
+        # on every word dominates the cost of long packets
+        self._tdfr = self._reg_map.TDFR.address
+        self._tdfv = self._reg_map.TDFV.address
+        self._tdfd = self._reg_map.TDFD.address
+        self._tlr = self._reg_map.TLR.address
+        self._rdfo = self._reg_map.RDFO.address
+        self._rlr = self._reg_map.RLR.address
+        self._rdfd = self._reg_map.RDFD.address
+        # single-word views of the data registers, used for block transfers
+        self._tdfd_word = self.mmio.array[self._tdfd >> 2:(self._tdfd >> 2) + 1]
+        self._rdfd_word = self.mmio.array[self._rdfd >> 2:(self._rdfd >> 2) + 1]
+        # all-zero indices into _rdfd_word, grown to the largest packet read so far
+        self._rx_index = np.zeros(0, dtype=np.intp)
+
     bindto = ['xilinx.com:ip:axi_fifo_mm_s:4.2']
-    
+
+    @staticmethod
+    def _keyhole(word: np.ndarray, num_words: int):
+        """Return a writable view of num_words elements that all alias a single 32-bit register
+
+        Copying an array into this view performs one store per element, in order, to the
+        same address, which is how the FIFO data registers expect to be accessed.
+        """
+        return np.lib.stride_tricks.as_strided(word, shape=(num_words,), strides=(0,), writeable=True)
+
     def read_num_tx_room(self):
         """
         Reads the number of 32-bit words that the TX FIFO has room for
         """
-        return self.read(self._reg_map.TDFV.address)
-    
+        return self.read(self._tdfv)
+
+    def _tx_occupancy(self, room: int):
+        """Describe TX FIFO fill level for error messages"""
+        if self._tx_fifo_depth == 0:
+            return f'vacancy {room} words'
+        return f'vacancy {room} words, occupancy {self._tx_fifo_depth - room}/{self._tx_fifo_depth} words'
+
+    def _poll_until(self, poll, ready, condition: str, occupancy, policy: FifoWaitPolicy = None):
+        """
+        Poll a register until ready(value) is True, following the wait policy.
+
+        This is a generator that yields the time to sleep between unsuccessful polls, so
+        that the same policy drives both blocking and asyncio waits. The final register
+        value is returned through StopIteration.
+
+        Arguments:
+            poll (callable): reads the register
+            ready (callable): returns True if the register value means the FIFO is ready
+            condition (str): what is being waited for, used in the timeout message
+            occupancy (callable): describes the FIFO fill level from the register value
+            policy (FifoWaitPolicy): overrides self.wait_policy if supplied
+        """
+        policy = self.wait_policy if policy is None else policy
+        start = time.perf_counter()
+        polls = 0
+        while True:
+            value = poll()
+            polls += 1
+            waited = time.perf_counter() - start
+            if ready(value):
+                self.wait_stats.record(polls, waited)
+                return value
+            if policy.expired(waited):
+                self.wait_stats.record(polls, waited, timed_out=True)
+                raise FifoTimeoutError(self.name, condition, waited, occupancy(value))
+            yield policy.delay(polls - 1)
+
+    @staticmethod
+    def _block_on(waiter):
+        """Run a _poll_until generator to completion, sleeping between polls"""
+        try:
+            while True:
+                delay = next(waiter)
+                if delay > 0:
+                    time.sleep(delay)
+        except StopIteration as done:
+            return done.value
+
+    @staticmethod
+    async def _await_on(waiter):
+        """Run a _poll_until generator to completion, yielding to the event loop between polls"""
+        try:
+            while True:
+                await asyncio.sleep(next(waiter))
+        except StopIteration as done:
+            return done.value
+
+    def _tx_room_waiter(self, num_tx: int, policy: FifoWaitPolicy = None):
+        return self._poll_until(
+            self.read_num_tx_room, lambda room: num_tx <= room, f'room for {num_tx} words',
+            self._tx_occupancy, policy
+        )
+
+    def wait_for_tx_room(self, num_tx: int, policy: FifoWaitPolicy = None):
+        """
+        Wait until the TX FIFO has room for num_tx words, following the wait policy.
+
+        Arguments:
+            num_tx (int): number of 32-bit words that need to fit
+            policy (FifoWaitPolicy): overrides self.wait_policy if supplied
+
+        Raises:
+            FifoTimeoutError: if there still isn't room after the policy timeout
+        """
+        self._block_on(self._tx_room_waiter(num_tx, policy))
+
+    async def wait_for_tx_room_async(self, num_tx: int, policy: FifoWaitPolicy = None):
+        """Awaitable version of wait_for_tx_room that yields to the event loop while polling"""
+        await self._await_on(self._tx_room_waiter(num_tx, policy))
+
+    @staticmethod
+    def _tx_words(data):
+        """Convert a packet to the form it is written to the FIFO in
+
+        Returns:
+            words (list or np.ndarray): np.uint32 array for buffer types (block transfer),
+                                        otherwise data unchanged
+        """
+        if isinstance(data, np.ndarray) and data.dtype == np.uint32:
+            return data.reshape(-1)
+        if isinstance(data, (np.ndarray, memoryview, bytes, bytearray)):
+            raw = memoryview(data).cast('B')
+            return np.frombuffer(raw, dtype=np.uint32, count=len(raw) >> 2)
+        return data
+
+    def _push_tx(self, words):
+        """Write a packet into the TX data FIFO and commit its length"""
+        num_tx = len(words)
+        # Writing a zero to hardware might be bad
+        if num_tx != 0 :
+            if isinstance(words, np.ndarray):
+                self._keyhole(self._tdfd_word, num_tx)[:] = words
+            else:
+                for i in words:
+                    self.write(self._tdfd, i)
+            # This FIFO reg counts bytes
+            self.write(self._tlr, num_tx << 2)
+
     def send_tx_pkt(self, data, wait_for_room=True):
         """
         Sends a list of integers (32-bit words) into the TX FIFO.
         If wait_for_room is True this will wait until there is room.
+
+        NumPy arrays, memoryviews and bytes are pushed into the FIFO with a single
+        block transfer (see send_tx_block).
         """
-        num_tx = len(data)
-        if type(data) is bytes :
-            num_tx >>= 2  # floors non 4 byte len
+        words = self._tx_words(data)
 
         if wait_for_room == True :
-            while num_tx > self.read_num_tx_room() :
-                pass
+            self.wait_for_tx_room(len(words))
+
+        self._push_tx(words)
+
+    def send_tx_block(self, data, wait_for_room=True):
+        """
+        Sends a packet of 32-bit words into the TX FIFO with one block transfer.
+
+        Arguments:
+            data (array_like): np.uint32 array, memoryview or bytes. Buffers that are not
+                                a multiple of 4 bytes long are truncated to whole words
+            wait_for_room (bool): if True, wait until there is room for the whole packet
+        """
+        self.send_tx_pkt(np.asarray(data, dtype=np.uint32) if isinstance(data, list) else data, wait_for_room)
+
+    async def send_tx_pkt_async(self, data, wait_for_room=True):
+        """
+        Awaitable version of send_tx_pkt that yields to the event loop while waiting for room.
+        """
+        words = self._tx_words(data)
+
+        if wait_for_room == True :
+            await self.wait_for_tx_room_async(len(words))
+
+        self._push_tx(words)
+
+    def benchmark_tx(self, num_words=256, repeats=10):
+        """
+        Compare TX throughput of the per-word loop and the block transfer.
+
+        Words are written into the data FIFO without committing a packet length, and
+        the TX FIFO is reset afterwards, so nothing is forwarded to the PL. Only run
+        this on a FIFO that is not in use.
+
+        Arguments:
+            num_words (int): words per packet, limited to the current FIFO vacancy
+            repeats (int): number of packets timed for each method
+
+        Returns:
+            rates (dict): words/s for 'loop' and 'block', and their ratio as 'speedup'
+        """
+        num_words = min(num_words, self.read_num_tx_room())
+        if num_words == 0:
+            raise RuntimeError('TX FIFO has no room, cannot run benchmark')
+        data = np.arange(num_words, dtype=np.uint32)
+        words = data.tolist()
+        elapsed = {'loop': 0.0, 'block': 0.0}
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for i in words:
+                self.write(self._reg_map.TDFD.address, i)
+            elapsed['loop'] += time.perf_counter() - start
+            self.write(self._tdfr, FIFO_RESET_KEY)
+            start = time.perf_counter()
+            self._keyhole(self._tdfd_word, num_words)[:] = data
+            elapsed['block'] += time.perf_counter() - start
+            self.write(self._tdfr, FIFO_RESET_KEY)
+        rates = {method: num_words * repeats / t for method, t in elapsed.items()}
+        rates['speedup'] = rates['block'] / rates['loop']
+        return rates
 
-        # Writing a zero to hardware might be bad
-        if num_tx != 0 :
-            if type(data) is bytes :
-                self.write(self._reg_map.TDFD.address, data)
-            else :
-                for i in data:
-                    self.write(self._reg_map.TDFD.address, i)
-            # This FIFO reg counts bytes
-            self.write(self._reg_map.TLR.address, num_tx << 2)
-   
     def read_num_rx_words(self):
         """
         Reads the number of 32-bit words in the RX FIFO yet to be read out
         """
-        return self.read(self._reg_map.RDFO.address)
-    
+        return self.read(self._rdfo)
+
+    def _rx_pkt_waiter(self, policy: FifoWaitPolicy = None):
+        return self._poll_until(
+            self.read_num_rx_words, lambda num_rx_words: num_rx_words != 0, 'an RX packet',
+            lambda num_rx_words: f'occupancy {num_rx_words} words', policy
+        )
+
+    def wait_for_rx_pkt(self, policy: FifoWaitPolicy = None):
+        """
+        Wait until the RX FIFO has data to read out, following the wait policy.
+
+        Arguments:
+            policy (FifoWaitPolicy): overrides self.wait_policy if supplied
+
+        Returns:
+            num_rx_words (int): number of 32-bit words in the RX FIFO
+
+        Raises:
+            FifoTimeoutError: if the RX FIFO is still empty after the policy timeout
+        """
+        return self._block_on(self._rx_pkt_waiter(policy))
+
+    async def wait_for_rx_pkt_async(self, policy: FifoWaitPolicy = None):
+        """Awaitable version of wait_for_rx_pkt that yields to the event loop while polling"""
+        return await self._await_on(self._rx_pkt_waiter(policy))
+
     def get_rx_fifo_pkt(self):
         """
         Pulls a single packet of data out of the RX FIFO.
         If there is no data to read, return an empty list
         """
-        if (self.read(self._reg_map.RDFO.address) == 0):
+        if (self.read(self._rdfo) == 0):
             return []
         out_data = []
-        num_rx_words = self.read(self._reg_map.RLR.address) >> 2  # Read number of words in packet
+        num_rx_words = self.read(self._rlr) >> 2  # Read number of words in packet
         for _ in range(num_rx_words):  # Read entire packet of data out
-            out_data.append(self.read(self._reg_map.RDFD.address))
-        return out_data
\ No newline at end of file
+            out_data.append(self.read(self._rdfd))
+        return out_data
+
+    def get_rx_fifo_array(self, out=None):
+        """
+        Pulls a single packet of data out of the RX FIFO into a np.uint32 array.
+
+        The whole packet is drained in one pass over the data register without going
+        through read() for every word. NumPy copies from a stride-0 view can't be used
+        here, since they load the source once and broadcast it. Instead, np.take gathers
+        the single-word view at an all-zero index array, which loads the register once
+        per word and writes straight into the result.
+
+        Arguments:
+            out (np.ndarray): optional np.uint32 buffer to read into, so that repeated
+                                polling doesn't allocate. Must hold the whole packet
+
+        Returns:
+            packet (np.ndarray): packet words; a view of out if it was supplied. Empty if
+                                there is no data to read
+
+        Raises:
+            ValueError: if out can't hold the packet. The packet is drained and dropped,
+                        so the FIFO stays aligned to packet boundaries
+        """
+        if (self.read(self._rdfo) == 0):
+            return np.empty(0, dtype=np.uint32) if out is None else out[:0]
+        num_rx_words = self.read(self._rlr) >> 2  # Read number of words in packet
+        if out is None:
+            out = np.empty(num_rx_words, dtype=np.uint32)
+        elif len(out) < num_rx_words:
+            # drain the packet anyway so the FIFO stays aligned to packet boundaries
+            for _ in map(self._rdfd_word.item, repeat(0, num_rx_words)):
+                pass
+            raise ValueError(
+                f'output buffer holds {len(out)} words but packet has {num_rx_words}, packet dropped'
+            )
+        if len(self._rx_index) < num_rx_words:
+            self._rx_index = np.zeros(num_rx_words, dtype=np.intp)
+        # mode='clip' keeps np.take from buffering the output (it does for mode='raise')
+        return np.take(self._rdfd_word, self._rx_index[:num_rx_words], out=out[:num_rx_words], mode='clip')
+
+    async def get_rx_fifo_array_async(self, out=None, policy: FifoWaitPolicy = None):
+        """
+        Wait for a packet without blocking the event loop, then read it with get_rx_fifo_array.
+
+        Arguments:
+            out (np.ndarray): optional np.uint32 buffer to read into
+            policy (FifoWaitPolicy): overrides self.wait_policy if supplied
+
+        Raises:
+            FifoTimeoutError: if no packet arrives within the policy timeout
+        """
+        await self.wait_for_rx_pkt_async(policy)
+        return self.get_rx_fifo_array(out)
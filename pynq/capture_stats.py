@@ -0,0 +1,123 @@
+import numpy as np
+
+class CaptureStatistics:
+    """Per-channel running statistics of captured samples, accumulated across captures
+
+    Samples are fed in slices (e.g. one DMA buffer bank at a time) and never stored.
+    Each slice is reduced to its exact int64 sum and sum of squares, which numpy
+    accumulates through small cast buffers instead of a widened copy of the slice. The
+    slice is then merged into the running count, mean and sum of squared deviations
+    with the parallel form of Welford's update (Chan et al.), which stays accurate over
+    billions of samples. Threshold crossings are counted across slice boundaries within
+    a capture, but not across captures.
+
+    Attributes:
+        thresholds (np.ndarray): per channel, level whose upward crossings are counted
+        count (np.ndarray): per channel, number of samples
+        mean (np.ndarray): per channel, mean sample value
+        m2 (np.ndarray): per channel, sum of squared deviations from the mean
+        min (np.ndarray): per channel, minimum sample value
+        max (np.ndarray): per channel, maximum sample value
+        crossings (np.ndarray): per channel, number of samples above the threshold
+                                whose predecessor was at or below it
+        captures (np.ndarray): per channel, number of captures with samples
+    """
+    summary_dtype = np.dtype([
+        ('channel', np.int64),
+        ('count', np.int64),
+        ('mean', np.float64),
+        ('std', np.float64),
+        ('min', np.int64),
+        ('max', np.int64),
+        ('crossings', np.int64),
+        ('captures', np.int64),
+    ])
+
+    def __init__(self, num_channels: int, thresholds: list[int] = None):
+        """
+        Arguments:
+            num_channels (int): number of channels
+            thresholds (list[int]): per channel, crossing level in (signed) sample units, defaults to 0
+        """
+        self.num_channels = num_channels
+        self.thresholds = np.zeros(num_channels, dtype=np.int64) if thresholds is None else np.array(thresholds, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        """Clear all statistics, keeping the thresholds"""
+        self.count = np.zeros(self.num_channels, dtype=np.int64)
+        self.mean = np.zeros(self.num_channels, dtype=np.float64)
+        self.m2 = np.zeros(self.num_channels, dtype=np.float64)
+        self.min = np.full(self.num_channels, np.iinfo(np.int64).max, dtype=np.int64)
+        self.max = np.full(self.num_channels, np.iinfo(np.int64).min, dtype=np.int64)
+        self.crossings = np.zeros(self.num_channels, dtype=np.int64)
+        self.captures = np.zeros(self.num_channels, dtype=np.int64)
+        # last sample of each channel in the current capture, for crossings between slices
+        self._last = [None] * self.num_channels
+
+    def _merge(self, channel: int, count: int, mean: float, m2: float):
+        total = self.count[channel] + count
+        delta = mean - self.mean[channel]
+        self.mean[channel] += delta * count / total
+        self.m2[channel] += m2 + delta * delta * self.count[channel] * count / total
+        self.count[channel] = total
+
+    def update(self, channel: int, samples: np.ndarray):
+        """Add a slice of samples of one channel from the current capture
+
+        Arguments:
+            channel (int): channel of the samples
+            samples (np.ndarray): int16 samples (raw uint16 ADC words are reinterpreted as int16)
+        """
+        if len(samples) == 0:
+            return
+        if samples.dtype == np.uint16:
+            samples = samples.view(np.int16)
+        count = len(samples)
+        total = int(samples.sum(dtype=np.int64))
+        squares = int(np.einsum('i,i->', samples, samples, dtype=np.int64))
+        # exact in integers until the final division
+        self._merge(channel, count, total / count, (squares * count - total * total) / count)
+        self.min[channel] = min(self.min[channel], int(samples.min()))
+        self.max[channel] = max(self.max[channel], int(samples.max()))
+        above = samples > self.thresholds[channel]
+        crossings = np.count_nonzero(above[1:] & ~above[:-1])
+        last = self._last[channel]
+        if last is not None and last <= self.thresholds[channel] and above[0]:
+            crossings += 1
+        if last is None:
+            self.captures[channel] += 1
+        self.crossings[channel] += crossings
+        self._last[channel] = int(samples[-1])
+
+    def end_capture(self):
+        """Mark the end of a capture, so crossings aren't counted across captures"""
+        self._last = [None] * self.num_channels
+
+    def merge(self, other):
+        """Add the statistics of another CaptureStatistics with the same channels"""
+        for channel in range(self.num_channels):
+            if other.count[channel] > 0:
+                self._merge(channel, int(other.count[channel]), float(other.mean[channel]), float(other.m2[channel]))
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.crossings += other.crossings
+        self.captures += other.captures
+
+    def summary(self):
+        """Statistics of every channel
+
+        Returns:
+            summary (np.ndarray): structured array with one record per channel and fields
+                                    channel, count, mean, std, min, max, crossings, captures
+        """
+        summary = np.zeros(self.num_channels, dtype=self.summary_dtype)
+        summary['channel'] = np.arange(self.num_channels)
+        summary['count'] = self.count
+        summary['mean'] = self.mean
+        summary['std'] = np.sqrt(np.divide(self.m2, self.count, out=np.zeros_like(self.m2), where=self.count > 0))
+        summary['min'] = np.where(self.count > 0, self.min, 0)
+        summary['max'] = np.where(self.count > 0, self.max, 0)
+        summary['crossings'] = self.crossings
+        summary['captures'] = self.captures
+        return summary
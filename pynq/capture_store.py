@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+
+def config_hash(config: dict):
+    """64-bit hash of a JSON-serializable configuration, independent of key order"""
+    text = json.dumps(config, sort_keys=True, default=_to_json)
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little')
+
+def _to_json(value):
+    # numpy scalars and arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+class CaptureStore:
+    """Append-only on-disk store for the captures of a long run
+
+    A store is a directory holding one flat binary file per column, a fixed-width
+    index with one record per capture, and a JSON metadata sidecar:
+
+        meta.json           fields, dtypes, channel counts, and configs by hash
+        index.bin           per capture: offset and length of every column (in
+                            elements), config hash, time, and label
+        <field>.bin         columns of fields with a single array per capture
+        <field>_<n>.bin     columns of per-channel fields (list of arrays per capture)
+
+    The fields are fixed by the first capture appended. Appending writes the column
+    data before the index record, so a capture is only visible once it was written
+    completely, and an interrupted append leaves the store readable. Reading a capture
+    memory-maps only the columns that are requested, without loading the rest.
+
+    Usage:
+        store = CaptureStore('data/run0')
+        n = store.append({'timestamps': timestamps, 'samples': samples}, config=config)
+        samples = store.read(n, fields=['samples'], channels=[0, 2])['samples']
+    """
+    index_file = 'index.bin'
+    meta_file = 'meta.json'
+    label_length = 64
+
+    def __init__(self, path: str, mode: str = 'a'):
+        """Open or create a store
+
+        Arguments:
+            path (str): directory of the store
+            mode (str): 'a' to append (creating the store if needed), 'r' for read-only
+        """
+        if mode not in ('a', 'r'):
+            raise ValueError(f"mode must be 'a' or 'r', got {mode}")
+        self.path = path
+        self.mode = mode
+        self.fields = {}
+        self.configs = {}
+        self._index_dtype = None
+        self._files = {}
+        # column name -> memmap of the column, remapped when it has grown
+        self._maps = {}
+        self._index = None
+        meta = os.path.join(path, self.meta_file)
+        if os.path.exists(meta):
+            with open(meta) as f:
+                self._set_meta(json.load(f))
+        elif mode == 'r':
+            raise FileNotFoundError(f'no capture store at {path}')
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    def _set_meta(self, meta: dict):
+        self.fields = {name: (np.dtype(field['dtype']), field['channels']) for name, field in meta['fields'].items()}
+        self.configs = {int(key): config for key, config in meta['configs'].items()}
+        num_columns = len(self.columns)
+        self._index_dtype = np.dtype([
+            ('offset', '<i8', (num_columns,)),
+            ('length', '<i8', (num_columns,)),
+            ('config', '<u8'),
+            ('time', '<f8'),
+            ('label', f'S{self.label_length}'),
+        ])
+
+    def _write_meta(self):
+        meta = {
+            'fields': {name: {'dtype': dtype.str, 'channels': channels} for name, (dtype, channels) in self.fields.items()},
+            'configs': {str(key): config for key, config in self.configs.items()},
+        }
+        # write to a temporary file first so the sidecar is never left half-written
+        path = os.path.join(self.path, self.meta_file)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f, default=_to_json)
+        os.replace(path + '.tmp', path)
+
+    @property
+    def columns(self):
+        """Names of all columns, in index order"""
+        columns = []
+        for name, (dtype, channels) in self.fields.items():
+            if channels is None:
+                columns.append(name)
+            else:
+                columns.extend(f'{name}_{channel}' for channel in range(channels))
+        return columns
+
+    def __len__(self):
+        """Number of captures in the store"""
+        if self._index_dtype is None:
+            return 0
+        path = os.path.join(self.path, self.index_file)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // self._index_dtype.itemsize
+
+    def _file(self, column: str):
+        if column not in self._files:
+            self._files[column] = open(os.path.join(self.path, f'{column}.bin'), 'ab')
+        return self._files[column]
+
+    @classmethod
+    def check_label(cls, label: str):
+        """Raise ValueError if label doesn't fit in an index record
+
+        Call before acquiring a capture, so it isn't lost when it can't be appended.
+        """
+        if len(label.encode()) > cls.label_length:
+            raise ValueError(f'label {label} is longer than {cls.label_length} bytes')
+
+    def append(self, data: dict, config: dict = None, label: str = ''):
+        """Append a capture
+
+        Arguments:
+            data (dict): field name -> array, or list of arrays (one per channel)
+            config (dict): JSON-serializable settings of the capture; identical configs
+                            are only stored once
+            label (str): short name of the capture (at most 64 bytes)
+
+        Returns:
+            capture (int): index of the new capture
+        """
+        if self.mode == 'r':
+            raise PermissionError(f'capture store {self.path} is read-only')
+        if not self.fields:
+            for name, value in data.items():
+                if isinstance(value, (list, tuple)):
+                    self.fields[name] = (np.asarray(value[0]).dtype, len(value))
+                else:
+                    self.fields[name] = (np.asarray(value).dtype, None)
+            self._set_meta({
+                'fields': {name: {'dtype': dtype.str, 'channels': channels} for name, (dtype, channels) in self.fields.items()},
+                'configs': {},
+            })
+            self._write_meta()
+        elif set(data) != set(self.fields):
+            raise ValueError(f'capture has fields {sorted(data)}, store has {sorted(self.fields)}')
+        self.check_label(label)
+        key = 0
+        if config is not None:
+            key = config_hash(config)
+            if key not in self.configs:
+                self.configs[key] = json.loads(json.dumps(config, default=_to_json))
+                self._write_meta()
+        record = np.zeros(1, dtype=self._index_dtype)
+        columns = self.columns
+        column = 0
+        for name, (dtype, channels) in self.fields.items():
+            arrays = [data[name]] if channels is None else data[name]
+            if channels is not None and len(arrays) != channels:
+                raise ValueError(f'{name} has {len(arrays)} channels, expected {channels}')
+            for array in arrays:
+                array = np.ascontiguousarray(array, dtype=dtype).reshape(-1)
+                f = self._file(columns[column])
+                # offset from the file size, so a partially written capture is skipped over
+                record['offset'][0, column] = f.seek(0, os.SEEK_END) // dtype.itemsize
+                record['length'][0, column] = array.size
+                f.write(array.data)
+                column += 1
+        for f in self._files.values():
+            f.flush()
+        record['config'] = key
+        record['time'] = time.time()
+        record['label'] = label.encode()
+        with open(os.path.join(self.path, self.index_file), 'ab') as f:
+            f.write(record.data)
+        return len(self) - 1
+
+    def index(self):
+        """Memory-mapped index with one record per capture"""
+        num_captures = len(self)
+        if num_captures == 0:
+            return np.zeros(0, dtype=self._index_dtype)
+        if self._index is None or len(self._index) < num_captures:
+            self._index = np.memmap(os.path.join(self.path, self.index_file), dtype=self._index_dtype,
+                                    mode='r', shape=(num_captures,))
+        return self._index[:num_captures]
+
+    def _column(self, column: str, dtype: np.dtype, end: int):
+        """Memory map of a column covering at least the first end elements"""
+        array = self._maps.get(column)
+        if array is None or len(array) < end:
+            path = os.path.join(self.path, f'{column}.bin')
+            array = np.memmap(path, dtype=dtype, mode='r', shape=(os.path.getsize(path) // dtype.itemsize,))
+            self._maps[column] = array
+        return array
+
+    def read(self, capture: int, fields: list[str] = None, channels: list[int] = None):
+        """Read a capture without loading other captures or unrequested columns
+
+        Arguments:
+            capture (int): index of the capture, negative values count from the end
+            fields (list[str]): fields to read, defaults to all fields
+            channels (list[int]): channels to read of per-channel fields, defaults to all
+                                    channels; other channels are returned as empty arrays
+
+        Returns:
+            data (dict): field name -> read-only memmap view, or list of views for
+                            per-channel fields, plus 'config' (dict) and 'label' (str)
+        """
+        index = self.index()
+        record = index[capture]
+        columns = self.columns
+        data = {}
+        for name in (self.fields if fields is None else fields):
+            dtype, num_channels = self.fields[name]
+            if num_channels is None:
+                data[name] = self._read_column(record, columns.index(name), name, dtype)
+                continue
+            first = columns.index(f'{name}_0')
+            wanted = range(num_channels) if channels is None else channels
+            data[name] = [
+                self._read_column(record, first + channel, f'{name}_{channel}', dtype)
+                if channel in wanted else np.zeros(0, dtype=dtype)
+                for channel in range(num_channels)
+            ]
+        data['config'] = self.configs.get(int(record['config']), {})
+        data['label'] = record['label'].decode()
+        return data
+
+    def _read_column(self, record, column: int, name: str, dtype: np.dtype):
+        offset = int(record['offset'][column])
+        length = int(record['length'][column])
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return self._column(name, dtype, offset + length)[offset:offset+length]
+
+    def __getitem__(self, capture: int):
+        return self.read(capture)
+
+    def __iter__(self):
+        for capture in range(len(self)):
+            yield self.read(capture)
+
+    def find(self, label: str):
+        """Index of the last capture with the given label, or -1 if there is none"""
+        matches = np.flatnonzero(self.index()['label'] == label.encode())
+        return int(matches[-1]) if len(matches) > 0 else -1
+
+    def close(self):
+        """Close files opened for appending and drop memory maps"""
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self._maps = {}
+        self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
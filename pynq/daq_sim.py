@@ -0,0 +1,877 @@
+import os
+import sys
+import math
+import time
+import types
+import tempfile
+from collections import deque
+import numpy as np
+
+class SimBuffer(np.ndarray):
+    """Host memory standing in for a contiguous DMA buffer from pynq.allocate"""
+    def freebuffer(self):
+        pass
+
+    def close(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def invalidate(self):
+        pass
+
+def sim_allocate(shape, dtype=np.uint32, **kwargs):
+    """Allocate a SimBuffer, called like pynq.allocate"""
+    return np.zeros(shape, dtype=dtype).view(SimBuffer)
+
+def _stand_in_pynq():
+    """Module with the parts of pynq used by the overlay code: Overlay, DefaultIP and allocate"""
+    module = types.ModuleType('pynq')
+
+    class DefaultIP:
+        def __init__(self, description):
+            self.description = description
+
+    class Overlay:
+        def __init__(self, bitfile_name, download=True, **kwargs):
+            self.bitfile_name = bitfile_name
+            # like pynq, which programs the PL while constructing the overlay
+            if download:
+                self.download()
+
+        def download(self, *args, **kwargs):
+            pass
+
+    module.DefaultIP = DefaultIP
+    module.Overlay = Overlay
+    module.allocate = sim_allocate
+    return module
+
+def _stand_in_xrfclk():
+    """Module with a set_ref_clks that does nothing, there are no clock synthesizers to program"""
+    module = types.ModuleType('xrfclk')
+    module.set_ref_clks = lambda lmk_freq=122.88, lmx_freq=409.6: None
+    return module
+
+def install_stand_ins():
+    """Register stand-ins for pynq and xrfclk if they can't be imported
+
+    On a board the real modules are used (only the PL is simulated). Elsewhere the
+    stand-ins let the overlay modules be imported, and allocate DMA buffers in host memory.
+
+    Returns:
+        installed (list[str]): names of the modules that were replaced by stand-ins
+    """
+    installed = []
+    for name, stand_in in (('pynq', _stand_in_pynq), ('xrfclk', _stand_in_xrfclk)):
+        try:
+            __import__(name)
+        except ImportError:
+            sys.modules[name] = stand_in()
+            installed.append(name)
+    return installed
+
+# has to happen before the overlay modules are imported, they import pynq and xrfclk
+STAND_INS = install_stand_ins()
+
+from pynq import Overlay
+from axififo import AxiStreamFifoDriver, FifoWaitPolicy, FifoWaitStats, FIFO_RESET_KEY
+from adc_layout import AdcBufferLayout
+from rfsoc_daq_overlay import DAQOverlay
+
+class SimLatency:
+    """Timing model of the simulated hardware
+
+    Host-side costs are spent by busy-waiting, so that code paths can be compared as
+    they would be on the board: every FIFO register access takes mmio_access_s. The PL
+    side runs on simulated time: the PL takes a TX FIFO packet fifo_word_s per word
+    after it was committed (or after the PL accepts it, for registers that are only
+    accepted in some states), and a DMA transfer completes dma_setup_s plus
+    nbytes / dma_bytes_per_s after it was started.
+    """
+    def __init__(self,
+                 mmio_access_s: float = 0.0,
+                 fifo_word_s: float = 10e-9,
+                 dma_setup_s: float = 20e-6,
+                 dma_bytes_per_s: float = 1.2e9):
+        """
+        Arguments:
+            mmio_access_s (float): time per AXI-lite register read or write, e.g. 0.5e-6
+            fifo_word_s (float): time for the PL to take one word out of a TX FIFO
+            dma_setup_s (float): time from starting a DMA transfer until data moves
+            dma_bytes_per_s (float): DMA throughput
+        """
+        self.mmio_access_s = mmio_access_s
+        self.fifo_word_s = fifo_word_s
+        self.dma_setup_s = dma_setup_s
+        self.dma_bytes_per_s = dma_bytes_per_s
+
+    def dma_time(self, nbytes: int):
+        """Duration of a DMA transfer of nbytes"""
+        return self.dma_setup_s + nbytes / self.dma_bytes_per_s
+
+    def access(self, num_accesses: int = 1):
+        """Spend the time of num_accesses register accesses"""
+        if self.mmio_access_s > 0:
+            end = time.perf_counter() + num_accesses * self.mmio_access_s
+            while time.perf_counter() < end:
+                pass
+
+class SimSignal:
+    """Synthetic ADC input: identical pulses at a fixed rate on top of Gaussian noise
+
+    The discriminator of a channel either saves every word (when it is bypassed, or its
+    high threshold is below the noise), nothing (high threshold above the pulses), or
+    event_cycles words around each pulse, with one timestamp per pulse.
+    """
+    def __init__(self,
+                 event_rate_hz: float = 2e6,
+                 event_cycles: int = 4,
+                 amplitude: int = 12000,
+                 decay_samples: float = 6.0,
+                 noise: float = 200.0,
+                 seed: int = 0):
+        """
+        Arguments:
+            event_rate_hz (float): pulses per second on each channel
+            event_cycles (int): words (of 8 samples) saved per pulse
+            amplitude (int): peak of each pulse
+            decay_samples (float): exponential decay time of the pulses in samples
+            noise (float): standard deviation of the noise
+            seed (int): seed of the noise and pulse times
+        """
+        self.event_rate_hz = event_rate_hz
+        self.event_cycles = event_cycles
+        self.amplitude = amplitude
+        self.decay_samples = decay_samples
+        self.noise = noise
+        self.seed = seed
+        self.reset()
+
+    def reset(self):
+        """Restart the random sequence"""
+        self.rng = np.random.default_rng(self.seed)
+        # captures take slices of a fixed noise record instead of drawing new noise
+        self._noise = np.round(self.rng.standard_normal(1 << 19) * self.noise).astype(np.int16)
+        n = np.arange(self.event_cycles * 8)
+        self._pulse = np.round(self.amplitude * np.exp(-np.maximum(n - 8, 0) / self.decay_samples))
+        self._pulse[:8] = 0
+
+    def mode(self, high_threshold: int, bypass: bool):
+        """What the discriminator of a channel saves: 'continuous', 'events' or 'none'
+
+        Arguments:
+            high_threshold (int): signed high threshold of the channel
+            bypass (bool): True if the discriminator is bypassed
+        """
+        if bypass or high_threshold < -4 * self.noise:
+            return 'continuous'
+        if high_threshold >= self.amplitude:
+            return 'none'
+        return 'events'
+
+    def _noise_slice(self, num_samples: int):
+        start = int(self.rng.integers(0, len(self._noise) - num_samples + 1))
+        return self._noise[start:start + num_samples]
+
+    def samples(self, mode: str, num_words: int):
+        """int16 samples of num_words saved words"""
+        samples = self._noise_slice(num_words * 8).copy()
+        if mode == 'events':
+            pulses = samples.reshape(-1, self.event_cycles * 8)
+            pulses += self._pulse.astype(np.int16)
+        return samples
+
+class _SimIP:
+    """IP in the simulated block design, holding a driver like the fifo of daq.<name>"""
+    def __init__(self, fifo):
+        self.fifo = fifo
+
+class _SimGpioChannel:
+    def __init__(self, value: int):
+        self.value = value
+
+    def __getitem__(self, index: slice):
+        start = 0 if index.start is None else index.start
+        return _SimGpioChannel((self.value >> start) & ((1 << (index.stop - start)) - 1))
+
+    def read(self):
+        return self.value
+
+class SimGpio:
+    """AXI GPIO with constant inputs, sliced and read like a pynq AxiGPIO channel"""
+    def __init__(self, value: int):
+        self.channel1 = _SimGpioChannel(value)
+
+class _SimDataRegister:
+    """RDFD as seen through the single-word view used by get_rx_fifo_array"""
+    def __init__(self, fifo):
+        self._fifo = fifo
+
+    def item(self, index: int):
+        self._fifo.device.latency.access()
+        return self._fifo._read_data()
+
+    def take(self, indices, axis=None, out=None, mode='raise'):
+        # np.take hands non-arrays to their take method, read one word per index
+        out = np.empty(len(indices), dtype=np.uint32) if out is None else out
+        for n in range(len(indices)):
+            out[n] = self.item(0)
+        return out
+
+class SimFifo(AxiStreamFifoDriver):
+    """AxiStreamFifoDriver whose registers are modelled instead of memory mapped
+
+    Committed TX packets stay in the FIFO until the SimDAQ hands them to the PL, which
+    only accepts some registers in some states (e.g. the banking mode while no capture
+    is held), so read_num_tx_room reports the same occupancy as the hardware would. RX
+    packets are pushed by the SimDAQ.
+
+    Attributes:
+        tx_packets (deque): committed packets the PL hasn't taken, as (words, commit time)
+        tx_overflows (int): words written while the TX FIFO was full, which are lost
+    """
+    # register offsets of axi_fifo_mm_s
+    _offsets = {'ISR': 0x0, 'IER': 0x4, 'TDFR': 0x8, 'TDFV': 0xc, 'TDFD': 0x10, 'TLR': 0x14,
+                'RDFR': 0x18, 'RDFO': 0x1c, 'RDFD': 0x20, 'RLR': 0x24}
+
+    def __init__(self, name: str, device, depth: int = 512):
+        """
+        Arguments:
+            name (str): name of the FIFO in the block design
+            device (SimDAQ): model of the PL the FIFO is connected to
+            depth (int): TX FIFO depth in words
+        """
+        # DefaultIP maps the register space of the IP, which doesn't exist here
+        self.name = name
+        self.device = device
+        self._tx_fifo_depth = depth
+        self.wait_policy = FifoWaitPolicy()
+        self.wait_stats = FifoWaitStats()
+        self._reg_map = types.SimpleNamespace(
+            **{reg: types.SimpleNamespace(address=offset) for reg, offset in self._offsets.items()}
+        )
+        self._tdfr = self._offsets['TDFR']
+        self._tdfv = self._offsets['TDFV']
+        self._tdfd = self._offsets['TDFD']
+        self._tlr = self._offsets['TLR']
+        self._rdfo = self._offsets['RDFO']
+        self._rlr = self._offsets['RLR']
+        self._rdfd = self._offsets['RDFD']
+        # block writes to TDFD are intercepted in _push_tx, this only absorbs benchmark_tx
+        self._tdfd_word = np.zeros(1, dtype=np.uint32)
+        self._rdfd_word = _SimDataRegister(self)
+        self._rx_index = np.zeros(0, dtype=np.intp)
+        self.reset()
+
+    def reset(self):
+        """Empty both FIFOs"""
+        self._tx_data = []
+        self.tx_packets = deque()
+        self._rx_packets = deque()
+        self._rx_packet = deque()
+        self.tx_overflows = 0
+        # time the PL finished taking the previous packet, and whether the head packet was refused
+        self._taken_s = 0.0
+        self._blocked = False
+
+    @property
+    def register_map(self):
+        return self._reg_map
+
+    def tx_occupancy(self):
+        """Words in the TX FIFO, committed or not"""
+        return len(self._tx_data) + sum(len(words) for words, commit_s in self.tx_packets)
+
+    def push_rx(self, packet: list[int]):
+        """Make a packet available to the PS, called by the PL model"""
+        self._rx_packets.append(packet)
+
+    def _read_data(self):
+        return self._rx_packet.popleft() if len(self._rx_packet) > 0 else 0
+
+    def read(self, offset: int):
+        self.device.latency.access()
+        if offset == self._tdfv:
+            self.device.advance()
+            return self._tx_fifo_depth - self.tx_occupancy()
+        if offset == self._rdfo:
+            self.device.advance()
+            return len(self._rx_packet) + sum(len(packet) for packet in self._rx_packets)
+        if offset == self._rlr:
+            if len(self._rx_packets) == 0:
+                return 0
+            self._rx_packet = deque(self._rx_packets.popleft())
+            return len(self._rx_packet) << 2
+        if offset == self._rdfd:
+            return self._read_data()
+        return 0
+
+    def write(self, offset: int, value: int):
+        self.device.latency.access()
+        if offset == self._tdfd:
+            self._write_data([value])
+        elif offset == self._tlr:
+            num_words = value >> 2
+            words, self._tx_data = self._tx_data[:num_words], self._tx_data[num_words:]
+            self.tx_packets.append((words, time.perf_counter()))
+            self.device.advance()
+        elif offset == self._tdfr and value == FIFO_RESET_KEY:
+            self._tx_data = []
+            self.tx_packets.clear()
+        elif offset == self._offsets['RDFR'] and value == FIFO_RESET_KEY:
+            self._rx_packets.clear()
+            self._rx_packet.clear()
+
+    def _write_data(self, words: list[int]):
+        room = self._tx_fifo_depth - self.tx_occupancy()
+        self.tx_overflows += max(len(words) - room, 0)
+        self._tx_data.extend(int(word) for word in words[:room])
+
+    def _push_tx(self, words):
+        if isinstance(words, np.ndarray) and len(words) != 0:
+            # the block transfer stores straight into the register array, which can't be observed
+            self.device.latency.access(len(words))
+            self._write_data(words.tolist())
+            self.write(self._tlr, len(words) << 2)
+        else:
+            super()._push_tx(words)
+
+class SimDmaChannel:
+    """DMA channel with the interface of a pynq send or receive channel
+
+    The transfer is served by the SimDAQ: data is moved when the PL starts producing
+    or consuming it, and the channel becomes idle after the latency of the transfer.
+    A transfer the PL never serves (e.g. a readout that wasn't started) never completes.
+
+    Attributes:
+        name (str): 'awg' or 'adc'
+        transfers (int): number of transfers started
+        bytes (int): number of bytes moved
+    """
+    def __init__(self, name: str, device):
+        self.name = name
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        """Abort any transfer in progress"""
+        # (buffer, start, nbytes) of a transfer the PL hasn't served yet
+        self.request = None
+        # completion time of the transfer in progress, None when idle
+        self.done_s = None
+        self._on_done = None
+        self.transfers = 0
+        self.bytes = 0
+
+    @property
+    def running(self):
+        return True
+
+    @property
+    def idle(self):
+        self.device.advance()
+        return self.done_s is None
+
+    def transfer(self, array, start: int = 0, nbytes: int = 0):
+        """Start a transfer of nbytes from byte start of array, 0 transfers the rest of array"""
+        if not self.idle:
+            raise RuntimeError(f'{self.name} DMA channel not idle')
+        self.request = (array, start, nbytes if nbytes > 0 else array.nbytes - start)
+        self.done_s = math.inf
+        self.transfers += 1
+        self.device.serve_dma(self, time.perf_counter())
+
+    def served(self, nbytes: int, t: float, on_done=None):
+        """Called by the PL model when it moved nbytes of the request at time t"""
+        self.request = None
+        self.bytes += nbytes
+        self.done_s = t + self.device.latency.dma_time(nbytes)
+        self._on_done = on_done
+
+    def complete(self, t: float):
+        self.done_s = None
+        on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            on_done(t)
+
+    def wait(self):
+        """Block until the transfer completes"""
+        while not self.idle:
+            if self.done_s == math.inf:
+                raise RuntimeError(f'{self.name} DMA transfer is not being served by the PL and would never complete')
+            time.sleep(max(self.done_s - time.perf_counter(), 0))
+
+class SimDAQ:
+    """Behavioural model of the rfsoc_daq PL, seen through SimFifo and SimDmaChannel
+
+    Models the state machines that the PS interacts with, following the RTL (capture and
+    readout in buffer.sv, DMA handling in awg.sv), in simulated time:
+        - capture: idle -> trigger_wait (arm) -> save (software start or AWG trigger)
+          -> hold (stop, or a bank of an active channel filled) -> idle (readout done or
+          capture reset). The banking mode is only accepted in idle, and capture
+          commands are not accepted in hold.
+        - readout: idle -> ready (capture done or readout reset) -> active (readout start)
+          -> idle (the whole buffer was transferred).
+        - AWG DMA: idle -> accepting (frame depth) -> blocking (DMA done) -> idle (AWG
+          stopped or bursts done). Burst length and trigger settings are only accepted
+          in idle, and start/stop not in accepting. The DAC side only latches frame
+          depths, burst lengths and trigger settings on the frame depth packet.
+    Refused packets wait in their TX FIFO until the state changes. When a capture ends,
+    SimSignal samples are written to the buffer memory and the write depth packets are
+    pushed to their RX FIFOs. The readout streams the buffer memory into the ADC DMA
+    buffer when the transfer starts, and the AWG DMA error code is pushed once the AWG
+    transfer completes.
+
+    Attributes:
+        latency (SimLatency): timing model
+        signal (SimSignal): ADC input
+        layout (AdcBufferLayout): layout of the buffer memory and readout
+        fifos (dict[str, SimFifo]): FIFOs by name in the block design
+        sendchannel, recvchannel (SimDmaChannel): AWG and ADC DMA channels
+        registers (dict[str, list[int]]): last packet the PL took from each FIFO
+        captures (int): number of completed captures
+    """
+    fifo_names = (
+        'awg_burst_length', 'awg_frame_depth', 'awg_start_stop', 'awg_trigger_config',
+        'capture_arm_start_stop', 'capture_banking_mode', 'capture_sw_reset',
+        'capture_trigger_config', 'readout_start', 'readout_sw_reset',
+        'discriminator_bypass', 'discriminator_trigger_source',
+        'sample_discriminator_delays', 'sample_discriminator_thresholds',
+        'receive_channel_mux_config', 'transmit_channel_mux', 'lmh6401_config',
+        'dac_scale_offset', 'dds_phase_inc', 'tri_phase_inc',
+        'awg_dma_error', 'samples_write_depth', 'timestamps_write_depth',
+    )
+    # afe_pgood with every rail good (the 2.7V pgood is inverted)
+    pgood_nominal = (0x3f ^ 0x4) << 1
+
+    def __init__(self,
+                 latency: SimLatency = None,
+                 signal: SimSignal = None,
+                 num_channels: int = 8,
+                 tstamp_depth: int = 512,
+                 data_depth: int = 4096,
+                 awg_frame_depth_max: int = 2048,
+                 fifo_depth: int = 512):
+        """
+        Arguments:
+            latency (SimLatency): timing model, defaults to SimLatency()
+            signal (SimSignal): ADC input, defaults to SimSignal()
+            num_channels (int): number of ADC/DAC channels
+            tstamp_depth (int): entries per timestamp bank
+            data_depth (int): entries per sample bank
+            awg_frame_depth_max (int): words per AWG channel
+            fifo_depth (int): TX depth of the config FIFOs in words
+        """
+        self.latency = SimLatency() if latency is None else latency
+        self.signal = SimSignal() if signal is None else signal
+        self.num_channels = num_channels
+        self.layout = AdcBufferLayout(num_channels, tstamp_depth, data_depth, 64, 128)
+        self.adc_cycles_per_s = 512e6
+        self.dac_words_per_s = 384e6
+        self._awg_depth_bits = (awg_frame_depth_max - 1).bit_length()
+        self._awg_frame_depth_max = awg_frame_depth_max
+        self.fifos = {name: SimFifo(name, self, fifo_depth) for name in self.fifo_names}
+        self.sendchannel = SimDmaChannel('awg', self)
+        self.recvchannel = SimDmaChannel('adc', self)
+        self.afe_pgood = SimGpio(self.pgood_nominal)
+        # PL side of each config FIFO, returning False to refuse a packet
+        self._handlers = {
+            'capture_arm_start_stop': self._capture_command,
+            'capture_banking_mode': self._banking_mode,
+            'capture_sw_reset': self._capture_reset,
+            'readout_start': self._readout_start,
+            'readout_sw_reset': self._readout_reset,
+            'awg_frame_depth': self._awg_frame_depth,
+            'awg_burst_length': self._awg_idle_only,
+            'awg_trigger_config': self._awg_idle_only,
+            'awg_start_stop': self._awg_start_stop,
+        }
+        self.reset()
+
+    def reset(self):
+        """Return to the power-on state, as after downloading the bitstream"""
+        for fifo in self.fifos.values():
+            fifo.reset()
+        self.sendchannel.reset()
+        self.recvchannel.reset()
+        self.signal.reset()
+        self.registers = {}
+        self.captures = 0
+        self.active_channels = self.num_channels
+        self.capture_state = 'idle'
+        self.readout_state = 'idle'
+        self.awg_state = 'idle'
+        self._t0 = time.perf_counter()
+        self._memory = np.zeros(self.layout.size, dtype=np.uint16)
+        self._readout_pos = 0
+        self._capture_start_s = 0.0
+        self._capture_full_s = math.inf
+        self._awg_done_s = None
+        self._latch_awg_config()
+
+    # register contents, as written by DAQOverlay
+
+    def _fields(self, name: str, bits: int, default: int = 0):
+        """Split the last packet of a FIFO into num_channels fields of bits bits"""
+        word = 0
+        for n, packet_word in enumerate(self.registers.get(name, [])):
+            word |= int(packet_word) << (32 * n)
+        if name not in self.registers:
+            return [default] * self.num_channels
+        return [(word >> (bits * channel)) & ((1 << bits) - 1) for channel in range(self.num_channels)]
+
+    def _channel_mode(self, channel: int):
+        bypass = (self._fields('discriminator_bypass', self.num_channels)[0] >> channel) & 1
+        high = self._fields('sample_discriminator_thresholds', 32)[channel] >> 16
+        high -= (high & 0x8000) << 1
+        return self.signal.mode(high, bypass)
+
+    # simulated time
+
+    def advance(self, now: float = None):
+        """Run the PL up to now, in order of event time"""
+        now = time.perf_counter() if now is None else now
+        while True:
+            t, event = math.inf, None
+            if self.capture_state == 'save' and self._capture_full_s < t:
+                t, event = self._capture_full_s, self._end_capture
+            if self._awg_done_s is not None and self._awg_done_s < t:
+                t, event = self._awg_done_s, self._awg_done
+            for channel in (self.sendchannel, self.recvchannel):
+                if channel.done_s is not None and channel.done_s < t:
+                    t, event = channel.done_s, channel.complete
+            for fifo in self.fifos.values():
+                if len(fifo.tx_packets) > 0 and not fifo._blocked:
+                    words, commit_s = fifo.tx_packets[0]
+                    ready_s = max(commit_s, fifo._taken_s) + len(words) * self.latency.fifo_word_s
+                    if ready_s < t:
+                        t, event = ready_s, (lambda t, fifo=fifo: self._take(fifo, t))
+            if t > now:
+                return
+            if event(t) is not False:
+                # the state changed, refused packets get another chance
+                for fifo in self.fifos.values():
+                    if fifo._blocked:
+                        fifo._blocked = False
+                        fifo._taken_s = t
+
+    def _take(self, fifo: SimFifo, t: float):
+        words, commit_s = fifo.tx_packets[0]
+        if self._handlers.get(fifo.name, lambda words, t: True)(words, t) is False:
+            fifo._blocked = True
+            return False
+        fifo.tx_packets.popleft()
+        fifo._taken_s = t
+        self.registers[fifo.name] = words
+
+    # capture
+
+    def _capture_command(self, words: list[int], t: float):
+        if self.capture_state == 'hold':
+            return False
+        arm, start, stop = words[0] & 0x4, words[0] & 0x2, words[0] & 0x1
+        if arm and self.capture_state == 'idle':
+            self.capture_state = 'trigger_wait'
+        if start and self.capture_state == 'trigger_wait':
+            self._start_capture(t)
+        if stop and self.capture_state == 'save':
+            self._end_capture(t)
+
+    def _banking_mode(self, words: list[int], t: float):
+        if self.capture_state != 'idle':
+            return False
+        self.active_channels = 1 << words[0]
+
+    def _capture_reset(self, words: list[int], t: float):
+        self.capture_state = 'idle'
+
+    def _trigger(self, trigger_bits: int, t: float):
+        """Digital trigger from the AWG, starts an armed capture if the trigger manager passes it"""
+        config = self.registers.get('capture_trigger_config', [0])[0]
+        mask = config & ((1 << self.num_channels) - 1)
+        if (config >> (self.num_channels + 1)) & 1:
+            fire = (trigger_bits & mask) == mask
+        else:
+            fire = (trigger_bits & mask) != 0
+        if fire and self.capture_state == 'trigger_wait':
+            self._start_capture(t)
+
+    def _capacity(self, region: int):
+        """Entries each active channel can save in a region"""
+        depth_bits, depth_to_words, offset, bank_depth = self.layout.regions[region]
+        return self.num_channels // self.active_channels * bank_depth
+
+    def _start_capture(self, t: float):
+        self.capture_state = 'save'
+        self._capture_start_s = t
+        # the capture stops itself as soon as any active channel runs out of space
+        fill_s = math.inf
+        for channel in range(self.active_channels):
+            mode = self._channel_mode(channel)
+            if mode == 'continuous':
+                fill_s = min(fill_s, self._capacity(1) / self.adc_cycles_per_s)
+            elif mode == 'events' and self.signal.event_rate_hz > 0:
+                events = min(self._capacity(0), self._capacity(1) // self.signal.event_cycles)
+                fill_s = min(fill_s, events / self.signal.event_rate_hz)
+        self._capture_full_s = t + fill_s
+
+    def _end_capture(self, t: float):
+        """Write the samples of the capture to the buffer memory and report the write depths"""
+        self.capture_state = 'hold'
+        cycles = round((t - self._capture_start_s) * self.adc_cycles_per_s)
+        start_cycle = int((self._capture_start_s - self._t0) * self.adc_cycles_per_s)
+        index_bits = (self.layout.regions[1][3] - 1).bit_length()
+        timestamps, samples = [], []
+        for channel in range(self.active_channels):
+            mode = self._channel_mode(channel)
+            if mode == 'continuous':
+                num_words = min(cycles, self._capacity(1))
+                event_cycles = np.zeros(1 if num_words > 0 else 0, dtype=np.int64)
+                word_index = event_cycles
+            elif mode == 'events':
+                num_events = min(round(cycles / self.adc_cycles_per_s * self.signal.event_rate_hz),
+                                 self._capacity(0), self._capacity(1) // self.signal.event_cycles)
+                # one pulse at a random time in each of num_events equal intervals
+                spacing = cycles // max(num_events, 1)
+                jitter = self.signal.rng.integers(0, max(spacing - self.signal.event_cycles, 1), num_events)
+                event_cycles = np.arange(num_events, dtype=np.int64) * spacing + jitter
+                word_index = np.arange(num_events, dtype=np.int64) * self.signal.event_cycles
+                num_words = num_events * self.signal.event_cycles
+            else:
+                event_cycles = word_index = np.zeros(0, dtype=np.int64)
+                num_words = 0
+            # capture time in cycles above the sample write address
+            timestamps.append((((start_cycle + event_cycles) << index_bits)
+                               | (word_index & ((1 << index_bits) - 1))).astype(np.uint64))
+            samples.append(self.signal.samples(mode, num_words))
+        # banks that aren't written keep the data of earlier captures, as in the hardware
+        _, depth_packets = self.layout.encode(timestamps, samples, self.active_channels, self._memory)
+        for name, packet in zip(('timestamps_write_depth', 'samples_write_depth'), depth_packets):
+            self.fifos[name].push_rx(packet.tolist())
+        self.captures += 1
+        if self.readout_state == 'idle':
+            self.readout_state = 'ready'
+
+    # readout
+
+    def _readout_start(self, words: list[int], t: float):
+        if self.readout_state != 'ready':
+            return False
+        self.readout_state = 'active'
+        self._readout_pos = 0
+        if self.recvchannel.request is not None:
+            self._readout(t)
+
+    def _readout_reset(self, words: list[int], t: float):
+        self.readout_state = 'ready'
+        self._readout_pos = 0
+
+    def _readout(self, t: float):
+        """Stream the buffer memory into the pending ADC DMA transfer"""
+        buffer, start, nbytes = self.recvchannel.request
+        memory = self._memory.view(np.uint8)
+        nbytes = min(nbytes, len(memory) - self._readout_pos)
+        np.asarray(buffer).view(np.uint8)[start:start + nbytes] = memory[self._readout_pos:self._readout_pos + nbytes]
+        self._readout_pos += nbytes
+        last = self._readout_pos == len(memory)
+        self.recvchannel.served(nbytes, t, self._readout_done if last else None)
+
+    def _readout_done(self, t: float):
+        self.readout_state = 'idle'
+        if self.capture_state == 'hold':
+            self.capture_state = 'idle'
+
+    def serve_dma(self, channel: SimDmaChannel, t: float):
+        """Start serving a transfer that was just started on a DMA channel, if the PL is ready for it"""
+        if channel is self.recvchannel and self.readout_state == 'active':
+            self._readout(t)
+        elif channel is self.sendchannel and self.awg_state == 'accepting':
+            self._awg_dma(t)
+
+    # AWG
+
+    def _awg_frame_depth(self, words: list[int], t: float):
+        if self.awg_state != 'idle':
+            return False
+        self.registers['awg_frame_depth'] = words
+        self.awg_state = 'accepting'
+        self._latch_awg_config()
+        # a new transfer clears the error code of the previous one
+        self.fifos['awg_dma_error'].reset()
+        if self.sendchannel.request is not None:
+            self._awg_dma(t)
+
+    def _awg_idle_only(self, words: list[int], t: float):
+        if self.awg_state != 'idle':
+            return False
+
+    def _latch_awg_config(self):
+        """Copy the AWG settings to the DAC side, as dac_awg_config_done does"""
+        self._awg_config = {
+            'frame_depths': [depth + 1 for depth in self._fields('awg_frame_depth', self._awg_depth_bits,
+                                                                 self._awg_frame_depth_max - 1)],
+            'burst_lengths': self._fields('awg_burst_length', 64),
+            'trigger_modes': self._fields('awg_trigger_config', 2),
+        }
+
+    def _awg_dma(self, t: float):
+        """Take the pending AWG DMA transfer, checking its length against the frame depths"""
+        buffer, start, nbytes = self.sendchannel.request
+        frame_depths = [depth + 1 for depth in self._fields('awg_frame_depth', self._awg_depth_bits)]
+        expected = sum(frame_depths) * 32
+        self.awg_state = 'blocking'
+        if nbytes <= expected:
+            # 0: tlast with the last word, 2: tlast before the last word
+            self.sendchannel.served(nbytes, t, lambda t: self.fifos['awg_dma_error'].push_rx([0 if nbytes == expected else 2]))
+        else:
+            # the buffers fill up without tlast, and the rest of the transfer is never taken
+            self.fifos['awg_dma_error'].push_rx([1])
+            self.sendchannel.request = None
+            self.sendchannel.bytes += expected
+
+    def _awg_start_stop(self, words: list[int], t: float):
+        if self.awg_state == 'accepting':
+            return False
+        if words[0] & 0x2:
+            frame_depths = self._awg_config['frame_depths']
+            burst_lengths = self._awg_config['burst_lengths']
+            if 0 in burst_lengths:
+                self._awg_done_s = math.inf
+            else:
+                words_per_burst = max(length * depth for length, depth in zip(burst_lengths, frame_depths))
+                self._awg_done_s = t + words_per_burst / self.dac_words_per_s
+            modes = self._awg_config['trigger_modes']
+            self._trigger(sum(1 << channel for channel, mode in enumerate(modes) if mode != 0), t)
+        if words[0] & 0x1:
+            self._awg_done(t)
+
+    def _awg_done(self, t: float):
+        self._awg_done_s = None
+        if self.awg_state == 'blocking':
+            self.awg_state = 'idle'
+
+class SimOverlay(Overlay):
+    """Overlay backed by a SimDAQ instead of a bitstream
+
+    Exposes the IP hierarchy that DAQOverlay uses: daq.<fifo name>.fifo for every FIFO,
+    daq.afe_pgood, and dma.dma.sendchannel/recvchannel. Combine it with an overlay class
+    with simulate().
+
+    Attributes:
+        sim (SimDAQ): model of the PL
+    """
+    def __init__(self,
+                 bitfile_name: str = None,
+                 latency: SimLatency = None,
+                 signal: SimSignal = None,
+                 download: bool = True,
+                 **kwargs):
+        """
+        Arguments:
+            bitfile_name (str): ignored
+            latency (SimLatency): timing model
+            signal (SimSignal): ADC input
+            download (bool): call download, like pynq.Overlay does
+            **kwargs: ignored, accepts the other arguments of pynq.Overlay
+        """
+        self.sim = SimDAQ(latency, signal)
+        self.daq = types.SimpleNamespace(**{name: _SimIP(fifo) for name, fifo in self.sim.fifos.items()})
+        self.daq.afe_pgood = self.sim.afe_pgood
+        self.dma = types.SimpleNamespace(dma=types.SimpleNamespace(sendchannel=self.sim.sendchannel,
+                                                                   recvchannel=self.sim.recvchannel))
+        if download:
+            self.download()
+
+    def download(self, *args, **kwargs):
+        """Reset the PL model"""
+        self.sim.reset()
+
+def simulate(overlay_class):
+    """Get a version of an overlay class (e.g. ShiftregTester) that runs on a SimDAQ
+
+    Usage:
+        ol = simulate(ShiftregTester)('sim', latency=SimLatency(mmio_access_s=0.5e-6))
+    """
+    return type(f'Sim{overlay_class.__name__}', (overlay_class, SimOverlay), {})
+
+SimDAQOverlay = simulate(DAQOverlay)
+
+def _count_capture(index, timestamps, samples, depth_packets):
+    return sum(len(s) for s in samples)
+
+def benchmark_sim(num_measurements: int = 5, num_captures: int = 50, latency: SimLatency = None):
+    """Run a shift register measurement and continuous acquisition on the simulated hardware
+
+    Captures are written to data/ under the working directory.
+
+    Arguments:
+        num_measurements (int): number of single_shiftreg_measurement calls to time
+        num_captures (int): captures per acquire_continuous run
+        latency (SimLatency): timing model
+
+    Returns:
+        results (dict): seconds per measurement, access trace, and the statistics of the acquire_continuous run
+    """
+    from shiftreg import ShiftregTester
+    ol = simulate(ShiftregTester)('sim', latency=latency)
+    args = ('sim', [0, 1, 2, 8], [1, 0, 1, 0, 5], [9.5, 9.5, 9.5, 4.5],
+            [[0x8000, 0x8000, 0x8000, 0x7fff], [0x8000, 0x8000, 0x8000, 0x7fff]],
+            [[0, 0, 0, 0], [0, 0, 0, 0]], [0, 1, 2, 3], [20, 20, 20] + [32]*5,
+            [0.0]*8, [1/1000]*8)
+    results = {}
+    start = time.perf_counter()
+    for n in range(num_measurements):
+        ol.single_shiftreg_measurement(*args)
+    results['measurement_s'] = (time.perf_counter() - start) / num_measurements
+    with ol.trace_accesses(report=False) as tracer:
+        ol.single_shiftreg_measurement(*args)
+    results['trace'] = tracer.report()
+    # capture channels 0-2 in software-started captures with the measurement's settings
+    ol.reset_readout()
+    ol.reset_capture()
+    _, results['continuous'] = ol.acquire_continuous(num_captures, _count_capture, 1e-4)
+    return results
+
+def check_awg_reconfigure():
+    """Check that AWG settings changed between sends of an unchanged buffer take effect
+
+    The burst lengths and trigger modes are only latched by the DAC side when an
+    upload starts, so changing them has to make the next send upload the buffer again.
+
+    Returns:
+        stats (dict): AWG upload statistics
+    """
+    from rfsoc_daq_overlay import DAQOverlay
+    ol = simulate(DAQOverlay)('sim')
+    num_channels = ol._num_channels
+    for n, burst_length in enumerate((1, 3, 3, 5)):
+        ol.stop_awg()
+        ol.set_awg_burst_length([burst_length] * num_channels)
+        ol.set_awg_triggers([n % 3] * num_channels)
+        ol.send_awg_data().wait()
+        ol.start_awg()
+        latched = ol.sim._awg_config
+        if latched['burst_lengths'] != [burst_length] * num_channels or latched['trigger_modes'] != [n % 3] * num_channels:
+            raise AssertionError(f'AWG plays with stale settings {latched} after send {n}')
+    ol.stop_awg()
+    stats = ol.get_awg_upload_stats()
+    if stats['uploads'] != 4:
+        raise AssertionError(f'expected every send to upload, got {stats}')
+    ol.send_awg_data().wait()
+    if ol.get_awg_upload_stats()['skipped'] != 1:
+        raise AssertionError('unchanged buffer and settings were uploaded again')
+    return ol.get_awg_upload_stats()
+
+if __name__ == '__main__':
+    print(f"check_awg_reconfigure: {check_awg_reconfigure()}")
+    with tempfile.TemporaryDirectory() as data_root:
+        os.chdir(data_root)
+        results = benchmark_sim()
+    print(f"single_shiftreg_measurement: {results['measurement_s']*1e3:.2f} ms")
+    print(results['trace'])
+    stats = results['continuous']
+    print(f"acquire_continuous: {stats['captures_per_s']:.1f} captures/s, "
+          f"readout {stats['readout_time_s']/stats['captures']*1e3:.3f} ms/capture, "
+          f"dead time {100*stats['dead_time_fraction']:.1f}%")
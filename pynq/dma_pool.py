@@ -0,0 +1,130 @@
+import numpy as np
+
+class DmaBufferPool:
+    """Size-classed pool of contiguous DMA buffers
+
+    Allocating contiguous memory is slow and fragments it over long sessions, so buffers
+    that are no longer needed are put back into the pool instead of being freed, and
+    handed out again for any later request of the same size class. Size classes are
+    multiples of a quarter of the largest power of two below the size (and at least
+    min_bytes), so a block is at most 25% larger than the request. The caller gets a
+    view of the first nbytes of the block with the requested shape and dtype, so it
+    starts at the physical address of the block and a DMA transfer of the view moves
+    exactly the requested size.
+
+    Attributes:
+        allocations (int): number of blocks allocated
+        reuses (int): number of requests served from the pool (allocations avoided)
+        frees (int): number of blocks freed
+        allocated_bytes (int): bytes in blocks that are currently allocated
+        in_use_bytes (int): bytes in blocks that are currently handed out
+        peak_bytes (int): largest allocated_bytes so far
+    """
+    def __init__(self, allocate, min_bytes: int = 4096, max_idle_bytes: int = 64*2**20):
+        """
+        Arguments:
+            allocate (callable): called as allocate(shape=..., dtype=...) to allocate a block
+                                    (pynq.allocate)
+            min_bytes (int): smallest block, a page
+            max_idle_bytes (int): blocks put back while the pool holds more than this
+                                    many idle bytes are freed
+        """
+        self._allocate = allocate
+        self.min_bytes = min_bytes
+        self.max_idle_bytes = max_idle_bytes
+        # size class -> idle blocks
+        self._idle = {}
+        # id of each buffer that is handed out -> (buffer, block)
+        self._in_use = {}
+        self.allocated_bytes = 0
+        self.in_use_bytes = 0
+        self.peak_bytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Clear the allocation counters"""
+        self.allocations = 0
+        self.reuses = 0
+        self.frees = 0
+
+    def size_class(self, nbytes: int):
+        """Size of the block used for a request of nbytes"""
+        nbytes = max(nbytes, self.min_bytes)
+        step = max(self.min_bytes, 1 << max(0, (nbytes - 1).bit_length() - 3))
+        return -(-nbytes // step) * step
+
+    @property
+    def idle_bytes(self):
+        return self.allocated_bytes - self.in_use_bytes
+
+    def get(self, shape, dtype, zero: bool = True):
+        """Get a DMA buffer, reusing an idle block of the same size class if there is one
+
+        Arguments:
+            shape (int or tuple): shape of the buffer
+            dtype (np.dtype): dtype of the buffer
+            zero (bool): clear a reused block, as freshly allocated memory is
+
+        Returns:
+            buffer (PynqBuffer): contiguous buffer, give it back with put
+        """
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        size = self.size_class(nbytes)
+        idle = self._idle.get(size)
+        if idle:
+            block = idle.pop()
+            if zero:
+                block.fill(0)
+            self.reuses += 1
+        else:
+            block = self._allocate(shape=(size,), dtype=np.uint8)
+            self.allocations += 1
+            self.allocated_bytes += size
+            self.peak_bytes = max(self.peak_bytes, self.allocated_bytes)
+        buffer = block[:nbytes].view(dtype).reshape(shape)
+        self._in_use[id(buffer)] = (buffer, block)
+        self.in_use_bytes += size
+        return buffer
+
+    def put(self, buffer):
+        """Give a buffer obtained from get back to the pool
+
+        The buffer must not be used afterwards, its memory is handed out again.
+        """
+        buffer, block = self._in_use.pop(id(buffer))
+        self.in_use_bytes -= len(block)
+        if self.idle_bytes > self.max_idle_bytes:
+            self._free(block)
+        else:
+            self._idle.setdefault(len(block), []).append(block)
+
+    def _free(self, block):
+        block.freebuffer()
+        self.allocated_bytes -= len(block)
+        self.frees += 1
+
+    def clear(self):
+        """Free all idle blocks"""
+        for blocks in self._idle.values():
+            for block in blocks:
+                self._free(block)
+        self._idle = {}
+
+    def close(self):
+        """Free all blocks, including the ones that are handed out"""
+        for buffer, block in self._in_use.values():
+            self.in_use_bytes -= len(block)
+            self._free(block)
+        self._in_use = {}
+        self.clear()
+
+    def as_dict(self):
+        return {
+            'allocations': self.allocations,
+            'reuses': self.reuses,
+            'frees': self.frees,
+            'allocated_bytes': self.allocated_bytes,
+            'in_use_bytes': self.in_use_bytes,
+            'idle_bytes': self.idle_bytes,
+            'peak_bytes': self.peak_bytes,
+        }
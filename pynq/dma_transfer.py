@@ -0,0 +1,121 @@
+import time
+import asyncio
+from axififo import FifoWaitPolicy
+
+class DmaTransfer:
+    """Handle to a DMA transfer that was started without waiting for it
+
+    Completion is detected by polling the idle bit of the DMA channel, so callbacks
+    added with add_done_callback run in whichever thread first observes completion
+    through done(), wait() or wait_async().
+
+    Attributes:
+        name (str): name of the DMA channel
+        buffer (PynqBuffer): buffer being transferred
+        nbytes (int): number of bytes moved by the transfer
+        duration_s (float): time from starting the transfer until completion was
+                            observed, None while the transfer is in progress
+        skipped (bool): True if no transfer was started (e.g. there was no data)
+    """
+    def __init__(self,
+                 channel,
+                 buffer,
+                 name: str,
+                 nbytes: int = 0,
+                 policy: FifoWaitPolicy = None,
+                 skip: bool = False):
+        """Start a transfer of buffer on channel
+
+        Arguments:
+            channel: DMA send or receive channel
+            buffer (PynqBuffer): buffer to transfer
+            name (str): name of the channel, used in messages
+            nbytes (int): number of bytes to transfer from the start of buffer,
+                            0 transfers the whole buffer
+            policy (FifoWaitPolicy): polling policy used by wait()
+            skip (bool): don't start a transfer, the handle is complete immediately
+        """
+        self.name = name
+        self.buffer = buffer
+        self.nbytes = 0 if skip else (nbytes if nbytes > 0 else buffer.nbytes)
+        self.skipped = skip
+        self.duration_s = 0.0 if skip else None
+        self._channel = channel
+        self._policy = FifoWaitPolicy() if policy is None else policy
+        self._callbacks = []
+        self._start = time.perf_counter()
+        if skip:
+            return
+        if nbytes > 0:
+            channel.transfer(buffer, nbytes=nbytes)
+        else:
+            channel.transfer(buffer)
+
+    def _complete(self):
+        self.duration_s = time.perf_counter() - self._start
+        # channel is idle, so this only finalizes the transfer and checks for DMA errors
+        self._channel.wait()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def done(self):
+        """Return True if the transfer has completed, without blocking"""
+        if self.duration_s is None and self._channel.idle:
+            self._complete()
+        return self.duration_s is not None
+
+    def _waiter(self, timeout_s: float):
+        """Generator yielding sleep times between polls until the transfer completes"""
+        polls = 0
+        while not self.done():
+            waited = time.perf_counter() - self._start
+            if timeout_s is not None and waited > timeout_s:
+                raise TimeoutError(f'{self.name}: DMA transfer did not complete after {waited:.3g} s')
+            yield self._policy.delay(polls)
+            polls += 1
+
+    def wait(self, timeout: float = None):
+        """Block until the transfer completes
+
+        Arguments:
+            timeout (float): seconds since the transfer started after which to give up,
+                                defaults to the timeout of the polling policy
+
+        Returns:
+            transfer (DmaTransfer): self
+
+        Raises:
+            TimeoutError: if the transfer didn't complete in time
+        """
+        for delay in self._waiter(self._policy.timeout_s if timeout is None else timeout):
+            if delay > 0:
+                time.sleep(delay)
+        return self
+
+    async def wait_async(self, timeout: float = None):
+        """Awaitable version of wait that yields to the event loop while polling"""
+        for delay in self._waiter(self._policy.timeout_s if timeout is None else timeout):
+            await asyncio.sleep(delay)
+        return self
+
+    def add_done_callback(self, callback):
+        """Call callback(transfer) once the transfer is complete
+
+        If the transfer has already completed, the callback is called immediately.
+        """
+        if self.duration_s is not None:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    @property
+    def throughput(self):
+        """Bytes per second, None while the transfer is in progress"""
+        if self.duration_s is None or self.duration_s == 0:
+            return None
+        return self.nbytes / self.duration_s
+
+    def __repr__(self):
+        state = 'skipped' if self.skipped else ('pending' if self.duration_s is None else f'done in {self.duration_s*1e6:.1f} us')
+        return f'<DmaTransfer {self.name} {self.nbytes} bytes, {state}>'
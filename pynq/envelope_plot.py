@@ -0,0 +1,97 @@
+import numpy as np
+from timeaxis import TimeAxis
+
+def minmax_envelope(t: np.ndarray, y: np.ndarray, num_bins: int):
+    """Reduce a trace to the minimum and maximum of each of num_bins equal time bins
+
+    Arguments:
+        t (np.ndarray): nondecreasing times
+        y (np.ndarray): values at each time
+        num_bins (int): number of bins, e.g. the width of the axes in pixels
+
+    Returns:
+        t_env, y_env (np.ndarray): two points per non-empty bin, at the time of the
+                                    first sample of the bin, with its minimum and maximum
+    """
+    if len(t) == 0:
+        return t, y
+    span = t[-1] - t[0]
+    bins = np.zeros(len(t), dtype=np.int64) if span <= 0 else ((t - t[0]) * (num_bins / span)).astype(np.int64)
+    first = np.flatnonzero(np.diff(bins, prepend=-1))
+    t_env = np.repeat(t[first], 2)
+    y_env = np.empty(2 * len(first), dtype=np.result_type(y.dtype, np.float32))
+    y_env[0::2] = np.minimum.reduceat(y, first)
+    y_env[1::2] = np.maximum.reduceat(y, first)
+    return t_env, y_env
+
+class DecimatedLine:
+    """Line that only hands a min/max envelope of the visible samples to matplotlib
+
+    The envelope is recomputed whenever the x limits of the axes change, so zooming in
+    shows the individual samples once there are fewer than a few per pixel.
+    """
+    def __init__(self,
+                 axis,
+                 t,
+                 y: np.ndarray,
+                 fmt: str = '-',
+                 scale: float = 1.0,
+                 yscale: float = 1.0,
+                 yoffset: float = 0.0,
+                 points_per_pixel: int = 2,
+                 **kwargs):
+        """Plot y against t on axis
+
+        Arguments:
+            axis (matplotlib.axes.Axes): axes to plot on
+            t (TimeAxis or np.ndarray): time of each sample, nondecreasing
+            y (np.ndarray): samples, e.g. the raw int16 ADC samples
+            fmt (str): matplotlib format string
+            scale (float): time scale of the plot, e.g. 1e6 to plot a TimeAxis in us
+            yscale (float): factor applied to the plotted values
+            yoffset (float): offset added to the plotted values after yscale
+            points_per_pixel (int): plot the samples themselves below this density, None
+                                    to never decimate and only clip to the visible range
+            **kwargs: passed to axis.plot
+        """
+        self.axis = axis
+        self.t = t
+        self.y = y
+        self.scale = scale
+        self.yscale = yscale
+        self.yoffset = yoffset
+        self.points_per_pixel = points_per_pixel
+        t_first, t_last = self._time_bounds()
+        self.line, = axis.plot(*self._data(t_first, t_last), fmt, **kwargs)
+        # strong reference through the closure, matplotlib holds bound methods weakly
+        axis.callbacks.connect('xlim_changed', lambda axis: self.update())
+
+    def _time_bounds(self):
+        if len(self.y) == 0:
+            return 0.0, 0.0
+        if isinstance(self.t, TimeAxis):
+            return self.t[0] * self.scale, self.t[-1] * self.scale
+        return self.t[0], self.t[-1]
+
+    def _data(self, t_start: float, t_stop: float):
+        """Decimated samples with times in [t_start, t_stop], plus one sample on either side"""
+        if isinstance(self.t, TimeAxis):
+            start, stop = self.t.indices(t_start, t_stop, self.scale)
+        else:
+            start = int(np.searchsorted(self.t, t_start, 'left'))
+            stop = int(np.searchsorted(self.t, t_stop, 'right'))
+        # include neighbours so lines continue past the edge of the axes
+        start, stop = max(start - 1, 0), min(stop + 1, len(self.y))
+        if isinstance(self.t, TimeAxis):
+            t = self.t.seconds(start, stop, scale=self.scale)
+        else:
+            t = self.t[start:stop]
+        y = self.y[start:stop]
+        num_bins = max(int(self.axis.bbox.width), 1)
+        if self.points_per_pixel is not None and stop - start > self.points_per_pixel * num_bins:
+            t, y = minmax_envelope(t, y, num_bins)
+        return t, y * self.yscale + self.yoffset
+
+    def update(self):
+        """Recompute the envelope for the current x limits"""
+        self.line.set_data(*self._data(*sorted(self.axis.get_xlim())))
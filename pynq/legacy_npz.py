@@ -0,0 +1,96 @@
+import os
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from capture_store import CaptureStore
+
+# per-capture arrays of the npz files written by single_shiftreg_measurement; everything
+# else in those files is a setting of the capture
+legacy_arrays = ('awg_buffer', 'bitstring')
+# ragged per-channel fields, pickled as object arrays, and the dtype they were saved with
+legacy_channel_fields = {'timestamps': np.uint64, 'samples': np.uint16}
+
+def _channel_arrays(value: np.ndarray, dtype: np.dtype):
+    """Unpack a pickled list of per-channel arrays
+
+    np.asarray(list, dtype=object) stacks the arrays into a 2D array of python ints if
+    all channels have the same length, so the dtype has to be restored
+    """
+    return [np.asarray(channel, dtype=dtype) for channel in value]
+
+def migrate_npz(npz_path: str, store_path: str = None, overwrite: bool = False):
+    """Convert an object-array npz file to a single-capture CaptureStore
+
+    The store is written under a temporary name and renamed when complete, so an
+    interrupted migration never leaves a partial store behind.
+
+    Arguments:
+        npz_path (str): path of the .npz file
+        store_path (str): directory of the new store, defaults to npz_path without .npz
+        overwrite (bool): if True, replace an existing store
+
+    Returns:
+        store_path (str): directory of the store
+    """
+    if store_path is None:
+        store_path = os.path.splitext(npz_path)[0]
+    if os.path.exists(store_path):
+        if not overwrite:
+            return store_path
+        shutil.rmtree(store_path)
+    tmp_path = store_path + '.migrating'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    with np.load(npz_path, allow_pickle=True) as f:
+        data = {}
+        config = {}
+        for name in f.files:
+            value = f[name]
+            if name in legacy_channel_fields:
+                data[name] = _channel_arrays(value, legacy_channel_fields[name])
+            elif name in legacy_arrays:
+                data[name] = value
+            else:
+                config[name] = value.tolist()
+    with CaptureStore(tmp_path) as store:
+        store.append(data, config=config, label=os.path.basename(store_path))
+    os.replace(tmp_path, store_path)
+    return store_path
+
+def open_store(path: str):
+    """Open a capture store read-only, migrating a legacy npz file on first use
+
+    Arguments:
+        path (str): directory of the store, or of a legacy file without the .npz suffix
+
+    Returns:
+        store (CaptureStore): read-only store
+    """
+    if not os.path.isdir(path) and os.path.isfile(path + '.npz'):
+        migrate_npz(path + '.npz', path)
+    return CaptureStore(path, 'r')
+
+def migrate_directory(data_dir: str = 'data', workers: int = None, overwrite: bool = False):
+    """Convert every legacy npz file in a directory, in parallel
+
+    Arguments:
+        data_dir (str): directory with the .npz files
+        workers (int): number of worker processes, defaults to the number of CPUs
+        overwrite (bool): if True, replace stores that were already migrated
+
+    Returns:
+        store_paths (list[str]): directories of the stores, in the order of the npz files
+    """
+    npz_paths = sorted(os.path.join(data_dir, name) for name in os.listdir(data_dir) if name.endswith('.npz'))
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(migrate_npz, npz_paths, [None] * len(npz_paths), [overwrite] * len(npz_paths)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert object-array npz captures to capture stores')
+    parser.add_argument('data_dir', nargs='?', default='data')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+    for store_path in migrate_directory(args.data_dir, args.workers, args.overwrite):
+        print(store_path)
@@ -0,0 +1,143 @@
+import time
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from adc_layout import AdcBufferLayout
+
+# state of a worker process, set up once by _init_worker
+_worker = {}
+
+def _attach(name: str):
+    """Attach to an existing shared memory block without taking ownership of it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13, attaching registers the block with the resource tracker,
+        # which then unlinks it when the worker exits
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+def _init_worker(slot_names: list[str], layout: AdcBufferLayout, process):
+    _worker['slots'] = [_attach(name) for name in slot_names]
+    _worker['raw'] = [np.ndarray((layout.size,), dtype=np.uint16, buffer=slot.buf) for slot in _worker['slots']]
+    _worker['arena'] = np.empty(layout.size, dtype=np.uint16)
+    _worker['layout'] = layout
+    _worker['process'] = process
+
+def _process_slot(slot: int, index: int, depth_packets: list, active_channels: int, channels: list[int]):
+    """Reassemble the capture in a slot and run the process function on it, in a worker"""
+    start = time.perf_counter()
+    timestamps, samples = _worker['layout'].reassemble(_worker['raw'][slot], depth_packets, active_channels,
+                                                       channels, _worker['arena'])
+    result = _worker['process'](index, timestamps, samples, depth_packets)
+    return result, time.perf_counter() - start
+
+class CapturePostProcessor:
+    """Process captures in worker processes, exchanging the raw data through shared memory
+
+    Each submitted capture is copied out of its DMA buffer into one of max_pending
+    shared memory slots, and a worker process reassembles it in place and calls
+    process(index, timestamps, samples, depth_packets). Only the depth packets go to the
+    worker and only the return value of process comes back, so sample arrays are never
+    pickled. The slot is reused once the capture is processed; when all slots are busy,
+    submit blocks, so a slow process function throttles acquisition instead of
+    queueing captures in memory.
+
+    process runs in another process: it must be a module-level function (unless the
+    fork start method is used), and timestamps/samples are views that are only valid
+    during the call. Return small results, e.g. extracted features or a file name.
+
+    Usage:
+        with ol.capture_postprocessor(extract_features) as pp:
+            results, stats = ol.acquire_continuous(1000, None, 1e-3, postprocessor=pp)
+    """
+    def __init__(self,
+                 layout: AdcBufferLayout,
+                 process,
+                 num_workers: int = 3,
+                 max_pending: int = None,
+                 channels: list[int] = None,
+                 mp_context = None):
+        """
+        Arguments:
+            layout (AdcBufferLayout): layout of the DMA buffers that are submitted
+            process (callable): called as process(index, timestamps, samples, depth_packets) in a worker
+            num_workers (int): number of worker processes, leave a core for acquisition
+            max_pending (int): number of captures that can be queued or in progress,
+                                defaults to twice the number of workers
+            channels (list[int]): channels to reassemble, defaults to all active channels
+            mp_context: multiprocessing context for the workers
+        """
+        max_pending = 2 * num_workers if max_pending is None else max_pending
+        self.layout = layout
+        self.channels = channels
+        self._slots = [shared_memory.SharedMemory(create=True, size=2 * layout.size) for slot in range(max_pending)]
+        self._raw = [np.ndarray((layout.size,), dtype=np.uint16, buffer=slot.buf) for slot in self._slots]
+        self._free = queue.Queue()
+        for slot in range(max_pending):
+            self._free.put(slot)
+        self._executor = ProcessPoolExecutor(num_workers, mp_context, initializer=_init_worker,
+                                             initargs=([slot.name for slot in self._slots], layout, process))
+        self.submitted = 0
+        self.stall_time_s = 0.0
+        self.copy_time_s = 0.0
+
+    def submit(self,
+               index: int,
+               buffer: np.ndarray,
+               depth_packets: list,
+               active_channels: int,
+               timeout: float = None):
+        """Publish a capture to the workers, blocking while all slots are in use
+
+        The DMA buffer can be reused as soon as this returns.
+
+        Arguments:
+            index (int): index of the capture, passed to process
+            buffer (PynqBuffer): DMA buffer holding the capture
+            depth_packets (list): write depth packets of the capture
+            active_channels (int): number of channels the capture was made with
+            timeout (float): seconds to wait for a free slot, None waits forever
+
+        Returns:
+            future (concurrent.futures.Future): resolves to (result of process, processing time in s)
+
+        Raises:
+            TimeoutError: if no slot became free in time
+        """
+        start = time.perf_counter()
+        try:
+            slot = self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f'no free capture slot after {timeout} s, post-processing is falling behind')
+        copy_start = time.perf_counter()
+        self.stall_time_s += copy_start - start
+        # only the written part of the buffer is parsed
+        words = self.layout.written_words(depth_packets)
+        self._raw[slot][:words] = buffer[:words]
+        self.copy_time_s += time.perf_counter() - copy_start
+        future = self._executor.submit(_process_slot, slot, index, depth_packets, active_channels, self.channels)
+        future.add_done_callback(lambda future: self._free.put(slot))
+        self.submitted += 1
+        return future
+
+    def close(self, wait: bool = True):
+        """Shut down the workers and free the shared memory"""
+        self._executor.shutdown(wait)
+        # views have to be released before the memory can be unmapped
+        self._raw = []
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,10 +1,26 @@
 import os
+import time
+import asyncio
+from copy import deepcopy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pynq import Overlay
 from pynq import allocate
 import xrfclk
 import numpy as np
-from axififo import AxiStreamFifoDriver
+from axififo import AxiStreamFifoDriver, FifoWaitPolicy, FifoTimeoutError
+from access_trace import AccessTracer
+from capture_stats import CaptureStatistics
+from adc_layout import AdcBufferLayout
+from postprocess import CapturePostProcessor
+from timeaxis import tvecs_from_timestamps, TimeAxis
+from dma_transfer import DmaTransfer
+from envelope_plot import DecimatedLine
+from awg_waveform import write_pulse, repeat_period, FULL_SCALE, WaveformCache
+from awg_buffer import AwgBuffer
+from dma_pool import DmaBufferPool
 import matplotlib.pyplot as plt
 
 def clog2(x):
@@ -18,6 +34,105 @@ def ns_to_samp(ns, fsamp):
 def get_savefile(device_name):
     return datetime.now().strftime("%Y%m%d_%H%M%S") + f'_{device_name}'
 
+class ConfigTransaction:
+    """Deferred configuration of a DAQOverlay, created by DAQOverlay.configure()
+
+    While the transaction is open, setters on the overlay (called either through the
+    transaction or the overlay itself) validate and encode their packets immediately,
+    but only stage them. When the with block exits normally, the staged packets that
+    differ from the shadow registers are sent in commit_order, with one wait for FIFO
+    room per FIFO. If the with block raises, nothing is sent. If sending fails part way,
+    the registers that were already written are restored to their previous contents.
+
+    Commands (arm/start/stop/reset) are not deferred and should be issued after the
+    transaction is committed.
+    """
+    # order in which FIFOs are written: capture path first, then the discriminator
+    # settings before the bypass mask enables them, then the AWG, then DAC gain before
+    # switching the DAC source, and the amplifiers (slow SPI writes) last
+    commit_order = (
+        'capture_banking_mode', 'receive_channel_mux_config',
+        'sample_discriminator_thresholds', 'sample_discriminator_delays',
+        'discriminator_trigger_source', 'discriminator_bypass', 'capture_trigger_config',
+        'awg_frame_depth', 'awg_burst_length', 'awg_trigger_config',
+        'dds_phase_inc', 'tri_phase_inc', 'dac_scale_offset', 'transmit_channel_mux',
+        'lmh6401_config',
+    )
+
+    def __init__(self, overlay):
+        self._overlay = overlay
+        # shadow key -> (fifo name, packet, force); later calls replace earlier ones
+        self._staged = {}
+        self._settings = {}
+        self._prior_active_channels = overlay._active_channels
+        self.packets_sent = 0
+        self.packets_skipped = 0
+
+    def __getattr__(self, name):
+        return getattr(self._overlay, name)
+
+    def __enter__(self):
+        if self._overlay._transaction is not None:
+            raise RuntimeError('a configuration transaction is already open')
+        self._overlay._transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._overlay._transaction = None
+        if exc_type is not None:
+            self._overlay._active_channels = self._prior_active_channels
+            return False
+        self._commit()
+        return False
+
+    def stage(self, fifo_name: str, packet: list[int], setting: str, value: dict, force: bool, key):
+        """Record an encoded packet to be sent on commit"""
+        self._staged[key] = (fifo_name, packet, force or self._staged.get(key, (None, None, False))[2])
+        self._settings[setting] = value
+
+    def _commit(self):
+        ol = self._overlay
+        per_fifo = {}
+        for key, (fifo_name, packet, force) in self._staged.items():
+            if force or ol._shadow.get(key) != packet:
+                per_fifo.setdefault(fifo_name, []).append((key, packet))
+            else:
+                self.packets_skipped += 1
+        prior_shadow = dict(ol._shadow)
+        written = []
+        try:
+            for fifo_name in sorted(per_fifo, key=self.commit_order.index):
+                fifo = ol._fifos[fifo_name]
+                packets = per_fifo[fifo_name]
+                fifo.wait_for_tx_room(sum(len(packet) for _, packet in packets))
+                for key, packet in packets:
+                    if ol.verbose:
+                        print(f'committing packet {packet} to {fifo_name}')
+                    fifo.send_tx_pkt(packet, wait_for_room=False)
+                    ol._shadow[key] = packet
+                    written.append((key, fifo_name))
+                    self.packets_sent += 1
+        except BaseException:
+            self._rollback(written, prior_shadow)
+            raise
+        ol._config.update(self._settings)
+
+    def _rollback(self, written: list, prior_shadow: dict):
+        """Restore registers written by a failed commit to their prior contents"""
+        ol = self._overlay
+        ol._active_channels = self._prior_active_channels
+        for key, fifo_name in reversed(written):
+            if key not in prior_shadow:
+                # previous contents unknown, make sure the next setter call resends
+                del ol._shadow[key]
+                continue
+            try:
+                ol._fifos[fifo_name].send_tx_pkt(prior_shadow[key])
+                ol._shadow[key] = prior_shadow[key]
+            except Exception as e:
+                print(f'WARNING: failed to restore {fifo_name} during rollback: {e}')
+                del ol._shadow[key]
+
 class DAQOverlay(Overlay):
     """Overlay for rfsoc_daq data acquisition system
     
@@ -31,6 +146,8 @@ class DAQOverlay(Overlay):
                  verbose: bool = False,
                  **kwargs):
         self.verbose = verbose
+        # read by download, which Overlay.__init__ calls
+        self._awg = None
         if self.verbose:
             print(f"loading bistream {bitfile_name}")
         super().__init__(bitfile_name, **kwargs)
@@ -67,15 +184,40 @@ class DAQOverlay(Overlay):
         # DMA IP handles
         self._awg_dma = self.dma.dma.sendchannel
         self._adc_dma = self.dma.dma.recvchannel
+        # polling of DMA completion for asyncio transfers; a full ADC readout takes a few ms
+        self._dma_wait_policy = FifoWaitPolicy(spin_count=0, min_sleep_s=50e-6, max_sleep_s=1e-3, timeout_s=5.0)
+        self._async_locks = None
+        # most recent DmaTransfer on each channel
+        self._dma_transfers = {'awg_dma': None, 'adc_dma': None}
+        # MMIO/DMA access tracer, None unless tracing is enabled
+        self._tracer = None
+        # per-channel sample statistics updated on every readout, None unless enabled
+        self.capture_stats = None
+        # host-side shadow of the configuration registers
+        self.invalidate_shadow()
+        # open ConfigTransaction, if any
+        self._transaction = None
         
-        # DMA buffers
+        # quantized pulse and pulse train templates, reused across measurements
+        self._waveform_cache = WaveformCache()
+        # DMA buffers, drawn from a pool so reallocating doesn't go back to the CMA allocator
+        self._dma_pool = DmaBufferPool(allocate)
         self._awg_buffer = None
+        # last packet read from awg_dma_error
+        self._awg_dma_status = []
         self.allocate_awg_memory([self._awg_frame_depth_max] * self._num_channels)
+        self._adc_layout = AdcBufferLayout(self._num_channels, self._adc_buffer_tstamp_depth, self._adc_buffer_data_depth,
+                                           self._tstamp_width, self._adc_data_width)
         adc_dma_bits = self._num_channels * self._adc_buffer_data_depth * self._adc_data_width
         adc_dma_bits += self._num_channels * self._adc_buffer_tstamp_depth * self._tstamp_width
         if self.verbose:
             print(f"allocating _adc_buffer with size {adc_dma_bits // 16} x 16b")
-        self._adc_buffer = allocate(shape=(adc_dma_bits // 16,), dtype=np.uint16)
+        self._adc_buffer = self._dma_pool.get(adc_dma_bits // 16, np.uint16, zero=False)
+        # reused for channels whose banks aren't contiguous in _adc_buffer
+        self._adc_arena = np.empty(adc_dma_bits // 16, dtype=np.uint16)
+        # _adc_buffer plus any extra buffers allocated for continuous acquisition
+        self._adc_buffers = [self._adc_buffer]
+        self.continuous_stats = None
         
         # keep track of number of active channels
         self._active_channels = 1
@@ -116,15 +258,183 @@ class DAQOverlay(Overlay):
         self._awg_dma_error = self.daq.awg_dma_error.fifo
         self._write_depth_samples = self.daq.samples_write_depth.fifo
         self._write_depth_timestamps = self.daq.timestamps_write_depth.fifo
+
+        # all config/status FIFOs, keyed by their name in the block design
+        self._fifos = {
+            name: getattr(self.daq, name).fifo for name in (
+                'awg_burst_length', 'awg_frame_depth', 'awg_start_stop', 'awg_trigger_config',
+                'capture_arm_start_stop', 'capture_banking_mode', 'capture_sw_reset',
+                'capture_trigger_config', 'readout_start', 'readout_sw_reset',
+                'discriminator_bypass', 'discriminator_trigger_source',
+                'sample_discriminator_delays', 'sample_discriminator_thresholds',
+                'receive_channel_mux_config', 'transmit_channel_mux', 'lmh6401_config',
+                'dac_scale_offset', 'dds_phase_inc', 'tri_phase_inc',
+                'awg_dma_error', 'samples_write_depth', 'timestamps_write_depth',
+            )
+        }
+        for name, fifo in self._fifos.items():
+            fifo.name = name
         
         if self.verbose:
             print("finished initializing overlay")
     
+    def set_fifo_wait_policy(self, policy: FifoWaitPolicy, fifo_names: list[str] = None):
+        """Set the polling/backoff/timeout policy used when waiting on FIFOs
+
+        Arguments:
+            policy (FifoWaitPolicy): policy to apply
+            fifo_names (list[str]): FIFOs to apply it to, defaults to all of them
+        """
+        for name in (self._fifos if fifo_names is None else fifo_names):
+            self._fifos[name].wait_policy = policy
+
+    def get_fifo_wait_stats(self):
+        """Get wait counters for each FIFO, sorted by total time spent waiting
+
+        Returns:
+            stats (dict[str, dict]): polls, waits, wait_time_s, max_wait_s and timeouts per FIFO
+        """
+        stats = {name: fifo.wait_stats.as_dict() for name, fifo in self._fifos.items()}
+        return dict(sorted(stats.items(), key=lambda item: item[1]['wait_time_s'], reverse=True))
+
+    def reset_fifo_wait_stats(self):
+        """Clear wait counters for all FIFOs"""
+        for fifo in self._fifos.values():
+            fifo.wait_stats.reset()
+
+    def enable_access_trace(self):
+        """Start counting register accesses, packets, words and time for every FIFO and DMA channel
+
+        Returns:
+            tracer (AccessTracer): the active tracer
+        """
+        if self._tracer is None:
+            self._tracer = AccessTracer()
+            for name, fifo in self._fifos.items():
+                self._tracer.attach_fifo(name, fifo)
+            self._tracer.attach_dma('awg_dma', self._awg_dma)
+            self._tracer.attach_dma('adc_dma', self._adc_dma)
+        return self._tracer
+
+    def disable_access_trace(self):
+        """Stop tracing and restore untraced FIFO and DMA methods
+
+        Returns:
+            tracer (AccessTracer): the tracer that was active, with its final counters
+        """
+        tracer = self._tracer
+        if tracer is not None:
+            tracer.detach()
+            self._tracer = None
+        return tracer
+
+    @contextmanager
+    def trace_accesses(self, report: bool = True):
+        """Trace accesses made inside a with block, e.g. a single measurement
+
+        Example:
+            with ol.trace_accesses() as tracer:
+                ol.single_shiftreg_measurement(...)
+
+        Arguments:
+            report (bool): if True, print the report when the block exits
+        """
+        was_enabled = self._tracer is not None
+        tracer = self.enable_access_trace()
+        tracer.reset()
+        try:
+            yield tracer
+        finally:
+            if report:
+                print(tracer.report())
+            if not was_enabled:
+                self.disable_access_trace()
+
+    def download(self, *args, **kwargs):
+        """Download the bitstream; this resets all configuration registers"""
+        super().download(*args, **kwargs)
+        self.invalidate_shadow()
+        if self._awg is not None:
+            self._awg.invalidate()
+
+    def invalidate_shadow(self):
+        """Forget the last packet committed to every configuration FIFO
+
+        The next call to each setter will be sent to hardware even if it is unchanged.
+        """
+        # fifo name (or (fifo name, address) for FIFOs with several registers) -> packet
+        self._shadow = {}
+        # setting name -> keyword arguments of the setter that was last committed
+        self._config = {}
+
+    def _commit_config(self,
+                       fifo_name: str,
+                       packet: list[int],
+                       setting: str,
+                       value: dict,
+                       force: bool,
+                       key=None):
+        """Send a configuration packet unless it matches the shadow of that register
+
+        Arguments:
+            fifo_name (str): FIFO the packet is sent to
+            packet (list[int]): encoded packet
+            setting (str): name of the setting, used as key by get_config
+            value (dict): setter arguments that produced packet
+            force (bool): if True, send the packet even if it is unchanged
+            key: shadow key, defaults to fifo_name
+
+        Returns:
+            sent (bool): True if the packet was sent to hardware (always False while a
+                            configuration transaction is open)
+        """
+        key = fifo_name if key is None else key
+        packet = [int(word) for word in packet]
+        if self._transaction is not None:
+            self._transaction.stage(fifo_name, packet, setting, value, force, key)
+            return False
+        sent = force or self._shadow.get(key) != packet
+        if sent:
+            self._fifos[fifo_name].send_tx_pkt(packet)
+            self._shadow[key] = packet
+        elif self.verbose:
+            print(f'skipping unchanged packet {packet} to {fifo_name}')
+        self._config[setting] = value
+        return sent
+
+    def configure(self):
+        """Open a configuration transaction
+
+        Example:
+            with ol.configure() as cfg:
+                cfg.set_capture_channel_count(4)
+                cfg.set_discriminator_thresholds(low, high)
+            # all changed registers have been written here
+
+        Returns:
+            transaction (ConfigTransaction): context manager collecting setter calls
+        """
+        return ConfigTransaction(self)
+
+    def get_config(self, setting: str = None):
+        """Get configuration last committed by the setters, without touching hardware
+
+        Arguments:
+            setting (str): name of a setting, e.g. 'discriminator_thresholds'. If None,
+                            return all settings
+
+        Returns:
+            config (dict): keyword arguments of the setter (so they can be passed back to it),
+                            or a dict of those for every setting. Settings that weren't
+                            configured since the last invalidation are absent (or None)
+        """
+        if setting is None:
+            return deepcopy(self._config)
+        return deepcopy(self._config.get(setting))
+
     def __del__(self):
         """Free DMA buffers"""
-        if self._awg_buffer is not None:
-            self._awg_buffer.freebuffer()
-        self._adc_buffer.freebuffer()
+        self._dma_pool.close()
         
     def _check_list_length(self, name: str, config: list):
         """Verify a list is num_channels long, throw ValueError if not"""
@@ -179,16 +489,32 @@ class DAQOverlay(Overlay):
             source_word |= source << (source_bits * channel)
         return self._packetize(source_word, (source_bits * self._num_channels + 31)//32)
     
-    def receive_adc_data(self, override_write_depth_errors: bool):
-        """Perform DMA to receive data from ADC.
-        
-        Checks if a capture was performed before running DMA
-        
+    def _start_dma(self, name: str, buffer, nbytes: int = 0, skip: bool = False):
+        """Start a DMA transfer on a channel once its previous transfer has completed
+
         Arguments:
-            override_write_depth_errors (bool): if True, perform transfer regardless of write_depth status
-        
+            name (str): 'awg_dma' or 'adc_dma'
+            buffer (PynqBuffer): buffer to transfer
+            nbytes (int): number of bytes to transfer, 0 for the whole buffer
+            skip (bool): don't transfer anything, just return a completed handle
+
         Returns:
-            depth_packets (list[list[int]]): for each (timestamps, samples), a packet of write depth information
+            transfer (DmaTransfer): handle to the transfer
+        """
+        previous = self._dma_transfers[name]
+        if previous is not None and not previous.done():
+            previous.wait()
+        channel = self._awg_dma if name == 'awg_dma' else self._adc_dma
+        transfer = DmaTransfer(channel, buffer, name, nbytes, self._dma_wait_policy, skip)
+        self._dma_transfers[name] = transfer
+        return transfer
+
+    def _read_write_depths(self):
+        """Read the timestamp and sample write depth packets
+
+        Returns:
+            depth_packets (list[np.ndarray]): for each (timestamps, samples), a packet of write depth information
+            failure (bool): True if either packet is missing
         """
         failure = False
         timestamps_write_depth = self.get_timestamps_write_depth()
@@ -200,10 +526,347 @@ class DAQOverlay(Overlay):
                 print(f"WARNING: didn't get the right number of packets for fifo, got {num_packets}")
                 failure = True
             depths.append(packet)
-        if not(failure) or override_write_depth_errors:
-            self._adc_dma.transfer(self._adc_buffer)
-        return depths
+        return depths, failure
+
+    def start_receive(self, override_write_depth_errors: bool = False, buffer: np.ndarray = None):
+        """Start DMA to receive data from ADC without waiting for it to complete.
+
+        Checks if a capture was performed before running DMA
+
+        The readout always streams the whole buffer, with tlast only on its last word, so
+        the transfer can't be shortened to the written entries. Empty banks are never
+        copied out of the buffer by reassembly though.
+
+        Arguments:
+            override_write_depth_errors (bool): if True, perform transfer regardless of write_depth status
+            buffer (PynqBuffer): DMA buffer to receive into, defaults to _adc_buffer
+
+        Returns:
+            transfer (DmaTransfer): handle to the transfer, with the write depth packets
+                                    for (timestamps, samples) as transfer.depth_packets.
+                                    If the transfer was skipped, transfer.skipped is True
+        """
+        depths, failure = self._read_write_depths()
+        return self._start_receive(depths, failure, override_write_depth_errors, buffer)
+
+    def _start_receive(self,
+                       depths: list[np.ndarray],
+                       failure: bool,
+                       override_write_depth_errors: bool,
+                       buffer: np.ndarray = None):
+        """Start the ADC DMA transfer once the write depth packets were read
+
+        Shared by start_receive and receive_adc_data_async, so both feed capture_stats.
+
+        Arguments:
+            depths (list[np.ndarray]): write depth packets for (timestamps, samples)
+            failure (bool): True if either packet is missing
+            override_write_depth_errors (bool): if True, perform transfer regardless of write_depth status
+            buffer (PynqBuffer): DMA buffer to receive into, defaults to _adc_buffer
+
+        Returns:
+            transfer (DmaTransfer): handle to the transfer, see start_receive
+        """
+        buffer = self._adc_buffer if buffer is None else buffer
+        skip = failure and not(override_write_depth_errors)
+        transfer = self._start_dma('adc_dma', buffer, skip=skip)
+        transfer.depth_packets = depths
+        if self.capture_stats is not None and not(skip):
+            stats = self.capture_stats
+            transfer.add_done_callback(lambda transfer: self.accumulate_capture_stats(depths, buffer, stats))
+        return transfer
+
+    def receive_adc_data(self,
+                         override_write_depth_errors: bool,
+                         buffer: np.ndarray = None,
+                         wait: bool = False):
+        """Perform DMA to receive data from ADC.
+        
+        Checks if a capture was performed before running DMA
+        
+        Arguments:
+            override_write_depth_errors (bool): if True, perform transfer regardless of write_depth status
+            buffer (PynqBuffer): DMA buffer to receive into, defaults to _adc_buffer
+            wait (bool): if True, wait for the transfer to complete before returning
+        
+        Returns:
+            depth_packets (list[np.ndarray]): for each (timestamps, samples), a packet of write depth information
+        """
+        transfer = self.start_receive(override_write_depth_errors, buffer)
+        if wait:
+            transfer.wait()
+        return transfer.depth_packets
     
+    def _adc_buffer_regions(self):
+        """Layout of the timestamp and sample regions of _adc_buffer (see AdcBufferLayout.regions)"""
+        return self._adc_layout.regions
+
+    def _decode_depth_packet(self, packet: list[int], depth_bits: int, bank_depth: int):
+        """Get the number of entries written to each bank from a write depth packet
+
+        Arguments:
+            packet (list[int]): write depth packet
+            depth_bits (int): bits per bank; the MSB indicates the bank is full
+            bank_depth (int): number of entries in a full bank
+
+        Returns:
+            depth_per_bank (list[int]): number of entries written to each bank
+        """
+        return self._adc_layout.decode_depth_packet(packet, depth_bits, bank_depth)
+
+    def _completed_adc_buffer(self, buffer: np.ndarray = None):
+        """Contents of an ADC DMA buffer, waiting for a pending readout into it to complete
+
+        Arguments:
+            buffer (PynqBuffer): DMA buffer holding the capture, defaults to _adc_buffer
+
+        Returns:
+            raw (np.ndarray): the buffer as an array
+        """
+        buffer = self._adc_buffer if buffer is None else buffer
+        transfer = self._dma_transfers['adc_dma']
+        if transfer is not None and np.may_share_memory(transfer.buffer, buffer):
+            transfer.wait()
+        return np.asarray(buffer)
+
+    def reassemble_adc_data(self,
+                            depth_packets: list[list[int]],
+                            channels: list[int] = None,
+                            buffer: np.ndarray = None):
+        """Split raw data from ADC into timestamps and samples without per-capture allocation
+
+        A channel whose filled banks are adjacent in the DMA buffer (always the case with
+        one active channel, or with one bank per channel) is returned as a view into
+        _adc_buffer. Otherwise its banks are gathered into a preallocated arena. Either
+        way, the returned arrays are overwritten by the next readout; copy them to keep them.
+        If a readout into the buffer is still in progress, it is waited for first.
+
+        Arguments:
+            depth_packets (list[list[int]]): for each (timestamps, samples), a packet of write depth information
+            channels (list[int]): channels to reassemble, defaults to all active channels
+            buffer (PynqBuffer): DMA buffer holding the capture, defaults to _adc_buffer
+
+        Returns:
+            timestamps (list[array_like]): for each of the num_channels channels, timestamps
+                                            (empty for channels that weren't requested)
+            samples (list[array_like]): for each of the num_channels channels, collected samples
+                                            (empty for channels that weren't requested)
+        """
+        raw = self._completed_adc_buffer(buffer)
+        return self._adc_layout.reassemble(raw, depth_packets, self._active_channels, channels, self._adc_arena)
+
+    def _sample_banks(self, depth_packets: list[list[int]], buffer: np.ndarray = None):
+        """Filled sample banks of each active channel, in capture order
+
+        Returns:
+            banks (list[list[np.ndarray]]): for each active channel, int16 views of its banks
+        """
+        raw = self._completed_adc_buffer(buffer)
+        return self._adc_layout.sample_banks(raw, depth_packets, self._active_channels)
+
+    def enable_capture_stats(self, thresholds: list[int] = None):
+        """Accumulate per-channel sample statistics on every ADC readout
+
+        Statistics are computed directly from the banks of the DMA buffer when each
+        readout completes, without reassembling or storing the samples.
+
+        Arguments:
+            thresholds (list[int]): per channel, level in signed sample units whose upward
+                                    crossings are counted; defaults to the discriminator
+                                    high thresholds if they were set, otherwise 0
+
+        Returns:
+            stats (CaptureStatistics): the statistics, also available as capture_stats
+        """
+        if thresholds is None:
+            config = self._config.get('discriminator_thresholds')
+            if config is not None:
+                thresholds = np.array(config['high_thresholds'], dtype=np.int64).astype(np.uint16).view(np.int16)
+        self.capture_stats = CaptureStatistics(self._num_channels, thresholds)
+        return self.capture_stats
+
+    def disable_capture_stats(self):
+        """Stop accumulating statistics
+
+        A readout that is still in progress is waited for, so its capture is included.
+
+        Returns:
+            stats (CaptureStatistics): the statistics accumulated so far
+        """
+        transfer = self._dma_transfers['adc_dma']
+        if transfer is not None:
+            # statistics are added when completion is observed
+            transfer.wait()
+        stats = self.capture_stats
+        self.capture_stats = None
+        return stats
+
+    def accumulate_capture_stats(self,
+                                 depth_packets: list[list[int]],
+                                 buffer: np.ndarray = None,
+                                 stats: CaptureStatistics = None):
+        """Add the samples of a capture to running per-channel statistics
+
+        Arguments:
+            depth_packets (list[list[int]]): for each (timestamps, samples), a packet of write depth information
+            buffer (PynqBuffer): DMA buffer holding the capture, defaults to _adc_buffer
+            stats (CaptureStatistics): statistics to update, defaults to capture_stats
+        """
+        stats = self.capture_stats if stats is None else stats
+        for channel, banks in enumerate(self._sample_banks(depth_packets, buffer)):
+            for bank in banks:
+                stats.update(channel, bank)
+        stats.end_capture()
+
+    def _allocate_adc_buffers(self, num_buffers: int):
+        """Get num_buffers ADC DMA buffers, allocating any that don't exist yet"""
+        while len(self._adc_buffers) < num_buffers:
+            if self.verbose:
+                print(f'allocating extra ADC buffer with size {len(self._adc_buffer)} x 16b')
+            self._adc_buffers.append(self._dma_pool.get(self._adc_buffer.shape, np.uint16, zero=False))
+        return self._adc_buffers[:num_buffers]
+
+    def release_adc_buffers(self):
+        """Return the extra ADC buffers allocated for continuous acquisition to the DMA pool
+
+        They are taken from the pool again by the next acquire_continuous, without
+        allocating new memory (see get_dma_pool_stats).
+        """
+        for buffer in self._adc_buffers[1:]:
+            self._dma_pool.put(buffer)
+        self._adc_buffers = [self._adc_buffer]
+
+    def get_dma_pool_stats(self):
+        """Get counters of the pool the DMA buffers are drawn from
+
+        Returns:
+            stats (dict): allocations, reuses (allocations avoided), frees, and allocated,
+                            in_use, idle and peak bytes
+        """
+        return self._dma_pool.as_dict()
+
+    def _process_capture(self, index: int, buffer, depth_packets: list, channels: list[int], process):
+        """Reassemble a capture and hand it to the process callback, timing both"""
+        start = time.perf_counter()
+        timestamps, samples = self.reassemble_adc_data(depth_packets, channels, buffer)
+        result = process(index, timestamps, samples, depth_packets)
+        return result, time.perf_counter() - start
+
+    def acquire_continuous(self,
+                           num_captures: int,
+                           process,
+                           capture_time_s: float,
+                           channels: list[int] = None,
+                           num_buffers: int = 2,
+                           trigger = None,
+                           override_write_depth_errors: bool = False,
+                           postprocessor: CapturePostProcessor = None):
+        """Repeatedly capture and read out, processing capture N while capture N+1 runs
+
+        The capture buffer and channel configuration must already be set up. Readouts
+        rotate through num_buffers DMA buffers and are processed in a worker thread, so
+        reassembly and processing of one capture overlap the acquisition and readout of
+        the following ones. A buffer is only reused once the capture in it was processed,
+        which stalls acquisition if processing falls behind by num_buffers captures.
+
+        With a postprocessor, each capture is instead copied to shared memory and
+        processed in worker processes (see CapturePostProcessor), and acquisition stalls
+        when all of its slots are in use.
+
+        Arguments:
+            num_captures (int): number of captures to acquire
+            process (callable): called as process(index, timestamps, samples, depth_packets)
+                                from the worker thread. timestamps and samples are views that
+                                are only valid during the call (see reassemble_adc_data).
+                                Unused with a postprocessor, which has its own
+            capture_time_s (float): time between starting and stopping each capture
+            channels (list[int]): channels to reassemble, defaults to all active channels
+            num_buffers (int): number of ADC DMA buffers to rotate through (at least 2)
+            trigger (callable): if None, each capture is started in software. Otherwise the
+                                capture is armed and trigger() is called to start it,
+                                e.g. ol.start_awg
+            override_write_depth_errors (bool): passed to receive_adc_data
+            postprocessor (CapturePostProcessor): process captures in worker processes
+
+        Returns:
+            results (list): return value of process for each capture
+            stats (dict): throughput and dead time statistics, also stored in continuous_stats
+        """
+        if num_buffers < 2:
+            raise ValueError(f'continuous acquisition needs at least 2 buffers, got {num_buffers}')
+        buffers = self._allocate_adc_buffers(num_buffers)
+        results = []
+        in_flight = deque()
+        stats = {'live_time_s': 0.0, 'readout_time_s': 0.0, 'process_time_s': 0.0, 'stall_time_s': 0.0}
+
+        def begin_capture():
+            if trigger is None:
+                self.start_capture()
+            else:
+                self.arm_capture()
+                trigger()
+            return time.perf_counter()
+
+        def collect():
+            result, process_time = in_flight.popleft().result()
+            results.append(result)
+            stats['process_time_s'] += process_time
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=1) as worker:
+            capture_start = begin_capture()
+            for index in range(num_captures):
+                remaining = capture_time_s - (time.perf_counter() - capture_start)
+                if remaining > 0:
+                    time.sleep(remaining)
+                self.stop_capture()
+                stop = time.perf_counter()
+                stats['live_time_s'] += stop - capture_start
+                # wait until the buffer we're about to overwrite has been processed
+                while postprocessor is None and len(in_flight) >= num_buffers:
+                    collect()
+                readout_start = time.perf_counter()
+                stats['stall_time_s'] += readout_start - stop
+                self.start_readout()
+                buffer = buffers[index % num_buffers]
+                depths = self.receive_adc_data(override_write_depth_errors, buffer=buffer, wait=True)
+                stats['readout_time_s'] += time.perf_counter() - readout_start
+                if index + 1 < num_captures:
+                    capture_start = begin_capture()
+                if postprocessor is None:
+                    in_flight.append(worker.submit(self._process_capture, index, buffer, depths, channels, process))
+                else:
+                    # blocks while all shared memory slots are in use
+                    submit_start = time.perf_counter()
+                    in_flight.append(postprocessor.submit(index, buffer, depths, self._active_channels))
+                    stats['stall_time_s'] += time.perf_counter() - submit_start
+            while len(in_flight) > 0:
+                collect()
+        elapsed = time.perf_counter() - start
+        stats['captures'] = num_captures
+        stats['elapsed_s'] = elapsed
+        stats['captures_per_s'] = num_captures / elapsed
+        stats['dead_time_fraction'] = 1 - stats['live_time_s'] / elapsed
+        if self.verbose:
+            print(f"{num_captures} captures in {elapsed:.3f} s ({stats['captures_per_s']:.1f}/s), "
+                  f"dead time {100*stats['dead_time_fraction']:.1f}%")
+        self.continuous_stats = stats
+        return results, stats
+
+    def capture_postprocessor(self, process, num_workers: int = 3, max_pending: int = None, channels: list[int] = None):
+        """Create a CapturePostProcessor for captures of this overlay
+
+        Arguments:
+            process (callable): module-level function called as process(index, timestamps, samples, depth_packets)
+            num_workers (int): number of worker processes
+            max_pending (int): number of captures that can be queued or in progress
+            channels (list[int]): channels to reassemble, defaults to all active channels
+
+        Returns:
+            postprocessor (CapturePostProcessor): pass to acquire_continuous, and close when done
+        """
+        return CapturePostProcessor(self._adc_layout, process, num_workers, max_pending, channels)
+
     def get_samples_and_timestamps_from_adc_data(self, depth_packets: list[list[int]]):
         """Split raw data from ADC into timestamps and samples
         
@@ -214,58 +877,15 @@ class DAQOverlay(Overlay):
             timestamps (list[array_like]): list of arrays of timestamps for each channel
             samples (list[array_like]): list of arrays of collected samples for each channel
         """
-        sample_depth_bits = clog2(self._adc_buffer_data_depth) + 1
-        timestamp_depth_bits = clog2(self._adc_buffer_tstamp_depth) + 1
-        buffer_midpoint = self._num_channels * self._adc_buffer_tstamp_depth * self._tstamp_width // 16
-        data = []
-        for i in range(2):
-            data.append([])
-            packet = depth_packets[i]
-            if i == 0:
-                depth_bits = timestamp_depth_bits
-                depth_to_words = self._tstamp_width // 16
-                offset = 0
-                bank_size = self._adc_buffer_tstamp_depth * depth_to_words
-            else:
-                depth_bits = sample_depth_bits
-                depth_to_words = self._adc_data_width // 16
-                offset = buffer_midpoint
-                bank_size = self._adc_buffer_data_depth * depth_to_words
-            # merge 32-bit qtys
-            depth_word = 0
-            for n, word in enumerate(packet):
-                depth_word |= word << (32 * n)
-            mask = ((1 << depth_bits) - 1)
-            total_depth = [0 for i in range(self._num_channels)]
-            depth_per_bank = []
-            for bank in range(self._num_channels):
-                depth = (depth_word >> (bank * depth_bits)) & mask
-                if depth & (1 << (depth_bits - 1)):
-                    depth = bank_size // depth_to_words
-                depth_per_bank.append(depth)
-                channel = bank % self._active_channels
-                total_depth[channel] += depth
-            for channel in range(self._num_channels):
-                data[-1].append(np.zeros((total_depth[channel] * depth_to_words,), dtype=np.uint16))
-            for bank in range(self._num_channels):
-                channel = bank % self._active_channels
-                read_start = offset + (bank_size * bank)
-                read_stop = offset + (bank_size * bank) + depth_per_bank[bank] * depth_to_words
-                write_start = (bank // self._active_channels) * bank_size
-                write_stop = (bank // self._active_channels) * bank_size + depth_per_bank[bank] * depth_to_words
-                data[-1][channel][write_start:write_stop] = self._adc_buffer[read_start:read_stop]
-        timestamps = [d.view(np.uint64) for d in data[0]]
-        samples = data[1]
-        return timestamps, samples
-            
+        timestamps, samples = self.reassemble_adc_data(depth_packets)
+        return [t.copy() for t in timestamps], [s.copy() for s in samples]
+
     def allocate_awg_memory(self, frame_depths: list[int]):
         """Allocate or reallocate AWG buffer based on specified frame_depths
         
         Arguments:
             frame_depths (list[int]): list of desired frame depth for each channel
         """
-        if self._awg_buffer is not None:
-            self._awg_buffer.freebuffer()
         total_size = 0
         self._check_list_length('frame_depths', frame_depths)
         for depth in frame_depths:
@@ -280,37 +900,327 @@ class DAQOverlay(Overlay):
             total_size += depth*self._dac_data_width//16 # (16-bit dtype)
         if self.verbose:
             print(f'allocating _awg_buffer with size {total_size} x 16b')
+        if self._awg_buffer is not None:
+            transfer = self._dma_transfers['awg_dma']
+            if transfer is not None:
+                # the pool may hand the block straight back and clear it, so a running
+                # upload must be done reading it
+                transfer.wait()
+            # the previous buffer is reused if the new one falls in the same size class
+            self._dma_pool.put(self._awg_buffer)
         self._awg_frame_depths = frame_depths
-        self._awg_buffer = allocate(shape=(total_size,), dtype=np.uint16)
+        self._awg_buffer = self._dma_pool.get(total_size, np.uint16)
+        # tracks what changed since the last upload, so unchanged buffers aren't resent
+        self._awg = AwgBuffer(self._awg_buffer, frame_depths, self._dac_parallel_samples)
+
+    def get_awg_channels(self):
+        """Get writable views of the AWG DMA buffer for each channel
 
-    def send_awg_data(self):
-        """Set AWG frame depths and perform DMA to send data to AWG"""
+        Writing to a view writes the waveform of its channel directly into the DMA buffer,
+        without building it in a temporary array first. The views are only valid until
+        the buffer is reallocated by allocate_awg_memory. All channels are marked as
+        modified, so the next send_awg_data uploads the buffer; use get_awg_channel to
+        only mark one channel.
+
+        Returns:
+            channels (list[np.ndarray]): for each channel, int16 view of the
+                                            frame_depth*dac_parallel_samples samples it plays
+        """
+        return [self._awg.channel(channel) for channel in range(len(self._awg))]
+
+    def get_awg_channel(self, channel: int, start: int = 0, stop: int = None):
+        """Get a writable view of part of a channel of the AWG DMA buffer
+
+        Only the returned samples are marked as modified. Writes made directly to
+        _awg_buffer aren't tracked, call mark_awg_modified after them.
+
+        Arguments:
+            channel (int): AWG channel
+            start (int): first sample
+            stop (int): end of the range, defaults to the end of the channel
+
+        Returns:
+            samples (np.ndarray): int16 view into the DMA buffer
+        """
+        return self._awg.channel(channel, start, stop)
+
+    def mark_awg_modified(self, channel: int = None):
+        """Mark a channel (or all channels) of the AWG DMA buffer as modified
+
+        Arguments:
+            channel (int): AWG channel, None for all channels
+        """
+        self._awg.mark_dirty(channel)
+
+    def write_awg_pulse_train(self,
+                              channel: int,
+                              pulse_param_ns: list[float],
+                              num_pulses: int = None,
+                              amplitude: int = FULL_SCALE,
+                              first_pulse: int = 0):
+        """Write a periodic pulse train into a channel of the AWG DMA buffer
+
+        The train (zero padded to the end of the channel) is generated once per pulse
+        parameters, frame depth and number of pulses and then copied from the waveform cache.
+
+        Arguments:
+            channel (int): AWG channel
+            pulse_param_ns (list[float]): [rise, hold, fall, init delay, period] of waveform in ns
+            num_pulses (int): number of periods, defaults to as many as fit in the channel
+            amplitude (int): DAC code of the top of the pulses
+            first_pulse (int): number of empty periods at the start of the train
+
+        Returns:
+            pulses (np.ndarray): read-only int16 view of the num_pulses periods in the channel
+        """
+        samples = [ns_to_samp(t, self._dac_fsamp) for t in pulse_param_ns]
+        period = samples[4]
+        channel_size = self._awg_frame_depths[channel]*self._dac_parallel_samples
+        max_pulses = channel_size//period
+        num_pulses = max_pulses if num_pulses is None else num_pulses
+        if num_pulses > max_pulses:
+            raise ValueError(f'{num_pulses} pulses of {period} samples do not fit in channel {channel} ({channel_size} samples)')
+        def generate():
+            train = np.zeros(channel_size, dtype=np.int16)
+            pulses = train[first_pulse*period:num_pulses*period]
+            if len(pulses) > 0:
+                write_pulse(pulses[:period], samples[0], samples[1], samples[2], samples[3], amplitude)
+                repeat_period(pulses, period)
+            return train
+        key = ('pulse_train', tuple(pulse_param_ns), self._dac_fsamp, self._awg_frame_depths[channel],
+               num_pulses, amplitude, first_pulse)
+        # a channel that already holds the train is neither rewritten nor uploaded again
+        pulses = self._awg.write_template(channel, key, self._waveform_cache.get(key, generate))[:num_pulses*period]
+        # writes through the result would not be tracked
+        pulses.flags.writeable = False
+        return pulses
+
+    def write_awg_prbs(self,
+                       channel: int,
+                       pulse_param_ns: list[float],
+                       bitstring: np.ndarray,
+                       amplitude: int = FULL_SCALE):
+        """Write a pulse for every 1 and an empty period for every 0 of bitstring into a channel
+
+        The periods are gathered from a cached [empty, pulse] template indexed by the
+        bitstring, straight into the AWG DMA buffer. The rest of the channel is zeroed.
+        The whole channel is marked as modified.
+
+        Arguments:
+            channel (int): AWG channel
+            pulse_param_ns (list[float]): [rise, hold, fall, init delay, period] of waveform in ns
+            bitstring (np.ndarray): 0/1 per period
+            amplitude (int): DAC code of the top of the pulses
+
+        Returns:
+            pulses (np.ndarray): int16 view of the pulse train in the channel
+        """
+        samples = [ns_to_samp(t, self._dac_fsamp) for t in pulse_param_ns]
+        period = samples[4]
+        data = self._awg.channel(channel)
+        num_pulses = len(bitstring)
+        if num_pulses*period > len(data):
+            raise ValueError(f'{num_pulses} pulses of {period} samples do not fit in channel {channel} ({len(data)} samples)')
+        if np.any((bitstring != 0) & (bitstring != 1)):
+            raise ValueError('bitstring must only contain 0 and 1')
+        def generate():
+            bits = np.zeros((2, period), dtype=np.int16)
+            write_pulse(bits[1], samples[0], samples[1], samples[2], samples[3], amplitude)
+            return bits
+        bits = self._waveform_cache.get(('pulse_bits', tuple(pulse_param_ns), self._dac_fsamp, amplitude), generate)
+        pulses = data[:num_pulses*period]
+        # mode='clip' avoids np.take buffering out (it does for mode='raise'); bitstring was range-checked above
+        np.take(bits, bitstring, axis=0, out=pulses.reshape(num_pulses, period), mode='clip')
+        data[num_pulses*period:] = 0
+        return pulses
+
+    def get_waveform_cache_stats(self):
+        """Get size and hit rate of the waveform template cache
+
+        Returns:
+            stats (dict): templates, nbytes, max_bytes, hits, misses, evictions and hit_rate
+        """
+        return self._waveform_cache.as_dict()
+
+    def set_waveform_cache_size(self, max_bytes: int):
+        """Bound the memory used by the waveform template cache, clearing it
+
+        Arguments:
+            max_bytes (int): upper bound on the memory used by cached templates
+        """
+        self._waveform_cache = WaveformCache(max_bytes)
+
+    def _check_awg_buffer(self):
         if self._awg_buffer is None:
             raise ValueError(
                 f"""AWG DMA buffer is not initialized, call
                 ol.allocate_awg_memory(depths)
                 to allocate a buffer"""
             )
-        self.set_awg_frame_depth(self._awg_frame_depths)
-        self._awg_dma.transfer(self._awg_buffer)
+
+    def _poll_awg_upload(self):
+        """Mark the AWG buffer clean if the last upload has completed by now"""
+        previous = self._dma_transfers['awg_dma']
+        if previous is not None:
+            previous.done()
+
+    def start_send(self, force: bool = False):
+        """Set AWG frame depths and start DMA to send data to AWG without waiting for it
+
+        If the buffer wasn't modified since the last upload completed, the AWG memory
+        already holds it and nothing is sent.
+
+        Arguments:
+            force (bool): upload even if the buffer is unchanged
+
+        Returns:
+            transfer (DmaTransfer): handle to the transfer (skipped if nothing was sent)
+        """
+        self._check_awg_buffer()
+        self._poll_awg_upload()
+        if not(force or self._awg.dirty):
+            self._awg.skip_upload()
+            return self._start_dma('awg_dma', self._awg_buffer, skip=True)
+        # the frame depth packet is what makes the AWG accept a DMA transfer, so it is
+        # sent even if the depths are unchanged
+        self.set_awg_frame_depth(self._awg_frame_depths, force=True)
+        awg = self._awg
+        generation = awg.begin_upload()
+        transfer = self._start_dma('awg_dma', self._awg_buffer)
+        transfer.add_done_callback(lambda transfer: awg.end_upload(generation))
+        return transfer
+
+    def send_awg_data(self, force: bool = False):
+        """Set AWG frame depths and perform DMA to send data to AWG
+
+        Skipped if the buffer is unchanged since the last upload, see start_send.
+
+        Arguments:
+            force (bool): upload even if the buffer is unchanged
+
+        Returns:
+            transfer (DmaTransfer): handle to the transfer
+        """
+        return self.start_send(force)
+
+    def get_awg_upload_stats(self):
+        """Get counters of AWG uploads made and skipped since the buffer was allocated
+
+        Returns:
+            stats (dict): uploads, skipped, failed, bytes_uploaded, bytes_saved and
+                            dirty_regions (channel -> modified (start, stop) sample range)
+        """
+        self._poll_awg_upload()
+        return self._awg.as_dict()
     
-    def get_samples_write_depth(self):
-        """Get packet of samples write depth"""
-        packet = self._write_depth_samples.get_rx_fifo_pkt()
+    def _async_lock(self, name: str):
+        """Get the asyncio lock serializing coroutines that share a DMA channel"""
+        if self._async_locks is None:
+            # created lazily so that they bind to the running event loop
+            self._async_locks = {'adc_dma': asyncio.Lock(), 'awg_dma': asyncio.Lock()}
+        return self._async_locks[name]
+
+    async def _dma_transfer_async(self, name: str, buffer):
+        """Start a DMA transfer and yield to the event loop until it completes
+
+        Arguments:
+            name (str): 'awg_dma' or 'adc_dma'
+            buffer (PynqBuffer): buffer to transfer
+        """
+        previous = self._dma_transfers[name]
+        if previous is not None:
+            # a transfer started synchronously may still be running, wait for it without
+            # blocking the event loop (_start_dma would block in previous.wait())
+            await previous.wait_async()
+        await self._start_dma(name, buffer).wait_async()
+
+    async def receive_adc_data_async(self, override_write_depth_errors: bool, buffer: np.ndarray = None):
+        """Awaitable version of receive_adc_data.
+
+        Waits for the write depth packets and the DMA transfer without blocking the event
+        loop. Concurrent readouts are serialized on the ADC DMA channel: the lock is held
+        from reading the write depth packets until the transfer completes, so each readout
+        gets its own packets and buffer contents.
+
+        Arguments:
+            override_write_depth_errors (bool): if True, perform transfer regardless of write_depth status
+            buffer (PynqBuffer): DMA buffer to receive into, defaults to _adc_buffer
+
+        Returns:
+            depth_packets (list[np.ndarray]): for each (timestamps, samples), a packet of write depth information
+        """
+        async with self._async_lock('adc_dma'):
+            failure = False
+            depths = []
+            for fifo in (self._write_depth_timestamps, self._write_depth_samples):
+                try:
+                    packet = await fifo.get_rx_fifo_array_async()
+                except FifoTimeoutError as e:
+                    print(f"WARNING: {e}")
+                    packet = np.empty(0, dtype=np.uint32)
+                    failure = True
+                if self.verbose:
+                    print(f'{fifo.name} reported: {packet}')
+                depths.append(packet)
+            previous = self._dma_transfers['adc_dma']
+            if previous is not None:
+                await previous.wait_async()
+            await self._start_receive(depths, failure, override_write_depth_errors, buffer).wait_async()
+        return depths
+
+    async def send_awg_data_async(self, force: bool = False):
+        """Awaitable version of send_awg_data"""
+        self._check_awg_buffer()
+        awg = self._awg
+        if not(force or awg.dirty):
+            awg.skip_upload()
+            return
+        packet = self._awg_frame_depth_packet(self._awg_frame_depths)
+        # always sent, see start_send
+        await self._awg_frame_depth.send_tx_pkt_async(packet)
+        self._shadow['awg_frame_depth'] = packet
+        self._config['awg_frame_depth'] = {'depths': list(self._awg_frame_depths)}
+        generation = awg.begin_upload()
+        async with self._async_lock('awg_dma'):
+            await self._dma_transfer_async('awg_dma', self._awg_buffer)
+        awg.end_upload(generation)
+
+    def get_samples_write_depth(self, out: np.ndarray = None):
+        """Get packet of samples write depth
+
+        Arguments:
+            out (np.ndarray): optional np.uint32 buffer to read the packet into
+        """
+        packet = self._write_depth_samples.get_rx_fifo_array(out)
         if self.verbose:
             print(f'samples_write_depth reported: {packet}')
         return packet
 
-    def get_timestamps_write_depth(self):
-        """Get packet of timestamps write depth"""
-        packet = self._write_depth_timestamps.get_rx_fifo_pkt()
+    def get_timestamps_write_depth(self, out: np.ndarray = None):
+        """Get packet of timestamps write depth
+
+        Arguments:
+            out (np.ndarray): optional np.uint32 buffer to read the packet into
+        """
+        packet = self._write_depth_timestamps.get_rx_fifo_array(out)
         if self.verbose:
             print(f'timestamps_write_depth reported: {packet}')
         return packet
 
     def get_dma_error(self):
-        """Get packet of AWG DMA error"""
-        return self._awg_dma_error.get_rx_fifo_pkt()
+        """Get packet of AWG DMA error
+
+        A failed upload is repeated by the next send_awg_data. If that call was skipped
+        because the buffer was unchanged, the status of the upload before it is returned.
+        """
+        packet = self._awg_dma_error.get_rx_fifo_pkt()
+        if len(packet) > 0:
+            self._awg_dma_status = packet
+            if packet[0] != 0 and self._awg is not None:
+                self._awg.upload_failed()
+        elif self._awg is not None and self._awg.last_skipped:
+            return self._awg_dma_status
+        return packet
     
     def start_capture(self):
         """Start capture buffer"""
@@ -320,11 +1230,15 @@ class DAQOverlay(Overlay):
         """Arm capture buffer, but don't start capture; wait for digital trigger"""
         self._capture_arm_start_stop.send_tx_pkt([0x4])
         
+    async def arm_capture_async(self):
+        """Awaitable version of arm_capture"""
+        await self._capture_arm_start_stop.send_tx_pkt_async([0x4])
+
     def stop_capture(self):
         """Stop capture buffer"""
         self._capture_arm_start_stop.send_tx_pkt([0x1])
 
-    def set_capture_channel_count(self, num_channels: int):
+    def set_capture_channel_count(self, num_channels: int, force: bool = False):
         """Set banking mode / channel count of capture buffer"""
         if num_channels not in [1,2,4,8]:
             raise ValueError(
@@ -336,21 +1250,26 @@ class DAQOverlay(Overlay):
         self._active_channels = num_channels
         if self.verbose:
             print(f'sending banking mode packet {banking_mode} to buffer_config.fifo')
-        self._capture_banking_mode.send_tx_pkt([banking_mode])
+        self._commit_config('capture_banking_mode', [banking_mode], 'capture_channel_count',
+                            {'num_channels': num_channels}, force)
 
     def reset_capture(self):
-        """Reset capture FSM; will require re-arming before capture can be triggered again"""
+        """Reset capture FSM; will require re-arming before capture can be triggered again
+
+        Also invalidates the configuration shadow, so every setting is resent afterwards.
+        """
         self._capture_sw_reset.send_tx_pkt([0x1])
+        self.invalidate_shadow()
         
     def reset_readout(self):
         """Reset readout FSM"""
-        self._capture_sw_reset.send_tx_pkt([0x1])
+        self._readout_sw_reset.send_tx_pkt([0x1])
 
     def start_readout(self):
         """Transition readout FSM from IDLE to ACTIVE"""
         self._readout_start.send_tx_pkt([0x1])
 
-    def configure_capture_trigger(self, mask: int, mode: str):
+    def configure_capture_trigger(self, mask: int, mode: str, force: bool = False):
         """Configure capture trigger manager
 
         Args:
@@ -365,11 +1284,13 @@ class DAQOverlay(Overlay):
                 f"invalid mask {hex(mask)} for number of channels {self._num_channels})"
             )
         packet = [(1 if mode.lower() == "and" else 0) << (self._num_channels + 1) | mask]
-        self._capture_trigger_config.send_tx_pkt(packet)
+        self._commit_config('capture_trigger_config', packet, 'capture_trigger',
+                            {'mask': mask, 'mode': mode}, force)
 
     def set_discriminator_thresholds(self,
                                      low_thresholds: list[int],
-                                     high_thresholds: list[int]):
+                                     high_thresholds: list[int],
+                                     force: bool = False):
         """Configure sample discriminator high/low thresholds
 
         Args:
@@ -394,12 +1315,15 @@ class DAQOverlay(Overlay):
             packet.append((high << self._sample_width) | low)
         if self.verbose:
             print(f'sending packet {packet} to discriminator_thresholds')
-        self._discriminator_thresholds.send_tx_pkt(packet)
+        self._commit_config('sample_discriminator_thresholds', packet, 'discriminator_thresholds',
+                            {'low_thresholds': list(low_thresholds),
+                             'high_thresholds': list(high_thresholds)}, force)
 
     def set_discriminator_delays(self,
                                  start_delays: list[int],
                                  stop_delays: list[int],
-                                 digital_delays: list[int]):
+                                 digital_delays: list[int],
+                                 force: bool = False):
         """Configure sample discriminator delays. Each word is 8 samples for 4096 MS/s
         ADC with 512 MHz data clock.
 
@@ -431,9 +1355,11 @@ class DAQOverlay(Overlay):
         packet = self._packetize(delay_word, (3 * timer_bits * self._num_channels + 31)//32)
         if self.verbose:
             print(f'sending packet {packet} to discriminator_delays')
-        self._discriminator_delays.send_tx_pkt(packet)
+        self._commit_config('sample_discriminator_delays', packet, 'discriminator_delays',
+                            {'start_delays': list(start_delays), 'stop_delays': list(stop_delays),
+                             'digital_delays': list(digital_delays)}, force)
 
-    def set_discriminator_event_sources(self, sources: list[int]):
+    def set_discriminator_event_sources(self, sources: list[int], force: bool = False):
         """Configure sample discriminator event sources.
 
         Args:
@@ -443,9 +1369,10 @@ class DAQOverlay(Overlay):
         packet = self._generate_mux_packet(sources, 2 * self._num_channels)
         if self.verbose:
             print(f'sending packet {packet} to discriminator_trigger_source')
-        self._discriminator_event_source.send_tx_pkt(packet)
+        self._commit_config('discriminator_trigger_source', packet, 'discriminator_event_sources',
+                            {'sources': list(sources)}, force)
 
-    def bypass_discriminators(self, bypass_mask: int):
+    def bypass_discriminators(self, bypass_mask: int, force: bool = False):
         """Disable sample discriminator and pass samples directly through.
 
         Args:
@@ -459,10 +1386,11 @@ class DAQOverlay(Overlay):
             )
         if self.verbose:
             print(f'sending packet {[bypass_mask]} to discrimininator_bypass')
-        self._discriminator_bypass.send_tx_pkt([bypass_mask])
+        self._commit_config('discriminator_bypass', [bypass_mask], 'discriminator_bypass',
+                            {'bypass_mask': bypass_mask}, force)
 
     # receive channel mux
-    def adc_mux_select(self, sources: list[int]):
+    def adc_mux_select(self, sources: list[int], force: bool = False):
         """Configure data sources for ADC channels.
 
         Args:
@@ -474,10 +1402,11 @@ class DAQOverlay(Overlay):
         packet = self._generate_mux_packet(sources, 2 * self._num_channels)
         if self.verbose:
             print(f'sending packet {packet} to receive_channel_mux')
-        self._receive_channel_mux.send_tx_pkt(packet)
+        self._commit_config('receive_channel_mux_config', packet, 'adc_mux',
+                            {'sources': list(sources)}, force)
 
     # VGA attenuation
-    def set_vga_atten_dB(self, atten_dB: list[float]):
+    def set_vga_atten_dB(self, atten_dB: list[float], force: bool = False):
         """Set attenuation (in dB) for variable gain amplifiers.
 
         Args:
@@ -485,6 +1414,7 @@ class DAQOverlay(Overlay):
                                         will be rounded to the nearest integer
         """
         self._check_list_length('atten_dB', atten_dB)
+        packets = []
         for channel, atten in enumerate(atten_dB):
             atten = round(atten)
             if atten < 0 or atten > 32:
@@ -493,17 +1423,38 @@ class DAQOverlay(Overlay):
                 )
             packet = 0x0200 | (atten & 0x3f) # address 0x02, 6-bit data atten_dB
             packet |= channel << 16 # address/channel ID is above 16-bit address+data
+            packets.append(packet)
+        for channel, packet in enumerate(packets):
             if self.verbose:
                 print(f'sending packet {packet} to lmh6401_config')
-            self._lmh6401_config.send_tx_pkt([packet])
+            # one register per amplifier, so each channel is shadowed separately
+            self._commit_config('lmh6401_config', [packet], 'vga_atten_dB',
+                                {'atten_dB': list(atten_dB)}, force, key=('lmh6401_config', channel))
 
-    def set_awg_frame_depth(self, depths: list[int]):
+    def set_awg_frame_depth(self, depths: list[int], force: bool = False):
         """Configure depth of AWG data frames.
 
         Arguments:
             depths (list[int]): for each channel, determine number of samples before
                                 AWG loops. DMA data must match this setting.
         """
+        self._commit_config('awg_frame_depth', self._awg_frame_depth_packet(depths), 'awg_frame_depth',
+                            {'depths': list(depths)}, force)
+        # a frame depth packet makes the AWG wait for a new transfer
+        self._invalidate_awg_upload()
+
+    def _invalidate_awg_upload(self):
+        """Make the next start_send upload the AWG buffer even if it is unchanged
+
+        The DAC side only latches the frame depths, burst lengths and trigger modes when
+        the frame depth packet sent with an upload is accepted, so a skipped upload would
+        leave new settings unused.
+        """
+        if self._awg is not None:
+            self._awg.invalidate()
+
+    def _awg_frame_depth_packet(self, depths: list[int]):
+        """Validate AWG frame depths and encode them into a packet"""
         frame_depth_word = 0
         depth_bits = clog2(self._awg_frame_depth_max)
         self._check_list_length('depths', depths)
@@ -514,9 +1465,9 @@ class DAQOverlay(Overlay):
         if self.verbose:
             print(f'sending frame_depth word = {hex(frame_depth_word)} to awg_frame_depth.fifo')
         expected_word_count = (depth_bits*self._num_channels + 31) // 32
-        self._awg_frame_depth.send_tx_pkt(self._packetize(frame_depth_word, expected_word_count))
+        return self._packetize(frame_depth_word, expected_word_count)
         
-    def set_awg_triggers(self, trigger_modes: list[int]):
+    def set_awg_triggers(self, trigger_modes: list[int], force: bool = False):
         """Configure trigger output of AWG.
 
         Arguments:
@@ -535,9 +1486,11 @@ class DAQOverlay(Overlay):
             trigger_word |= mode << (2*channel)
         if self.verbose:
             print(f'sending trigger_word {hex(trigger_word)} to awg_trigger_config.fifo')
-        self._awg_trigger_output_mode.send_tx_pkt([trigger_word])
+        if self._commit_config('awg_trigger_config', [trigger_word], 'awg_triggers',
+                               {'trigger_modes': list(trigger_modes)}, force) or self._transaction is not None:
+            self._invalidate_awg_upload()
 
-    def set_awg_burst_length(self, burst_lengths):
+    def set_awg_burst_length(self, burst_lengths, force: bool = False):
         """Configure AWG burst length in number of frames.
 
         Arguments:
@@ -551,7 +1504,9 @@ class DAQOverlay(Overlay):
             packet.append((burst_length >> 32) & ((1 << 32) - 1))
         if self.verbose:
             print(f'sending packet {packet} to awg_burst_length.fifo')
-        self._awg_burst_length.send_tx_pkt(packet)
+        if self._commit_config('awg_burst_length', packet, 'awg_burst_length',
+                               {'burst_lengths': list(burst_lengths)}, force) or self._transaction is not None:
+            self._invalidate_awg_upload()
 
     def start_awg(self):
         """Start AWG. Will send triggers to capture buffer if they have been configured"""
@@ -561,7 +1516,7 @@ class DAQOverlay(Overlay):
         """Stop AWG"""
         self._awg_start_stop.send_tx_pkt([1])
 
-    def set_dac_scale_offset(self, scales: list[float], offsets: list[float]):
+    def set_dac_scale_offset(self, scales: list[float], offsets: list[float], force: bool = False):
         """Set gain and offset correction for DAC output
 
         Args:
@@ -591,10 +1546,11 @@ class DAQOverlay(Overlay):
         if self.verbose:
             print(f'sending scale_word {hex(scale_offset_word)} to dac_scale_config.fifo')
         expected_word_count = (word_bits * self._num_channels + 31) // 32
-        self._dac_scale_offset.send_tx_pkt(self._packetize(scale_offset_word, expected_word_count))
+        self._commit_config('dac_scale_offset', self._packetize(scale_offset_word, expected_word_count),
+                            'dac_scale_offset', {'scales': list(scales), 'offsets': list(offsets)}, force)
 
     # DDS and triangle wave generators
-    def set_dds_freq(self, freqs_hz: list[float]):
+    def set_dds_freq(self, freqs_hz: list[float], force: bool = False):
         """Set frequency of DDS sinusoid generator
 
         Args:
@@ -603,9 +1559,9 @@ class DAQOverlay(Overlay):
         packet = self._generate_pinc_packet(freqs_hz, self._dds_phase_bits)
         if self.verbose:
             print(f'sending dds_phase_inc packet {packet}')
-        self._dds_phase_inc.send_tx_pkt(packet)
+        self._commit_config('dds_phase_inc', packet, 'dds_freq', {'freqs_hz': list(freqs_hz)}, force)
 
-    def set_tri_freq(freqs_hz):
+    def set_tri_freq(self, freqs_hz: list[float], force: bool = False):
         """Set frequency of triangle wave generator
 
         Args:
@@ -614,9 +1570,9 @@ class DAQOverlay(Overlay):
         packet = self._generate_pinc_packet(freqs_hz, self._tri_phase_bits)
         if self.verbose:
             print(f'sending tri_phase_inc packet {packet}')
-        self._tri_phase_inc.send_tx_pkt(packet)
+        self._commit_config('tri_phase_inc', packet, 'tri_freq', {'freqs_hz': list(freqs_hz)}, force)
         
-    def dac_mux_select(self, sources: list[int]):
+    def dac_mux_select(self, sources: list[int], force: bool = False):
         """Configure data sources for DAC channels.
 
         Args:
@@ -626,7 +1582,7 @@ class DAQOverlay(Overlay):
         packet = self._generate_mux_packet(sources, 3 * self._num_channels)
         if self.verbose:
             print(f'sending packet {packet} to transmit_channel_mux.fifo')
-        self._transmit_channel_mux.send_tx_pkt(packet)
+        self._commit_config('transmit_channel_mux', packet, 'dac_mux', {'sources': list(sources)}, force)
     
     def afe_power_status(self):
         """Get status of power rails.
@@ -651,57 +1607,64 @@ class DAQOverlay(Overlay):
         Returns:
             tvecs (list[array_like]): list of time vectors (units: seconds)
         """
-    
-        tvecs = []
-        index_bits = int(np.ceil(np.log2(self._adc_buffer_data_depth)))
-        index_mask = (1 << index_bits) - 1
-        # first get minimum t0
-        min_t0 = np.inf
-        for channel in channel_list:
-            if len(timestamps[channel]) > 0:
-                min_t0 = min(min_t0, int(timestamps[channel][0]) >> index_bits)
-        for channel in channel_list:
-            if len(timestamps[channel]) > 0:
-                tvec = np.empty(num_samples[channel])
-                tstamp = int(timestamps[channel][0])
-                overflow = 0
-                for n in range(len(timestamps[channel])):
-                    tstamp = int(timestamps[channel][n])
-                    toffset = ((tstamp >> index_bits) - min_t0) * self._adc_parallel_samples
-                    sample_index = (tstamp & index_mask) * self._adc_parallel_samples
-                    sample_index += overflow * (1 << index_bits) * self._adc_parallel_samples
-                    if n == len(timestamps[channel]) - 1:
-                        sample_index_next = len(tvec)
-                    else:
-                        tstamp = int(timestamps[channel][n + 1])
-                        sample_index_next = (tstamp & index_mask) * self._adc_parallel_samples
-                        sample_index_next += overflow * (1 << index_bits) * self._adc_parallel_samples
-                        if sample_index_next < sample_index:
-                            overflow += 1
-                            sample_index_next += (1 << index_bits) * self._adc_parallel_samples
-                    n_samples = sample_index_next - sample_index
-                    tvec[sample_index:sample_index_next] = (toffset + np.arange(n_samples))/self._adc_fsamp
-            else:
-                tvec = np.arange(num_samples[channel])/self._adc_fsamp
-            tvecs.append(tvec)
-        return tvecs
-    
+        return tvecs_from_timestamps(
+            channel_list,
+            timestamps,
+            num_samples,
+            clog2(self._adc_buffer_data_depth),
+            self._adc_parallel_samples,
+            self._adc_fsamp
+        )
+
+    def _get_time_axes(self,
+                       channel_list: list[int],
+                       timestamps: list[np.ndarray],
+                       num_samples: list[int]):
+        """Generate compact time axes from timestamp data
+
+        Arguments:
+            channel_list (list[int]): list of received channels
+            timestamps (list[array_like]): list of timestamp data for each channel
+            num_samples (list[int]): number of samples per channel
+
+        Returns:
+            time_axes (list[TimeAxis]): time axis for each channel in channel_list
+        """
+        return TimeAxis.for_channels(
+            channel_list,
+            timestamps,
+            num_samples,
+            clog2(self._adc_buffer_data_depth),
+            self._adc_parallel_samples,
+            self._adc_fsamp
+        )
+
     def plot_channels(self,
                       channel_list: list[int],
                       timestamps: list[np.ndarray],
-                      samples: list[np.ndarray]):
+                      samples: list[np.ndarray],
+                      decimate: bool = True):
         """Plot received data for specified channels
         
         Arguments:
             channel_list (list[int]): list of received channels to plot
             timestamps (list[array_like]): list of timestamp data for each channel
             samples (list[array_like]): list of sample data for each channel
+            decimate (bool): if True, only plot a min/max envelope of the visible samples,
+                                otherwise plot every visible sample. Either way, the
+                                line is recomputed when zooming
+
+        Returns:
+            lines (list[DecimatedLine]): line of each channel
         """
         fig, axes = plt.subplots(len(channel_list), 1, sharex=True, figsize=(12,8+0.5*len(channel_list)), dpi=90)
-        tvecs = self._get_tvecs_from_timestamps(channel_list, timestamps, [len(s) for s in samples])
-        for n, axis in enumerate(axes):
+        time_axes = self._get_time_axes(channel_list, timestamps, [len(s) for s in samples])
+        lines = []
+        for n, axis in enumerate(np.atleast_1d(axes)):
             channel = channel_list[n]
-            axis.plot(tvecs[n], np.int16(samples[channel])/2**15)
+            lines.append(DecimatedLine(axis, time_axes[n], np.asarray(samples[channel]).view(np.int16), yscale=1/2**15,
+                                       points_per_pixel=2 if decimate else None))
+        return lines
             
             
     def generate_pulse(self,
@@ -2,6 +2,9 @@ import time
 import numpy as np
 import matplotlib.pyplot as plt
 from rfsoc_daq_overlay import DAQOverlay, ns_to_samp, get_savefile, clog2
+from capture_store import CaptureStore
+from legacy_npz import open_store
+from envelope_plot import DecimatedLine
 
 class ShiftregTester(DAQOverlay):
     """Overlay for testing the shift register.
@@ -13,6 +16,25 @@ class ShiftregTester(DAQOverlay):
              verbose: bool = False,
              **kwargs):
         super().__init__(bitfile_name, verbose, **kwargs)
+        # open capture stores by run name
+        self._capture_stores = {}
+
+    def capture_store(self, run_name: str, mode: str = 'a'):
+        """Get the capture store data/<run_name>, opening it if necessary
+
+        Arguments:
+            run_name (str): name of the run, e.g. SPG717_single_sr0a
+            mode (str): 'a' to append, 'r' for read-only; read-only stores may also be
+                        legacy npz files, which are migrated on first use
+
+        Returns:
+            store (CaptureStore): store holding all captures of the run
+        """
+        store = self._capture_stores.get(run_name)
+        if store is None or (mode == 'a' and store.mode == 'r'):
+            store = CaptureStore(f'data/{run_name}') if mode == 'a' else open_store(f'data/{run_name}')
+            self._capture_stores[run_name] = store
+        return store
         
     def generate_shiftreg_pulses(self, pulse_param_ns):
         reallocate = False
@@ -33,20 +55,15 @@ class ShiftregTester(DAQOverlay):
         phi2_param_ns = pulse_param_ns.copy()
         phi1_param_ns[3] = 0
         phi2_param_ns[3] = pulse_param_ns[4]/2
-        phi1_pulse = self.generate_pulse(phi1_param_ns, self._dac_fsamp)
-        phi2_pulse = self.generate_pulse(phi2_param_ns, self._dac_fsamp)
         bitstring = np.random.randint(2, size=(num_pulses,))
-        self._awg_buffer[0:num_pulses*clock_period] = np.kron(bitstring, phi1_pulse)
-        for i in range(1, 4):
-            start = i*channel_size
-            end = start+num_pulses*clock_period
-            self._awg_buffer[start:end] = np.tile(phi1_pulse if i != 2 else phi2_pulse, num_pulses)
-            if i < 3:
-                # clear end pulses on input/clk1/clk2
-                self._awg_buffer[end-clock_period:end] = 0
-            else:
-                # clear beginning pulse on clkro
-                self._awg_buffer[start:start+clock_period] = 0
+        self.write_awg_prbs(0, phi1_param_ns, bitstring)
+        # clock trains only depend on the pulse parameters, so they are copied from the
+        # waveform cache and only uploaded when they change.
+        # no end pulses on input/clk1/clk2
+        self.write_awg_pulse_train(1, phi1_param_ns, num_pulses - 1)
+        self.write_awg_pulse_train(2, phi2_param_ns, num_pulses - 1)
+        # no beginning pulse on clkro
+        self.write_awg_pulse_train(3, phi1_param_ns, num_pulses, first_pulse=1)
         return bitstring
     
     def single_shiftreg_measurement(self,
@@ -74,11 +91,16 @@ class ShiftregTester(DAQOverlay):
             dac_bias_correction (list[float]): offset correction for DACs
             dac_scale_per_mV (list[float]): conversion between mV and full-scale input for amplitude of pulses
             
+        Captures are appended to the capture store data/SPG717_single_<expt_name>, with
+        the scalar settings saved once per distinct configuration.
+
         Returns:
-            savefile (str): name of file (located in data/) with saved data
+            savefile (str): <run name>/<capture number> of the saved capture, relative to data/
         """
         device_name = f'SPG717_single_{expt_name}'
         savefile = get_savefile(device_name)
+        # fail before acquiring rather than after, when the capture is appended
+        CaptureStore.check_label(savefile)
         active_channels = 2 ** clog2(len(adc_save_channels))
         if active_channels > self._num_channels:
             raise ValueError("can only save up to 8 channels")
@@ -92,35 +114,37 @@ class ShiftregTester(DAQOverlay):
         self.stop_awg() # stop the AWG to make sure we return to DMA_IDLE state
         self.reset_readout() # reset capture state machines
         self.reset_capture()
-        ### AWG setup ###
-        self.set_awg_triggers([1] + [0]*7) # set the trigger to output a 1 only at the beginning of a burst, only on channel 0
-        num_bursts = 64 # if num_bursts = 0, run for 2^64 - 1 cycles, basically forever
-        self.set_awg_burst_length([num_bursts]*8)
-        self.dac_mux_select([0,1,2,3,4,5,6,7])
         bitstring = self.generate_shiftreg_pulses(pulse_param_ns)
-        ### Set output amplitudes ####
-        # extra divide by 2 to correct for error in prescaler
-        self.set_dac_scale_offset(dac_scale_per_mV * np.array(dac_amplitudes_mV + [0]*4) / 2, dac_bias_correction)
-        ### Set up capture buffer ###
-        self.set_capture_channel_count(active_channels)
-        self.adc_mux_select(adc_save_channels+[0]*(self._num_channels - len(adc_save_channels))) # ADC0, ADC1, ADC2, diff(ADC2)
-        self.bypass_discriminators(0x0) # don't bypass any discriminators
-        self.set_discriminator_thresholds(
-            discriminator_thresholds[0] + [0]*(self._num_channels - len(discriminator_thresholds[0])),
-            discriminator_thresholds[1] + [0]*(self._num_channels - len(discriminator_thresholds[1]))
-        )
-        self.set_discriminator_delays(
-            discriminator_delays[0] + [0]*(self._num_channels - len(discriminator_delays[0])),
-            discriminator_delays[1] + [0]*(self._num_channels - len(discriminator_delays[1])),
-            [0]*8
-        )
-        self.set_discriminator_event_sources(
-            discriminator_sources+[0]*(self._num_channels - len(discriminator_sources))
-        )
-        # set capture to trigger from AWG channel 0 only
-        self.configure_capture_trigger(0x1, 'or')
+        # validate everything before touching hardware, then write all registers at once
+        with self.configure() as cfg:
+            ### AWG setup ###
+            cfg.set_awg_triggers([1] + [0]*7) # set the trigger to output a 1 only at the beginning of a burst, only on channel 0
+            num_bursts = 64 # if num_bursts = 0, run for 2^64 - 1 cycles, basically forever
+            cfg.set_awg_burst_length([num_bursts]*8)
+            cfg.dac_mux_select([0,1,2,3,4,5,6,7])
+            ### Set output amplitudes ####
+            # extra divide by 2 to correct for error in prescaler
+            cfg.set_dac_scale_offset(dac_scale_per_mV * np.array(dac_amplitudes_mV + [0]*4) / 2, dac_bias_correction)
+            ### Set up capture buffer ###
+            cfg.set_capture_channel_count(active_channels)
+            cfg.adc_mux_select(adc_save_channels+[0]*(self._num_channels - len(adc_save_channels))) # ADC0, ADC1, ADC2, diff(ADC2)
+            cfg.bypass_discriminators(0x0) # don't bypass any discriminators
+            cfg.set_discriminator_thresholds(
+                discriminator_thresholds[0] + [0]*(self._num_channels - len(discriminator_thresholds[0])),
+                discriminator_thresholds[1] + [0]*(self._num_channels - len(discriminator_thresholds[1]))
+            )
+            cfg.set_discriminator_delays(
+                discriminator_delays[0] + [0]*(self._num_channels - len(discriminator_delays[0])),
+                discriminator_delays[1] + [0]*(self._num_channels - len(discriminator_delays[1])),
+                [0]*8
+            )
+            cfg.set_discriminator_event_sources(
+                discriminator_sources+[0]*(self._num_channels - len(discriminator_sources))
+            )
+            # set capture to trigger from AWG channel 0 only
+            cfg.configure_capture_trigger(0x1, 'or')
+            cfg.set_vga_atten_dB(adc_atten_dB)
         self.arm_capture()
-        self.set_vga_atten_dB(adc_atten_dB)
         ### Start capture ###
         self.send_awg_data()
         self.start_awg()
@@ -130,28 +154,39 @@ class ShiftregTester(DAQOverlay):
             print(f'AWG DMA transfer exit code = {dma_exit_code}')
         self.stop_capture()
         self.start_readout()
-        write_depths = self.receive_adc_data(False)
-        timestamps, samples = self.get_samples_and_timestamps_from_adc_data(write_depths)
-        np.savez(f'data/{savefile}',
-                 awg_buffer=self._awg_buffer,
-                 bitstring=bitstring,
-                 timestamps=np.asarray(timestamps, dtype=object),
-                 samples=np.asarray(samples, dtype=object),
-                 active_channels=active_channels,
-                 discriminator_thresholds=discriminator_thresholds,
-                 discriminator_delays=discriminator_delays,
-                 discriminator_sources=discriminator_sources,
-                 dac_amplitudes_mV=dac_amplitudes_mV,
-                 pulse_param_ns=pulse_param_ns,
-                 adc_atten_dB=adc_atten_dB,
-                 dac_bias_correction=dac_bias_correction,
-                 dac_scale_per_mV=dac_scale_per_mV,
+        # the buffer is reassembled and stored right away, so the transfer has to be complete
+        write_depths = self.receive_adc_data(False, wait=True)
+        # only reassemble the channels being saved; views are fine since they're written out immediately
+        timestamps, samples = self.reassemble_adc_data(write_depths, range(len(adc_save_channels)))
+        capture = self.capture_store(device_name).append(
+            {
+                'awg_buffer': self._awg_buffer,
+                'bitstring': bitstring,
+                'timestamps': timestamps,
+                'samples': samples,
+            },
+            config={
+                'adc_save_channels': adc_save_channels,
+                'active_channels': active_channels,
+                'discriminator_thresholds': discriminator_thresholds,
+                'discriminator_delays': discriminator_delays,
+                'discriminator_sources': discriminator_sources,
+                'dac_amplitudes_mV': dac_amplitudes_mV,
+                'pulse_param_ns': pulse_param_ns,
+                'adc_atten_dB': adc_atten_dB,
+                'dac_bias_correction': dac_bias_correction,
+                'dac_scale_per_mV': dac_scale_per_mV,
+            },
+            label=savefile,
         )
-        return savefile
+        return f'{device_name}/{capture}'
  
     def plot_shiftreg_experiment(self, savefile: str, t0: float, trange: list[float]):
-        f = np.load(f'data/{savefile}.npz', allow_pickle=True)
-        active_channels = f['active_channels']
+        # legacy savefiles hold a single capture
+        run_name, _, capture = savefile.partition('/')
+        # only map the fields and channels that are plotted
+        f = self.capture_store(run_name, 'r').read(int(capture or 0), ['awg_buffer', 'timestamps', 'samples'], range(4))
+        config = f['config']
         fig, ax = plt.subplots(2,1,sharex=True,figsize=(12,8),dpi=90)
         dac_channel_size = self._dac_parallel_samples*self._awg_frame_depth_max
         tvec_awg = np.linspace(0,dac_channel_size/self._dac_fsamp,dac_channel_size,endpoint=False)
@@ -159,33 +194,34 @@ class ShiftregTester(DAQOverlay):
         dac_labels = ["input", "clk1", "clk2", "clkro"]
         for channel in range(4):
             data = awg_buffer[channel*dac_channel_size:(channel+1)*dac_channel_size]
-            ax[0].plot(t0*1e6 + tvec_awg*1e6, 0.8 * (data/2**15) - channel, label=dac_labels[channel])
+            DecimatedLine(ax[0], t0*1e6 + tvec_awg*1e6, data, yscale=0.8/2**15, yoffset=-channel, label=dac_labels[channel])
         ax[0].legend()
         
         timestamps = f['timestamps']
         samples = f['samples']
-        tvecs = self._get_tvecs_from_timestamps([0,1,2,3], timestamps, [len(s) for s in samples])
+        time_axes = self._get_time_axes([0,1,2,3], timestamps, [len(s) for s in samples])
         adc_labels = ["shunt1", "shunt2", "output", "ch4"]
         yoffset = 0
         prev_min = 0
         for channel in range(4):
             if len(samples[channel]) == 0:
                 continue
-            data = np.int16(samples[channel])/2**15
-            yoffset += np.max(data - yoffset) - prev_min
-            data -= 1.1*yoffset
-            prev_min = np.min(data)
-            ax[1].plot(tvecs[channel]*1e6, data, '.', alpha=0.2, label=adc_labels[channel])
+            # envelope of the visible samples is recomputed when zooming
+            data = samples[channel].view(np.int16)
+            yoffset += data.max()/2**15 - yoffset - prev_min
+            prev_min = data.min()/2**15 - 1.1*yoffset
+            DecimatedLine(ax[1], time_axes[channel], data, '.', scale=1e6, yscale=1/2**15, yoffset=-1.1*yoffset,
+                          alpha=0.2, label=adc_labels[channel])
         ax[1].legend(loc='lower right')
         ax[0].set_xlim(trange[0], trange[1])
         ax[1].set_xlabel('t [us]')
         titlestr = f"""{savefile}
-        input, clk1, clk2, clkro amplitudes (uA) = {f['dac_amplitudes_mV']/1e3/50*1e6}
-        thresholds_low = {f['discriminator_thresholds'][0]}
-        thresholds_high = {f['discriminator_thresholds'][1]}
-        delays_start = {f['discriminator_delays'][0]}
-        delays_stop = {f['discriminator_delays'][1]}
+        input, clk1, clk2, clkro amplitudes (uA) = {np.array(config['dac_amplitudes_mV'])/1e3/50*1e6}
+        thresholds_low = {config['discriminator_thresholds'][0]}
+        thresholds_high = {config['discriminator_thresholds'][1]}
+        delays_start = {config['discriminator_delays'][0]}
+        delays_stop = {config['discriminator_delays'][1]}
         """
         fig.suptitle(titlestr)
         plt.tight_layout()
-        plt.savefig(f'figures/{savefile}.png')
\ No newline at end of file
+        plt.savefig(f'figures/{f["label"]}.png')
\ No newline at end of file
@@ -0,0 +1,412 @@
+import time
+import numpy as np
+
+def _first_tick(timestamps: list[np.ndarray], channel_list: list[int], index_bits: int):
+    """Smallest capture time (in ADC clock cycles) of the first timestamp over all channels"""
+    first = [int(timestamps[channel][0]) >> index_bits for channel in channel_list if len(timestamps[channel]) > 0]
+    return min(first) if len(first) > 0 else 0
+
+def timestamp_segments(tstamps: np.ndarray, index_bits: int, parallel_samples: int, t0: int):
+    """Decode the timestamps of one channel into the runs of samples they describe
+
+    Each timestamp holds the capture time in ADC clock cycles above index_bits, and
+    the sample buffer write address at that time in the low index_bits. Addresses wrap
+    every 2**index_bits words, which is detected as a decrease between consecutive
+    timestamps.
+
+    Arguments:
+        tstamps (np.ndarray): uint64 timestamps of one channel
+        index_bits (int): number of bits of the sample buffer address
+        parallel_samples (int): samples per ADC clock cycle / buffer word
+        t0 (int): capture time (ADC clock cycles) to use as time zero
+
+    Returns:
+        starts (np.ndarray): int64 index of the first sample of each run
+        ticks (np.ndarray): int64 time (in samples since t0) of the first sample of each run
+    """
+    tstamps = np.asarray(tstamps, dtype=np.uint64)
+    index = (tstamps & np.uint64((1 << index_bits) - 1)).astype(np.int64)
+    overflow = np.zeros(len(index), dtype=np.int64)
+    np.cumsum(np.diff(index) < 0, out=overflow[1:])
+    starts = (index + overflow * (1 << index_bits)) * parallel_samples
+    ticks = ((tstamps >> np.uint64(index_bits)).astype(np.int64) - t0) * parallel_samples
+    return starts, ticks
+
+def tvecs_from_timestamps(channel_list: list[int],
+                          timestamps: list[np.ndarray],
+                          num_samples: list[int],
+                          index_bits: int,
+                          parallel_samples: int,
+                          fsamp: float):
+    """Generate per-sample time vectors from timestamp data
+
+    Arguments:
+        channel_list (list[int]): list of received channels
+        timestamps (list[array_like]): list of timestamp data for each channel
+        num_samples (list[int]): number of samples per channel
+        index_bits (int): number of bits of the sample buffer address
+        parallel_samples (int): samples per ADC clock cycle / buffer word
+        fsamp (float): sample rate in Hz
+
+    Returns:
+        tvecs (list[array_like]): time vector (units: seconds) for each channel in channel_list
+    """
+    tvecs = []
+    t0 = _first_tick(timestamps, channel_list, index_bits)
+    for channel in channel_list:
+        if len(timestamps[channel]) == 0:
+            tvecs.append(np.arange(num_samples[channel])/fsamp)
+            continue
+        tvec = np.empty(num_samples[channel])
+        starts, ticks = timestamp_segments(timestamps[channel], index_bits, parallel_samples, t0)
+        # each run extends to the start of the next one, the last run to the end of the samples
+        stops = np.minimum(np.append(starts[1:], num_samples[channel]), num_samples[channel])
+        lengths = np.maximum(stops - starts, 0)
+        first = starts[0]
+        last = first + lengths.sum()
+        tvec[first:last] = (np.repeat(ticks - starts, lengths) + np.arange(first, last))/fsamp
+        tvecs.append(tvec)
+    return tvecs
+
+class TimeAxis:
+    """Compact time axis of one channel of a sparse capture
+
+    Rather than storing one float64 time per sample, the axis is stored as runs of
+    consecutive samples: run k starts at sample starts[k], was captured t0_cycles[k]
+    ADC clock cycles after time zero, and is lengths[k] samples long. Times are only
+    evaluated for the samples that are asked for.
+
+    Samples before the first run are assigned to the first run, as are samples after
+    the last run to the last run.
+
+    Attributes:
+        starts (np.ndarray): int64 index of the first sample of each run
+        t0_cycles (np.ndarray): int64 ADC clock cycle of the first sample of each run
+        lengths (np.ndarray): int64 number of samples in each run
+        parallel_samples (int): samples per ADC clock cycle
+        fsamp (float): sample rate in Hz
+    """
+    def __init__(self,
+                 starts: np.ndarray,
+                 t0_cycles: np.ndarray,
+                 num_samples: int,
+                 parallel_samples: int,
+                 fsamp: float):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.t0_cycles = np.asarray(t0_cycles, dtype=np.int64)
+        self.parallel_samples = parallel_samples
+        self.fsamp = fsamp
+        self._num_samples = num_samples
+        stops = np.minimum(np.append(self.starts[1:], num_samples), num_samples)
+        self.lengths = np.maximum(stops - self.starts, 0)
+        # time of the first sample of each run, minus its index
+        self._tick_offsets = self.t0_cycles * parallel_samples - self.starts
+
+    @classmethod
+    def from_timestamps(cls,
+                        tstamps: np.ndarray,
+                        num_samples: int,
+                        index_bits: int,
+                        parallel_samples: int,
+                        fsamp: float,
+                        t0: int = None):
+        """Build the time axis of one channel from its timestamps
+
+        Arguments:
+            tstamps (np.ndarray): uint64 timestamps of the channel
+            num_samples (int): number of samples of the channel
+            index_bits (int): number of bits of the sample buffer address
+            parallel_samples (int): samples per ADC clock cycle / buffer word
+            fsamp (float): sample rate in Hz
+            t0 (int): ADC clock cycle to use as time zero, defaults to the first timestamp.
+                        Channels without timestamps start at zero
+        """
+        if len(tstamps) == 0:
+            return cls(np.zeros(1), np.zeros(1), num_samples, parallel_samples, fsamp)
+        if t0 is None:
+            t0 = int(tstamps[0]) >> index_bits
+        starts, ticks = timestamp_segments(tstamps, index_bits, parallel_samples, t0)
+        return cls(starts, ticks // parallel_samples, num_samples, parallel_samples, fsamp)
+
+    @classmethod
+    def for_channels(cls,
+                     channel_list: list[int],
+                     timestamps: list[np.ndarray],
+                     num_samples: list[int],
+                     index_bits: int,
+                     parallel_samples: int,
+                     fsamp: float):
+        """Build time axes for several channels with a common time zero
+
+        Arguments are the same as tvecs_from_timestamps.
+
+        Returns:
+            time_axes (list[TimeAxis]): time axis for each channel in channel_list
+        """
+        t0 = _first_tick(timestamps, channel_list, index_bits)
+        return [
+            cls.from_timestamps(timestamps[channel], num_samples[channel], index_bits, parallel_samples, fsamp, t0)
+            for channel in channel_list
+        ]
+
+    def __len__(self):
+        return self._num_samples
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.t0_cycles.nbytes + self.lengths.nbytes + self._tick_offsets.nbytes
+
+    def _bounds(self, start: int, stop: int):
+        start = 0 if start is None else start
+        stop = self._num_samples if stop is None else stop
+        if start < 0 or stop > self._num_samples or start > stop:
+            raise IndexError(f'invalid sample range [{start}, {stop}) for {self._num_samples} samples')
+        return start, stop
+
+    def ticks(self, start: int = None, stop: int = None):
+        """Time of samples [start, stop) in units of samples since time zero
+
+        Returns:
+            ticks (np.ndarray): int64 sample ticks
+        """
+        start, stop = self._bounds(start, stop)
+        if start == stop:
+            return np.empty(0, dtype=np.int64)
+        # the run containing a sample is the last one starting at or before it
+        first = max(int(np.searchsorted(self.starts, start, 'right')) - 1, 0)
+        last = max(int(np.searchsorted(self.starts, stop - 1, 'right')) - 1, 0) + 1
+        bounds = np.clip(self.starts[first + 1:last], start, stop)
+        lengths = np.diff(np.concatenate(([start], bounds, [stop])))
+        # ticks step by one within a run and jump between runs: accumulate the steps in
+        # place, so the only per-sample array is the result
+        offsets = self._tick_offsets[first:last]
+        ticks = np.ones(stop - start, dtype=np.int64)
+        ticks[0] = offsets[0] + start
+        np.add.at(ticks, np.cumsum(lengths[:-1]), np.diff(offsets))
+        np.cumsum(ticks, out=ticks)
+        return ticks
+
+    def seconds(self, start: int = None, stop: int = None, dtype=np.float64, scale: float = 1.0):
+        """Time of samples [start, stop) in seconds
+
+        Arguments:
+            dtype: np.float64 or np.float32
+            scale (float): multiply times by scale, e.g. 1e6 for microseconds
+
+        Returns:
+            t (np.ndarray): times with the requested dtype
+        """
+        ticks = self.ticks(start, stop)
+        # divided straight into the result, so float32 never goes through a float64 copy
+        t = np.divide(ticks, self.fsamp, out=np.empty(len(ticks), dtype=dtype), casting='unsafe')
+        if scale != 1.0:
+            t *= scale
+        return t
+
+    def indices(self, t_start: float, t_stop: float, scale: float = 1.0):
+        """Range of samples with times in [t_start, t_stop]
+
+        Assumes runs were captured in order, i.e. times increase with the sample index.
+
+        Arguments:
+            t_start, t_stop (float): time range in seconds times scale
+            scale (float): scale of the times, e.g. 1e6 for microseconds
+
+        Returns:
+            start, stop (int): sample range [start, stop)
+        """
+        # the first run also covers the samples before it
+        run_first = np.append(0, self.starts[1:])
+        run_stops = self.starts + self.lengths
+        # runs without samples (repeated buffer addresses) would shadow the run after them
+        nonempty = run_stops > run_first
+        if not nonempty.any():
+            return 0, 0
+        run_first = run_first[nonempty]
+        run_stops = run_stops[nonempty]
+        run_ticks = self._tick_offsets[nonempty] + run_first
+        bounds = []
+        for t, first_after in ((t_start, False), (t_stop, True)):
+            tick = t * self.fsamp / scale
+            run = max(int(np.searchsorted(run_ticks, tick, 'right')) - 1, 0)
+            offset = np.floor(tick - run_ticks[run]) + 1 if first_after else np.ceil(tick - run_ticks[run])
+            bounds.append(int(np.clip(run_first[run] + offset, run_first[run], run_stops[run])))
+        return bounds[0], max(bounds)
+
+    def ticks_at(self, index: np.ndarray):
+        """Time of arbitrary samples in units of samples since time zero
+
+        Arguments:
+            index (np.ndarray): sample indices, each in [0, len(self))
+
+        Returns:
+            ticks (np.ndarray): int64 sample ticks
+        """
+        index = np.asarray(index, dtype=np.int64)
+        if index.size > 0 and (index.min() < 0 or index.max() >= self._num_samples):
+            raise IndexError(f'sample index out of range for {self._num_samples} samples')
+        run = np.maximum(np.searchsorted(self.starts, index, 'right') - 1, 0)
+        return self._tick_offsets[run] + index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._num_samples)
+            if step == 1:
+                return self.seconds(start, max(start, stop))
+            # only evaluate the samples that are picked, in either direction
+            return self.ticks_at(np.arange(start, stop, step)) / self.fsamp
+        index = index + self._num_samples if index < 0 else index
+        return self.seconds(index, index + 1)[0]
+
+    def __array__(self, dtype=None, copy=None):
+        # lets numpy consume the axis directly; this materializes every sample, so
+        # plotting code should ask for the visible range with seconds(start, stop) instead
+        if copy is False:
+            raise ValueError('TimeAxis cannot be converted to an array without a copy')
+        return self.seconds(dtype=np.float64 if dtype is None else dtype)
+
+def _tvecs_from_timestamps_loop(channel_list: list[int],
+                                timestamps: list[np.ndarray],
+                                num_samples: list[int],
+                                index_bits: int,
+                                parallel_samples: int,
+                                fsamp: float):
+    """Reference per-timestamp implementation of tvecs_from_timestamps, used for benchmarking"""
+    tvecs = []
+    index_mask = (1 << index_bits) - 1
+    # first get minimum t0
+    min_t0 = np.inf
+    for channel in channel_list:
+        if len(timestamps[channel]) > 0:
+            min_t0 = min(min_t0, int(timestamps[channel][0]) >> index_bits)
+    for channel in channel_list:
+        if len(timestamps[channel]) > 0:
+            tvec = np.empty(num_samples[channel])
+            tstamp = int(timestamps[channel][0])
+            overflow = 0
+            for n in range(len(timestamps[channel])):
+                tstamp = int(timestamps[channel][n])
+                toffset = ((tstamp >> index_bits) - min_t0) * parallel_samples
+                sample_index = (tstamp & index_mask) * parallel_samples
+                sample_index += overflow * (1 << index_bits) * parallel_samples
+                if n == len(timestamps[channel]) - 1:
+                    sample_index_next = len(tvec)
+                else:
+                    tstamp = int(timestamps[channel][n + 1])
+                    sample_index_next = (tstamp & index_mask) * parallel_samples
+                    sample_index_next += overflow * (1 << index_bits) * parallel_samples
+                    if sample_index_next < sample_index:
+                        overflow += 1
+                        sample_index_next += (1 << index_bits) * parallel_samples
+                n_samples = sample_index_next - sample_index
+                tvec[sample_index:sample_index_next] = (toffset + np.arange(n_samples))/fsamp
+        else:
+            tvec = np.arange(num_samples[channel])/fsamp
+        tvecs.append(tvec)
+    return tvecs
+
+def random_timestamps(num_timestamps: int,
+                      num_samples: int,
+                      index_bits: int,
+                      parallel_samples: int,
+                      t_start: int = 1 << 20,
+                      rng: np.random.Generator = None):
+    """Generate timestamps for a sparse capture of num_samples samples
+
+    The capture is split into num_timestamps runs of random length, separated by
+    random gaps in time, with buffer addresses that wrap like the hardware.
+
+    Returns:
+        timestamps (np.ndarray): uint64 timestamps
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    num_words = num_samples // parallel_samples
+    boundaries = np.sort(rng.choice(np.arange(1, num_words), num_timestamps - 1, replace=False))
+    word_index = np.concatenate(([0], boundaries)).astype(np.uint64)
+    run_words = np.diff(np.append(word_index, num_words))
+    cycle = t_start + np.cumsum(np.append(0, run_words[:-1] + rng.integers(1, 1000, num_timestamps - 1)))
+    index = word_index & np.uint64((1 << index_bits) - 1)
+    return (cycle.astype(np.uint64) << np.uint64(index_bits)) | index
+
+def benchmark_tvecs(num_channels: int = 8,
+                    num_timestamps: int = 512,
+                    num_samples: int = 4096 * 8,
+                    index_bits: int = 12,
+                    parallel_samples: int = 8,
+                    fsamp: float = 4.096e9,
+                    repeats: int = 5):
+    """Compare the vectorized time vector reconstruction against the per-timestamp loop
+
+    Also checks that both produce bit-identical output.
+
+    Returns:
+        times (dict): seconds per call for 'loop' and 'vectorized', and their ratio as 'speedup'
+    """
+    rng = np.random.default_rng(0)
+    channel_list = list(range(num_channels))
+    timestamps = [random_timestamps(num_timestamps, num_samples, index_bits, parallel_samples, rng=rng)
+                  for _ in channel_list]
+    lengths = [num_samples]*num_channels
+    args = (channel_list, timestamps, lengths, index_bits, parallel_samples, fsamp)
+    times = {}
+    for name, func in (('loop', _tvecs_from_timestamps_loop), ('vectorized', tvecs_from_timestamps)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            tvecs = func(*args)
+        times[name] = (time.perf_counter() - start) / repeats
+        if name == 'loop':
+            reference = tvecs
+    for expected, actual in zip(reference, tvecs):
+        if not np.array_equal(expected.view(np.uint64), actual.view(np.uint64)):
+            raise AssertionError('vectorized time vectors differ from loop implementation')
+    times['speedup'] = times['loop'] / times['vectorized']
+    return times
+
+def check_time_axis_indices(num_captures: int = 200,
+                            windows: int = 50,
+                            num_samples: int = 4096,
+                            index_bits: int = 8,
+                            parallel_samples: int = 8,
+                            fsamp: float = 4.096e9,
+                            scale: float = 1e6):
+    """Compare TimeAxis.indices against a brute force search over the materialized axis
+
+    Some timestamps are preceded by one at the same buffer address, which gives runs
+    without samples, as the hardware produces when it records two timestamps at one
+    address. The time of an empty run is anywhere after the start of the run before it.
+
+    Returns:
+        checked (int): number of windows checked
+    """
+    rng = np.random.default_rng(1)
+    checked = 0
+    for _ in range(num_captures):
+        num_timestamps = int(rng.integers(1, 64))
+        tstamps = random_timestamps(num_timestamps, num_samples, index_bits, parallel_samples, rng=rng)
+        tstamps = np.repeat(tstamps, 1 + rng.integers(0, 3, num_timestamps))
+        cycles = (tstamps >> np.uint64(index_bits)).astype(np.int64)
+        for n in np.flatnonzero(tstamps[:-1] == tstamps[1:])[::-1]:
+            cycles[n] = rng.integers(cycles[max(n - 1, 0)], cycles[n + 1] + 1)
+        index = tstamps & np.uint64((1 << index_bits) - 1)
+        tstamps = (cycles.astype(np.uint64) << np.uint64(index_bits)) | index
+        axis = TimeAxis.from_timestamps(tstamps, num_samples, index_bits, parallel_samples, fsamp)
+        t = axis.seconds(scale=scale)
+        for a, b in np.sort(rng.uniform(t[0] - 0.01, t[-1] + 0.01, (windows, 2)), axis=1):
+            inside = np.flatnonzero((t >= a) & (t <= b))
+            start, stop = axis.indices(a, b, scale)
+            if len(inside) > 0:
+                expected = (inside[0], inside[-1] + 1)
+                ok = (start, stop) == expected
+            else:
+                ok = start == stop
+            if not ok:
+                raise AssertionError(f'indices({a}, {b}) returned {(start, stop)} for samples {inside}')
+            checked += 1
+    return checked
+
+if __name__ == '__main__':
+    print(f"TimeAxis.indices matches brute force on {check_time_axis_indices()} windows")
+    for num_timestamps in (16, 128, 512):
+        times = benchmark_tvecs(num_timestamps=num_timestamps)
+        print(f"{num_timestamps:4d} timestamps/channel: loop {times['loop']*1e3:8.2f} ms, "
+              f"vectorized {times['vectorized']*1e3:8.2f} ms, speedup {times['speedup']:6.1f}x")